@@ -1,11 +1,36 @@
+import time
+
+# 起動時間の計測（インポート開始時刻）
+_import_started = time.perf_counter()
+
 import os
+import io
+import json
+import threading
+import base64
+import tempfile
+import tarfile
+import zipfile
 import cv2
 import numpy as np
-from flask import Flask, request, render_template, send_from_directory, jsonify
+from flask import Flask, Response, g, request, render_template, send_file, jsonify, abort, stream_with_context, url_for
 from werkzeug.utils import secure_filename
-from ultralytics import YOLO
 import uuid
-from PIL import Image
+import functools
+from contextlib import ExitStack
+from concurrent.futures import as_completed
+from batching import BatchScheduler, QueueFullError
+from storage import LocalStorage, MemoryResultStore, S3Storage, StorageReaper, host_lock_path
+from cache import DetectionCache, make_cache_key
+from video import FrameReader, FpsMeter, iter_frame_batches
+from backends import describe_model, load_model, result_array
+from worker_pool import InferencePool
+from jobs import FINISHED_STATUSES, JobRunner, JobStore
+from metrics import MetricsRegistry, SamplingProfiler, SpanRecorder
+from model_selection import QUALITY_TIERS, ModelSelector
+from preprocess import (
+    decode_image, decode_region, downscale, draw_detections, filter_detections, image_size, merge_detections, split_tiles
+)
 
 app = Flask(__name__)
 
@@ -18,8 +43,176 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 最大ファイルサイ
 # アップロードディレクトリが存在しない場合は作成
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# ディスクを使わないインメモリモード（入力は保存せず、結果画像はメモリ上のストアに保持）
+IN_MEMORY_UPLOADS = os.getenv('IN_MEMORY_UPLOADS', '0') == '1'
+RESULT_STORE_MAX_ENTRIES = int(os.getenv('RESULT_STORE_MAX_ENTRIES', '256'))
+RESULT_STORE_MAX_MB = int(os.getenv('RESULT_STORE_MAX_MB', '256'))
+
+IMAGE_MIMETYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+# 注釈付き画像の描画モード（none: 検出結果のJSONのみ / lazy: 初回の取得時に描画 / eager: 検出時に描画）
+RENDER_MODES = ('none', 'lazy', 'eager')
+RENDER_MODE = os.getenv('RENDER_MODE', 'eager')  # ?render= で上書き可能
+OUTPUT_FORMAT = os.getenv('OUTPUT_FORMAT', '')  # jpeg / webp / png（空の場合は入力と同じ形式）
+OUTPUT_QUALITY = int(os.getenv('OUTPUT_QUALITY', '90'))  # JPEG・WebPの品質（1〜100）
+OUTPUT_MAX_DIMENSION = int(os.getenv('OUTPUT_MAX_DIMENSION', '0'))  # 注釈付き画像の長辺の上限（0 で無制限）
+
+# 動画検出の設定
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv'}
+VIDEO_FRAME_SKIP = int(os.getenv('VIDEO_FRAME_SKIP', '1'))  # Nフレームごとに1フレームを推論
+VIDEO_QUEUE_SIZE = int(os.getenv('VIDEO_QUEUE_SIZE', '32'))  # デコード済みフレームのキュー上限
+
+result_store = MemoryResultStore(
+    max_entries=RESULT_STORE_MAX_ENTRIES,
+    max_bytes=RESULT_STORE_MAX_MB * 1024 * 1024
+)
+
+# アップロード・結果ファイルの保存先（local: ハッシュで分散したディレクトリ / s3: S3互換ストレージ）
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+STORAGE_S3_BUCKET = os.getenv('STORAGE_S3_BUCKET', '')
+STORAGE_S3_ENDPOINT = os.getenv('STORAGE_S3_ENDPOINT', '')  # MinIOなどS3互換ストレージのURL
+STORAGE_S3_PREFIX = os.getenv('STORAGE_S3_PREFIX', 'uploads/')
+STORAGE_TTL_SECONDS = float(os.getenv('STORAGE_TTL_SECONDS', '86400'))  # 0 で無期限
+STORAGE_MAX_MB = int(os.getenv('STORAGE_MAX_MB', '5120'))  # 合計容量の上限（0 で無制限）
+STORAGE_REAP_INTERVAL = float(os.getenv('STORAGE_REAP_INTERVAL', '300'))
+
+if STORAGE_BACKEND == 's3':
+    storage = S3Storage(STORAGE_S3_BUCKET, prefix=STORAGE_S3_PREFIX, endpoint_url=STORAGE_S3_ENDPOINT)
+else:
+    storage = LocalStorage(UPLOAD_FOLDER)
+
+storage_reaper = StorageReaper(
+    storage,
+    ttl=STORAGE_TTL_SECONDS,
+    max_bytes=STORAGE_MAX_MB * 1024 * 1024,
+    interval=STORAGE_REAP_INTERVAL,
+    # 同じホストの gunicorn のワーカーのうち1つだけが削除を行う
+    lock_path=host_lock_path(
+        f's3:{STORAGE_S3_ENDPOINT}/{STORAGE_S3_BUCKET}/{STORAGE_S3_PREFIX}' if STORAGE_BACKEND == 's3' else os.path.abspath(UPLOAD_FOLDER)
+    )
+)
+
+# 検出結果キャッシュの設定（同一画像の再アップロード時に推論をスキップ）
+DETECTION_CACHE_ENABLED = os.getenv('DETECTION_CACHE_ENABLED', '1') == '1'
+DETECTION_CACHE_MAX_ENTRIES = int(os.getenv('DETECTION_CACHE_MAX_ENTRIES', '512'))
+DETECTION_CACHE_MAX_MB = int(os.getenv('DETECTION_CACHE_MAX_MB', '256'))
+DETECTION_CACHE_DIR = os.getenv('DETECTION_CACHE_DIR', '')  # 指定時のみディスク層を有効化
+DETECTION_CACHE_DISK_MAX_MB = int(os.getenv('DETECTION_CACHE_DISK_MAX_MB', '1024'))  # ディスク層の合計容量の上限（0 で無制限）
+DETECTION_CACHE_DISK_TTL_SECONDS = float(os.getenv('DETECTION_CACHE_DISK_TTL_SECONDS', '604800'))  # 0 で無期限
+
+detection_cache = DetectionCache(
+    max_entries=DETECTION_CACHE_MAX_ENTRIES,
+    max_bytes=DETECTION_CACHE_MAX_MB * 1024 * 1024,
+    disk_dir=DETECTION_CACHE_DIR or None
+) if DETECTION_CACHE_ENABLED else None
+
+# ディスク層の保存期間・容量の上限を超えたエントリを古いものから削除
+detection_cache_reaper = StorageReaper(
+    detection_cache,
+    ttl=DETECTION_CACHE_DISK_TTL_SECONDS,
+    max_bytes=DETECTION_CACHE_DISK_MAX_MB * 1024 * 1024,
+    interval=STORAGE_REAP_INTERVAL,
+    lock_path=host_lock_path(os.path.abspath(DETECTION_CACHE_DIR))
+) if detection_cache is not None and DETECTION_CACHE_DIR else None
+
+# 一括アップロードの上限（ファイル数・アーカイブ展開後の合計サイズ）
+BATCH_UPLOAD_MAX_FILES = int(os.getenv('BATCH_UPLOAD_MAX_FILES', '64'))
+BATCH_ARCHIVE_MAX_MB = int(os.getenv('BATCH_ARCHIVE_MAX_MB', '64'))
+
+# 非同期ジョブの設定（結果はTTL経過後に破棄）
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '256'))
+JOB_TTL_SECONDS = float(os.getenv('JOB_TTL_SECONDS', '600'))
+JOB_DB_PATH = os.getenv('JOB_DB_PATH', 'jobs.sqlite3')  # すべてのWebプロセスで共有するジョブの状態のファイル
+JOB_EVENTS_MAX_STREAMS = int(os.getenv('JOB_EVENTS_MAX_STREAMS', '4'))  # プロセスあたりの同時SSE接続数の上限
+JOB_EVENTS_MAX_SECONDS = float(os.getenv('JOB_EVENTS_MAX_SECONDS', '30'))  # 1回のSSE接続を維持する最大秒数
+JOB_STALE_SECONDS = float(os.getenv('JOB_STALE_SECONDS', '60'))  # 生存確認がこの秒数途絶えた未完了のジョブは failed にする
+
+job_store = JobStore(JOB_DB_PATH, ttl=JOB_TTL_SECONDS, stale_after=JOB_STALE_SECONDS)
+# SSEの接続はその間gunicornのスレッドを1つ占有するため、同時接続数と接続時間を制限する
+job_event_streams = threading.BoundedSemaphore(JOB_EVENTS_MAX_STREAMS)
+job_runner = JobRunner(job_store, max_workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING)
+
+# 前処理の設定（大きな画像は縮小デコードしてモデルの入力サイズに1回だけ縮小）
+PREPROCESS_ENABLED = os.getenv('PREPROCESS_ENABLED', '1') == '1'
+MODEL_INPUT_SIZE = int(os.getenv('MODEL_INPUT_SIZE', '640'))
+
+# タイル推論の設定（巨大な画像を重なり付きタイルに分割して小さな物体も検出）
+TILE_SIZE = int(os.getenv('TILE_SIZE', '640'))
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', '0.2'))
+TILE_NMS_IOU = float(os.getenv('TILE_NMS_IOU', '0.5'))
+TILE_AUTO_THRESHOLD = int(os.getenv('TILE_AUTO_THRESHOLD', '0'))  # 長辺がこの値以上なら自動でタイル推論（0 で無効）
+
+# マイクロバッチ推論の設定（同時リクエストをまとめて1回の推論で処理）
+BATCHING_ENABLED = os.getenv('BATCHING_ENABLED', '1') == '1'
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', '8'))
+BATCH_MAX_WAIT_MS = float(os.getenv('BATCH_MAX_WAIT_MS', '15'))
+
 # YOLOモデルをロード（初回実行時は自動的にダウンロード）
-model = YOLO('yolov8n.pt')  # 速度重視でnanoバージョンを使用
+MODEL_NAME = 'yolov8n.pt'  # 速度重視でnanoバージョンを使用
+CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD', '0.25'))  # ?conf= はこの値以上のみ指定可能
+IOU_THRESHOLD = float(os.getenv('IOU_THRESHOLD', '0.7'))  # モデルのNMSのIoUしきい値（?iou= はこの値以下のみ指定可能）
+
+# 推論バックエンド（torch / onnx / openvino）。torch以外は初回起動時にエクスポートしてキャッシュ
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'torch')
+MODEL_INT8 = os.getenv('MODEL_INT8', '0') == '1'
+MODEL_EXPORT_DIR = os.getenv('MODEL_EXPORT_DIR', 'models')
+
+# 品質ティアと負荷に応じて切り替えるモデル（速い順にカンマ区切り。例: yolov8n.pt,yolov8s.pt,yolov8m.pt）
+MODEL_VARIANTS = [name.strip() for name in os.getenv('MODEL_VARIANTS', MODEL_NAME).split(',') if name.strip()]
+MODEL_DEFAULT_TIER = os.getenv('MODEL_DEFAULT_TIER', 'balanced')  # ?quality= で上書き可能
+MODEL_DEGRADE_DEPTH = int(os.getenv('MODEL_DEGRADE_DEPTH', '16'))  # 処理中のリクエスト数がこの値以上なら速いモデルに落とす（0 で無効）
+MODEL_LATENCY_SLO_MS = float(os.getenv('MODEL_LATENCY_SLO_MS', '0'))  # 直近のp95がこの値を超えたら最速のモデルに切り替える（0 で無効）
+MODEL_SLO_WINDOW_SECONDS = float(os.getenv('MODEL_SLO_WINDOW_SECONDS', '10'))
+MODEL_IDS = [describe_model(name, MODEL_BACKEND, MODEL_INT8) for name in MODEL_VARIANTS]
+
+model_selector = ModelSelector(
+    MODEL_IDS,
+    default_tier=MODEL_DEFAULT_TIER,
+    degrade_depth=MODEL_DEGRADE_DEPTH,
+    latency_slo_ms=MODEL_LATENCY_SLO_MS,
+    window=MODEL_SLO_WINDOW_SECONDS
+)
+
+# 推論ワーカープール（0 の場合はWebプロセス内で推論）
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '0'))
+INFERENCE_THREADS_PER_WORKER = int(os.getenv('INFERENCE_THREADS_PER_WORKER', '1'))
+INFERENCE_MAX_QUEUE = int(os.getenv('INFERENCE_MAX_QUEUE', '64'))  # 超えた分は503で拒否
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '1'))
+
+# 起動モード
+#   eager: インポート時にモデルをロード（gunicorn の preload でマスターが1回だけロードし、ワーカーとコピーオンライトで共有）
+#   background: インポートはすぐに完了し、モデルのロードとウォームアップはバックグラウンドで行う
+STARTUP_MODE = os.getenv('STARTUP_MODE', 'eager')
+IMPORT_TIME_BUDGET_MS = float(os.getenv('IMPORT_TIME_BUDGET_MS', '500'))  # モデルのロードを除くインポート時間の目標
+WARMUP_IMAGE_SIZE = int(os.getenv('WARMUP_IMAGE_SIZE', '640'))
+
+# メトリクスとプロファイラ（/metrics はPrometheus形式、/debug/profiler は PROFILER_ENABLED=1 の場合のみ有効）
+SERVER_TIMING_ENABLED = os.getenv('SERVER_TIMING_ENABLED', '1') == '1'  # ステージ別の内訳を Server-Timing ヘッダで返す
+PROFILER_ENABLED = os.getenv('PROFILER_ENABLED', '0') == '1'
+PROFILER_INTERVAL_MS = float(os.getenv('PROFILER_INTERVAL_MS', '10'))
+PROFILER_MAX_SECONDS = float(os.getenv('PROFILER_MAX_SECONDS', '60'))  # 停止し忘れた場合に自動停止するまでの時間
+
+metrics = MetricsRegistry()
+http_requests = metrics.counter('http_requests_total', 'HTTP requests by endpoint and status', ('endpoint', 'method', 'status'))
+http_in_flight = metrics.gauge('http_requests_in_flight', 'HTTP requests currently being handled', ('endpoint',))
+http_latency = metrics.histogram('http_request_duration_seconds', 'Time until the response is returned', ('endpoint',))
+error_counter = metrics.counter('detection_errors_total', 'Failed detections by kind', ('kind',))
+model_latency = metrics.histogram('model_inference_seconds', 'Time of one model call (one batch)', ('model',))
+model_batch_size = metrics.histogram('model_batch_size', 'Images per model call', ('model',), buckets=(1, 2, 4, 8, 16, 32, 64))
+model_selections = metrics.counter('model_selections_total', 'Requests by serving model and fallback reason', ('model', 'reason'))
+spans = SpanRecorder(metrics.histogram('detection_stage_seconds', 'Time spent in each processing stage', ('stage',)))
+profiler = SamplingProfiler(interval=PROFILER_INTERVAL_MS / 1000.0)
+
+# モデル（load_inference_model でロード。MODEL_VARIANTS と同じ順）
+models = []
+inference_pool = None
+model_names = None
+class_name_table = None
+class_id_lookup = None
+model_loaded = threading.Event()
+model_warmed = threading.Event()
+startup_timings = {}
 
 # 物体クラスの日本語翻訳辞書
 class_translation = {
@@ -109,47 +302,542 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def detect_objects(image_path, output_path):
+def load_inference_model():
+    """
+    Load the model (or start the inference worker pool) and build the class name table
+    """
+    global models, inference_pool, model_names, class_name_table, class_id_lookup
+    started = time.perf_counter()
+    
+    if INFERENCE_WORKERS > 0:
+        # モデルはワーカープロセスごとに1組だけロードし、Webプロセスではロードしない
+        inference_pool = InferencePool(
+            {
+                'model_names': MODEL_VARIANTS,
+                'backend': MODEL_BACKEND,
+                'int8': MODEL_INT8,
+                'export_dir': MODEL_EXPORT_DIR,
+                'conf': CONFIDENCE_THRESHOLD,
+                'iou': IOU_THRESHOLD
+            },
+            num_workers=INFERENCE_WORKERS,
+            threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+            max_pending=INFERENCE_MAX_QUEUE
+        ).start()
+        model_names = inference_pool.names
+    else:
+        models = [
+            load_model(model_name, MODEL_BACKEND, int8=MODEL_INT8, export_dir=MODEL_EXPORT_DIR)
+            for model_name in MODEL_VARIANTS
+        ]
+        # クラスの定義はすべてのモデルで共通（COCO）
+        model_names = models[0].names
+    
+    class_name_table = build_class_name_table(model_names)
+    class_id_lookup = build_class_id_lookup(model_names)
+    startup_timings['model_load_ms'] = (time.perf_counter() - started) * 1000.0
+    model_loaded.set()
+
+def warm_up():
+    """
+    Run a dummy inference so the first real request does not pay the warm-up cost
+    """
+    model_loaded.wait()
+    if model_warmed.is_set():
+        return
+    started = time.perf_counter()
+    for variant in range(len(MODEL_VARIANTS)):
+        run_model_batch([np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8)], variant)
+    startup_timings['warmup_ms'] = (time.perf_counter() - started) * 1000.0
+    model_warmed.set()
+
+def run_model_batch(sources, variant=0):
+    """
+    Run the model variant once over a batch of images and return one (N, 6) detection array per image
+    """
+    # バックグラウンド起動中はモデルのロード完了を待つ
+    model_loaded.wait()
+    started = time.perf_counter()
+    if inference_pool is not None:
+        results = inference_pool.run(sources, variant)
+    else:
+        results = models[variant](sources, conf=CONFIDENCE_THRESHOLD, iou=IOU_THRESHOLD, verbose=False)
+        results = [result_array(result) for result in results]
+    model_latency.observe(time.perf_counter() - started, model=MODEL_IDS[variant])
+    model_batch_size.observe(len(sources), model=MODEL_IDS[variant])
+    return results
+
+# 推論スケジューラ（モデルごとに1つ。無効時は1枚ずつ直接推論）
+# ワーカープール使用時はワーカー数と同じ数のバッチを並行して投入する
+batch_schedulers = [
+    BatchScheduler(
+        functools.partial(run_model_batch, variant=variant),
+        max_batch_size=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_MAX_WAIT_MS,
+        num_threads=max(1, INFERENCE_WORKERS),
+        max_queue=INFERENCE_MAX_QUEUE,
+        name=f'batch-scheduler-{variant}'
+    )
+    for variant in range(len(MODEL_VARIANTS))
+] if BATCHING_ENABLED else None
+
+def run_inference(source, variant=0):
+    """
+    Run inference on a single image, going through the batch scheduler when enabled
+    """
+    if batch_schedulers is not None:
+        return batch_schedulers[variant](source)
+    return run_model_batch([source], variant)[0]
+
+def iter_inference(sources, variant=0):
+    """
+    Run inference on many images, yielding (index, result, error) as each one finishes
+    """
+    if batch_schedulers is not None:
+        # まとめて投入し、スケジューラにバッチを組ませて完了順に返す
+        futures = {}
+        for index, source in enumerate(sources):
+            try:
+                futures[batch_schedulers[variant].submit(source)] = index
+            except QueueFullError as e:
+                yield index, None, e
+        for future in as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+        return
+    
+    for start in range(0, len(sources), BATCH_MAX_SIZE):
+        chunk = sources[start:start + BATCH_MAX_SIZE]
+        try:
+            results = run_model_batch(chunk, variant)
+        except Exception as e:
+            for offset in range(len(chunk)):
+                yield start + offset, None, e
+            continue
+        for offset, result in enumerate(results):
+            yield start + offset, result, None
+
+def iter_tracked_inference(sources, variant=0):
+    """
+    Same as iter_inference, counting each image as an in-flight request for model selection until its result is ready
+    """
+    # 1枚ずつ処理中のリクエストとして数え、結果が出た時点でレイテンシ（キュー待ちを含む）を記録する
+    tracking = {}
+    for index in range(len(sources)):
+        tracking[index] = ExitStack()
+        tracking[index].enter_context(model_selector.track(variant))
+    try:
+        for index, result, error in iter_inference(sources, variant):
+            tracking.pop(index).close()
+            yield index, result, error
+    finally:
+        # 途中で打ち切られた場合も残りの画像を処理中から外す
+        for stack in tracking.values():
+            stack.close()
+
+def build_class_name_table(names):
+    """
+    Build an array mapping class id to its Japanese name (falls back to the English name)
+    """
+    table = np.empty(max(names) + 1, dtype=object)
+    for class_id, class_name in names.items():
+        table[class_id] = class_translation.get(class_name, class_name)
+    return table
+
+def build_class_id_lookup(names):
+    """
+    Build a map from English (case-insensitive) and Japanese class names to class ids
+    """
+    lookup = {}
+    for class_id, class_name in names.items():
+        lookup[class_name.lower()] = class_id
+        if class_name in class_translation:
+            lookup[class_translation[class_name]] = class_id
+    return lookup
+
+def detections_from_array(data, scale=1.0, region=None):
+    """
+    Convert a (N, 6+) detection array into columnar detections in original image coordinates
+
+    region is the (x1, y1, x2, y2) crop the image was cut from, if any
+    """
+    if len(data) == 0:
+        return {'class': [], 'confidence': [], 'bbox': []}
+    
+    class_ids = data[:, -1].astype(np.intp)
+    bboxes = data[:, :4] / scale if scale != 1.0 else data[:, :4]
+    if region is not None:
+        bboxes = bboxes + np.array([region[0], region[1], region[0], region[1]])
+    
+    return {
+        'class': class_name_table[class_ids].tolist(),
+        'confidence': data[:, -2].tolist(),
+        'bbox': bboxes.tolist()
+    }
+
+def detections_to_records(detections):
+    """
+    Convert columnar detections into a list of per-box dicts
+    """
+    return [
+        {'class': class_name, 'confidence': confidence, 'bbox': bbox}
+        for class_name, confidence, bbox in zip(detections['class'], detections['confidence'], detections['bbox'])
+    ]
+
+def format_detections(detections):
+    # ?format=columnar の場合は並列配列のまま返す（大量の検出結果向け）
+    if request.args.get('format') == 'columnar':
+        return detections
+    return detections_to_records(detections)
+
+def prepare_image(source, tiled=False, roi=None):
+    """
+    Decode an uploaded image (bytes or path) for detection and return (image, scale, tiled, region)
+
+    With an ROI only that part of the image is decoded into the returned image, and region is the
+    crop actually taken (None without an ROI, or when the ROI lies outside the image along with image)
+    """
+    if not tiled and TILE_AUTO_THRESHOLD:
+        size, _ = image_size(source)
+        if size is not None and roi is not None:
+            size = (roi[2] - roi[0], roi[3] - roi[1])
+        tiled = size is not None and max(size) >= TILE_AUTO_THRESHOLD
+    # タイル推論はタイルごとに元の解像度が必要なため縮小しない
+    target_size = MODEL_INPUT_SIZE if PREPROCESS_ENABLED and not tiled else None
+    with spans.span('decode'):
+        if roi is not None:
+            # 推論前に ROI を切り出し、モデルが処理する画素を減らす
+            image, scale, region = decode_region(source, roi, target_size)
+            return image, scale, tiled, region
+        image, scale = decode_image(source, target_size)
+    return image, scale, tiled, None
+
+def output_extension(file_extension):
+    # 出力形式の指定がなければ入力と同じ形式で出力
+    return {'jpeg': 'jpg', 'webp': 'webp', 'png': 'png'}.get(OUTPUT_FORMAT.lower(), file_extension)
+
+def requested_render_mode():
+    # ?render= で描画モードを上書き（不正な値の場合は None）
+    render = request.args.get('render', RENDER_MODE)
+    return render if render in RENDER_MODES else None
+
+def requested_filters():
+    """
+    Parse the detection filters (?classes=, ?conf=, ?iou=, ?max_det=, ?roi=) into a dict, or None when none are given.
+    Raises ValueError describing the first invalid parameter
+    """
+    args = request.args
+    filters = {}
+    if args.get('classes'):
+        # 英語名（大文字小文字は区別しない）と日本語名のどちらでも指定できる
+        model_loaded.wait()
+        class_ids = set()
+        for class_name in args['classes'].split(','):
+            class_name = class_name.strip()
+            if not class_name:
+                continue
+            class_id = class_id_lookup.get(class_name.lower())
+            if class_id is None:
+                raise ValueError(f"Unknown class '{class_name}'")
+            class_ids.add(class_id)
+        filters['classes'] = sorted(class_ids)
+    
+    # バッチ推論は全リクエスト共通の設定で行うため、しきい値はモデルの出力より絞り込む方向にのみ指定できる
+    if 'conf' in args:
+        conf = args.get('conf', type=float)
+        if conf is None or not CONFIDENCE_THRESHOLD <= conf <= 1.0:
+            raise ValueError(f'Invalid conf (expected a number between {CONFIDENCE_THRESHOLD} and 1)')
+        filters['conf'] = conf
+    if 'iou' in args:
+        iou = args.get('iou', type=float)
+        if iou is None or not 0.0 < iou <= IOU_THRESHOLD:
+            raise ValueError(f'Invalid iou (expected a number greater than 0 and at most {IOU_THRESHOLD})')
+        filters['iou'] = iou
+    if 'max_det' in args:
+        max_det = args.get('max_det', type=int)
+        if max_det is None or max_det < 1:
+            raise ValueError('Invalid max_det (expected a positive integer)')
+        filters['max_det'] = max_det
+    if 'roi' in args:
+        # 元画像の座標で x1,y1,x2,y2
+        try:
+            roi = tuple(float(value) for value in args['roi'].split(','))
+        except ValueError:
+            roi = ()
+        if len(roi) != 4 or roi[0] < 0 or roi[1] < 0 or roi[2] <= roi[0] or roi[3] <= roi[1]:
+            raise ValueError('Invalid roi (expected x1,y1,x2,y2 in image pixels)')
+        filters['roi'] = roi
+    return filters or None
+
+def apply_filters(data, filters):
+    # ROI 以外の絞り込みを検出結果 (N, 6) に適用する
+    if filters is None:
+        return data
+    return filter_detections(
+        data,
+        classes=filters.get('classes'),
+        conf=filters.get('conf'),
+        iou=filters.get('iou'),
+        max_det=filters.get('max_det')
+    )
+
+def requested_quality():
+    # ?quality= で品質ティアを指定（未指定なら MODEL_DEFAULT_TIER、不正な値の場合は None）
+    quality = request.args.get('quality', MODEL_DEFAULT_TIER)
+    return quality if quality in QUALITY_TIERS else None
+
+def select_model(quality):
+    """
+    Pick the model variant for a request and return (index, fallback reason or None)
+    """
+    variant, reason = model_selector.select(quality)
+    model_selections.inc(model=MODEL_IDS[variant], reason=reason or 'none')
+    return variant, reason
+
+def output_mimetype(output_filename):
+    return IMAGE_MIMETYPES[output_filename.rsplit('.', 1)[1]] if output_filename else None
+
+def render_output(image, data, extension):
+    """
+    Draw (N, 6) detections on the image and encode it in the configured output format
+    """
+    resize = 1.0
+    if OUTPUT_MAX_DIMENSION:
+        # 描画前に縮小し、描画とエンコードの画素数を減らす
+        image, resize = downscale(image, OUTPUT_MAX_DIMENSION)
+    if resize != 1.0:
+        data = data.copy()
+        data[:, :4] *= resize
+    else:
+        image = image.copy()
+    with spans.span('plot'):
+        annotated_image = draw_detections(image, data, model_names)
+    
+    # 注釈付き画像をメモリ上でエンコード
+    params = []
+    if extension in ('jpg', 'jpeg'):
+        params = [cv2.IMWRITE_JPEG_QUALITY, OUTPUT_QUALITY]
+    elif extension == 'webp':
+        params = [cv2.IMWRITE_WEBP_QUALITY, OUTPUT_QUALITY]
+    with spans.span('encode'):
+        ok, encoded = cv2.imencode(f'.{extension}', annotated_image, params)
+    if not ok:
+        raise RuntimeError('Failed to encode annotated image')
+    return encoded.tobytes()
+
+def deferred_render(data, scale, tiled=False, region=None):
+    """
+    Describe what render_lazy_output needs to draw (N, 6) detections later (also kept in detection cache entries)
+    """
+    # 検出結果は切り出した領域の左上を原点とした元画像の縮尺で記録する
+    boxes = data.astype(np.float64)
+    boxes[:, :4] /= scale
+    return {'boxes': boxes.tolist(), 'tiled': tiled, 'region': region}
+
+def write_render_record(output_filename, input_filename, deferred, cache_key=None):
+    # 入力画像は呼び出し側で保存済み。描画後に結果画像をキャッシュのエントリにも追加できるようキーを記録する
+    record = {'input': input_filename, 'cache_key': cache_key, **deferred}
+    store_output(f'{output_filename}.render.json', json.dumps(record).encode('utf-8'), 'application/json')
+
+def render_or_defer(output_filename, image, data, render, input_filename=None, deferred=None, cache_key=None):
+    """
+    Render the annotated image now (eager), record what is needed to render it on first GET (lazy),
+    or skip it (none). Returns the encoded image when it was rendered
+    """
+    if render == 'eager':
+        return render_output(image, data, output_filename.rsplit('.', 1)[1])
+    if render == 'lazy':
+        write_render_record(output_filename, input_filename, deferred, cache_key)
+    return None
+
+def store_cached_output(cached, output_filename, input_filename, data, file_extension, cache_key):
+    """
+    Make a cached result's annotated image available as output_filename, writing a lazy render record
+    from the cached boxes when the entry has no image yet
+    """
+    if cached['output'] is not None:
+        store_output(output_filename, cached['output'], cached['mimetype'])
+        return
+    store_output(input_filename, data, IMAGE_MIMETYPES[file_extension])
+    write_render_record(output_filename, input_filename, cached['render'], cache_key)
+
+def render_lazy_output(output_filename):
+    """
+    Render a deferred annotated image on its first request and store it. Returns (data, mimetype) or None
+    """
+    record_name = f'{output_filename}.render.json'
+    record = load_output(record_name)
+    if record is None:
+        return None
+    record = json.loads(record)
+    source = load_output(record['input'])
+    if source is None:
+        return None
+    
+    # 出力サイズまで縮小デコードしてから描画する
+    sizes = [OUTPUT_MAX_DIMENSION]
+    if PREPROCESS_ENABLED and not record['tiled']:
+        sizes.append(MODEL_INPUT_SIZE)
+    target_size = min((size for size in sizes if size), default=None)
+    if record.get('region'):
+        # ROI を指定した検出の結果画像は切り出した領域だけを描画する
+        image, scale, _ = decode_region(source, record['region'], target_size)
+    else:
+        image, scale = decode_image(source, target_size)
+    if image is None:
+        return None
+    data = np.array(record['boxes'], dtype=np.float32).reshape(-1, 6)
+    data[:, :4] *= scale
+    
+    model_loaded.wait()
+    encoded = render_output(image, data, output_filename.rsplit('.', 1)[1])
+    mimetype = output_mimetype(output_filename)
+    store_output(output_filename, encoded, mimetype)
+    if detection_cache is not None and record.get('cache_key'):
+        # 同じ画像の次の遅延描画のリクエストは描画済みの画像をそのまま使う
+        detection_cache.set_output(record['cache_key'], encoded, mimetype)
+    if not IN_MEMORY_UPLOADS:
+        storage.delete(record_name)
+    return encoded, mimetype
+
+def detect_tiled(image, variant=0):
+    """
+    Detect objects tile by tile (plus one downscaled full-frame pass) and merge them with cross-tile NMS
+    """
+    tiles = split_tiles(image, TILE_SIZE, TILE_OVERLAP)
+    # 大きな物体用に画像全体を縮小したものも一緒に推論する
+    full_frame, full_scale = downscale(image, MODEL_INPUT_SIZE)
+    sources = [tile for _, _, tile in tiles] + [full_frame]
+    
+    # BATCH_MAX_SIZE 枚ずつ投入して完了を待つ（巨大な画像でも推論キューの上限 INFERENCE_MAX_QUEUE を超えないように）
+    parts = [None] * len(sources)
+    for start in range(0, len(sources), BATCH_MAX_SIZE):
+        for offset, data, error in iter_inference(sources[start:start + BATCH_MAX_SIZE], variant):
+            if error is not None:
+                raise error
+            index = start + offset
+            if index < len(tiles):
+                x, y, _ = tiles[index]
+                data[:, [0, 2]] += x
+                data[:, [1, 3]] += y
+            else:
+                data[:, :4] /= full_scale
+            parts[index] = data
+    
+    return merge_detections(parts, TILE_NMS_IOU)
+
+def detect_image(image, scale=1.0, tiled=False, variant=0, filters=None, region=None):
+    """
+    Run detection with the given model variant and return (detections, (N, 6) boxes in image coordinates)
+
+    filters (see requested_filters) are applied before postprocessing, and region is the crop the image was cut from
+    """
+    # inference はバッチ推論のキュー待ちを含む（モデル選択のレイテンシもキュー待ち込みで計測する）
+    with spans.span('inference'), model_selector.track(variant):
+        if tiled:
+            data = detect_tiled(image, variant)
+        else:
+            # 推論を実行（他のリクエストとまとめてバッチ推論される）
+            data = run_inference(image, variant)
+    with spans.span('postprocess'):
+        data = apply_filters(data, filters)
+        detections = detections_from_array(data, scale, region)
+    return detections, data
+
+def detect_objects(image_path, output_path, tiled=False, variant=0, filters=None):
     """
     Perform object detection on an image and save the result
     """
     try:
-        # 推論を実行
-        results = model(image_path)
-        
-        # 最初の結果を取得（1枚の画像を処理しているため）
-        result = results[0]
+        image, scale, tiled, region = prepare_image(image_path, tiled, (filters or {}).get('roi'))
+        if image is None:
+            raise ValueError('Invalid image data')
         
-        # バウンディングボックスとラベルを画像に描画
-        annotated_image = result.plot()
+        # 検出情報を取得し、バウンディングボックスとラベルを描画
+        detections, data = detect_image(image, scale, tiled, variant, filters, region)
+        encoded = render_output(image, data, output_path.rsplit('.', 1)[1].lower())
         
         # 注釈付き画像を保存
-        cv2.imwrite(output_path, annotated_image)
-        
-        # 検出情報を抽出
-        detections = []
-        if result.boxes is not None:
-            for box in result.boxes:
-                # バウンディングボックスの座標を取得
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                # 信頼度スコアを取得
-                confidence = box.conf[0].cpu().numpy()
-                # クラスIDと名前を取得
-                class_id = int(box.cls[0].cpu().numpy())
-                class_name = model.names[class_id]
-                # 利用可能な場合は日本語に翻訳
-                japanese_name = class_translation.get(class_name, class_name)
-                
-                detections.append({
-                    'class': japanese_name,
-                    'confidence': float(confidence),
-                    'bbox': [float(x1), float(y1), float(x2), float(y2)]
-                })
+        with open(output_path, 'wb') as f:
+            f.write(encoded)
         
         return detections, True
+    except QueueFullError:
+        raise
     except Exception as e:
         print(f"Error in object detection: {str(e)}")
-        return [], False
+        error_counter.inc(kind='detection')
+        return {'class': [], 'confidence': [], 'bbox': []}, False
+
+def detect_objects_in_memory(image, scale=1.0, tiled=False, variant=0, filters=None, region=None):
+    """
+    Perform object detection on a decoded image and return (detections, boxes, success)
+    """
+    try:
+        # デコード済みの配列をそのままモデルに渡す
+        detections, data = detect_image(image, scale, tiled, variant, filters, region)
+        
+        return detections, data, True
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"Error in object detection: {str(e)}")
+        error_counter.inc(kind='detection')
+        return {'class': [], 'confidence': [], 'bbox': []}, None, False
+
+def detection_cache_key(data, file_extension, tiled=False, variant=0, filters=None):
+    # 推論結果に影響する設定をすべてキーに含める
+    return make_cache_key(
+        data,
+        model=MODEL_IDS[variant],
+        conf=CONFIDENCE_THRESHOLD,
+        format=file_extension,
+        input_size=MODEL_INPUT_SIZE if PREPROCESS_ENABLED else 0,
+        tiled=tiled,
+        tile=f'{TILE_SIZE}/{TILE_OVERLAP}/{TILE_NMS_IOU}/{TILE_AUTO_THRESHOLD}',
+        output=f'{output_extension(file_extension)}/{OUTPUT_QUALITY}/{OUTPUT_MAX_DIMENSION}',
+        iou=IOU_THRESHOLD,
+        filters=json.dumps(filters, sort_keys=True) if filters else ''
+    )
+
+def cached_result(cache_key, render):
+    """
+    Look up the detection cache. Entries stored without an annotated image satisfy render=none,
+    and render=lazy when they carry the boxes to render it from
+    """
+    if cache_key is None:
+        return None
+    cached = detection_cache.get(cache_key)
+    if cached is None:
+        return None
+    if cached['output'] is None and not (render == 'none' or (render == 'lazy' and cached['render'] is not None)):
+        return None
+    return cached
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.metrics_endpoint = request.endpoint or 'unknown'
+    http_in_flight.inc(endpoint=g.metrics_endpoint)
+    spans.start_trace()
+
+@app.after_request
+def record_request_metrics(response):
+    # ストリーミングのレスポンスはレスポンスを返し始めるまでの時間を記録する
+    endpoint = g.get('metrics_endpoint', 'unknown')
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    if 'request_started' in g:
+        http_latency.observe(time.perf_counter() - g.request_started, endpoint=endpoint)
+    recorded = spans.finish_trace()
+    if SERVER_TIMING_ENABLED and recorded:
+        # ブラウザの開発者ツールでステージ別の内訳を確認できる
+        response.headers['Server-Timing'] = ', '.join(f'{name};dur={seconds * 1000.0:.2f}' for name, seconds in recorded)
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if 'metrics_endpoint' in g:
+        http_in_flight.dec(endpoint=g.pop('metrics_endpoint'))
 
 @app.route('/')
 def index():
@@ -170,34 +858,682 @@ def upload_file():
         unique_id = str(uuid.uuid4())
         file_extension = filename.rsplit('.', 1)[1].lower()
         input_filename = f"{unique_id}_input.{file_extension}"
-        output_filename = f"{unique_id}_output.{file_extension}"
         
-        input_path = os.path.join(app.config['UPLOAD_FOLDER'], input_filename)
-        output_path = os.path.join(app.config['UPLOAD_FOLDER'], output_filename)
+        render = requested_render_mode()
+        if render is None:
+            return jsonify({'error': f"Invalid render mode (expected one of {', '.join(RENDER_MODES)})"}), 400
+        if render == 'lazy' and request.args.get('inline') == '1':
+            # 埋め込む画像が必要なため検出時に描画する
+            render = 'eager'
+        quality = requested_quality()
+        if quality is None:
+            return jsonify({'error': f"Invalid quality (expected one of {', '.join(QUALITY_TIERS)})"}), 400
+        try:
+            filters = requested_filters()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        variant, fallback = select_model(quality)
+        output_filename = f"{unique_id}_output.{output_extension(file_extension)}" if render != 'none' else None
         
-        # アップロードされたファイルを保存
-        file.save(input_path)
+        with spans.span('read'):
+            data = file.read()
+        tiled = request.args.get('tiled') == '1'
         
-        # 物体検出を実行
-        detections, success = detect_objects(input_path, output_path)
+        # 同一画像・同一設定の結果がキャッシュにあれば推論をスキップ
+        cache_key = detection_cache_key(data, file_extension, tiled, variant, filters) if detection_cache is not None else None
+        cached = cached_result(cache_key, render)
+        if cached is not None:
+            if output_filename is not None and cached['output'] is None:
+                store_cached_output(cached, output_filename, input_filename, data, file_extension, cache_key)
+            return respond_with_result(
+                output_filename, cached['detections'], cached['output'] if output_filename else None,
+                variant, fallback, cached=True
+            )
+        
+        if not IN_MEMORY_UPLOADS or render == 'lazy':
+            # アップロードされたファイルを保存（インメモリモードでは遅延描画に使う場合のみメモリストアに保持）
+            # 検出は読み直さずにメモリ上のデータで行う
+            store_output(input_filename, data, IMAGE_MIMETYPES[file_extension])
+        return upload_file_in_memory(
+            data, input_filename, output_filename, file_extension, cache_key, tiled, render, variant, fallback, filters
+        )
+    
+    return jsonify({'error': 'Invalid file type'}), 400
+
+def upload_file_in_memory(data, input_filename, output_filename, file_extension, cache_key=None, tiled=False, render='eager',
+                          variant=0, fallback=None, filters=None):
+    # リクエストボディをメモリ上でデコード（ディスクから読み直さない）
+    image, scale, tiled, region = prepare_image(data, tiled, (filters or {}).get('roi'))
+    if image is None:
+        return jsonify({'error': 'Invalid image data or roi outside the image'}), 400
+    
+    detections, boxes, success = detect_objects_in_memory(image, scale, tiled, variant, filters, region)
+    if not success:
+        return jsonify({'error': 'Object detection failed'}), 500
+    
+    deferred = deferred_render(boxes, scale, tiled, region)
+    try:
+        encoded = render_or_defer(output_filename, image, boxes, render, input_filename, deferred, cache_key)
+    except Exception as e:
+        print(f"Error in rendering: {str(e)}")
+        error_counter.inc(kind='render')
+        return jsonify({'error': 'Object detection failed'}), 500
+    if cache_key is not None:
+        detection_cache.put(cache_key, detections, encoded, output_mimetype(output_filename), deferred)
+    
+    return respond_with_result(output_filename, detections, encoded, variant, fallback)
+
+def respond_with_result(output_filename, detections, encoded, variant=0, fallback=None, cached=False):
+    # メモリ上の結果画像をレスポンスに埋め込むか、結果ストア（またはストレージ）に保存して返す
+    # 描画しない場合（render=none）は output_image が null、遅延描画の場合は encoded が None
+    # model は結果を出したモデル、model_fallback は要求より速いモデルに切り替えた理由（slo / queue）
+    response = {
+        'success': True,
+        'output_image': output_filename,
+        'detections': format_detections(detections),
+        'detection_count': len(detections['class']),
+        'cached': cached,
+        'model': MODEL_IDS[variant],
+        'model_fallback': fallback
+    }
+    
+    if encoded is not None and request.args.get('inline') == '1':
+        # 結果画像をレスポンスに直接埋め込む（ストアには保持しない）
+        response['output_image_data'] = base64.b64encode(encoded).decode('ascii')
+        response['output_image_mimetype'] = output_mimetype(output_filename)
+    elif encoded is not None:
+        store_output(output_filename, encoded, output_mimetype(output_filename))
+    
+    return jsonify(response)
+
+def read_archive(data):
+    """
+    Extract (filename, bytes) pairs for supported images from a zip or tar archive
+    """
+    items = []
+    total_bytes = 0
+    max_bytes = BATCH_ARCHIVE_MAX_MB * 1024 * 1024
+    buffer = io.BytesIO(data)
+    
+    if zipfile.is_zipfile(buffer):
+        with zipfile.ZipFile(buffer) as archive:
+            for info in archive.infolist():
+                if info.is_dir() or not allowed_file(info.filename):
+                    continue
+                total_bytes += info.file_size
+                if total_bytes > max_bytes or len(items) >= BATCH_UPLOAD_MAX_FILES:
+                    raise ValueError('Archive too large')
+                items.append((os.path.basename(info.filename), archive.read(info)))
+        return items
+    
+    buffer.seek(0)
+    with tarfile.open(fileobj=buffer, mode='r:*') as archive:
+        for member in archive.getmembers():
+            if not member.isfile() or not allowed_file(member.name):
+                continue
+            total_bytes += member.size
+            if total_bytes > max_bytes or len(items) >= BATCH_UPLOAD_MAX_FILES:
+                raise ValueError('Archive too large')
+            items.append((os.path.basename(member.name), archive.extractfile(member).read()))
+    return items
+
+def store_output(output_filename, encoded, mimetype):
+    # 結果画像をモードに応じてメモリストアかストレージに保存
+    with spans.span('write'):
+        if IN_MEMORY_UPLOADS:
+            result_store.put(output_filename, encoded, mimetype)
+        else:
+            storage.put(output_filename, encoded, mimetype)
+
+def load_output(filename):
+    # store_output で保存したファイルの内容を返す（存在しない場合は None）
+    if IN_MEMORY_UPLOADS:
+        entry = result_store.get(filename)
+        return entry[0] if entry is not None else None
+    return storage.get(filename)
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    # 複数ファイル（files フィールド）またはzip/tarアーカイブ（archive フィールド）を受け付ける
+    items = [(file.filename, file.read()) for file in request.files.getlist('files') if file.filename]
+    if 'archive' in request.files:
+        try:
+            items.extend(read_archive(request.files['archive'].read()))
+        except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+            return jsonify({'error': f'Invalid archive: {str(e)}'}), 400
+    
+    if not items:
+        return jsonify({'error': 'No file uploaded'}), 400
+    if len(items) > BATCH_UPLOAD_MAX_FILES:
+        return jsonify({'error': f'Too many files (max {BATCH_UPLOAD_MAX_FILES})'}), 400
+    
+    render = requested_render_mode()
+    if render is None:
+        return jsonify({'error': f"Invalid render mode (expected one of {', '.join(RENDER_MODES)})"}), 400
+    quality = requested_quality()
+    if quality is None:
+        return jsonify({'error': f"Invalid quality (expected one of {', '.join(QUALITY_TIERS)})"}), 400
+    try:
+        filters = requested_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    roi = (filters or {}).get('roi')
+    # バッチ全体を同じモデルで処理する
+    variant, fallback = select_model(quality)
+    served_by = {'model': MODEL_IDS[variant], 'model_fallback': fallback}
+    
+    def generate():
+        started = time.perf_counter()
+        succeeded = 0
+        pending = []
+        
+        def line(payload):
+            return json.dumps(payload, ensure_ascii=False) + '\n'
+        
+        # デコードとキャッシュ確認（ヒットしたものは推論を待たずに即座に返す）
+        for index, (name, data) in enumerate(items):
+            filename = secure_filename(name)
+            if not allowed_file(filename):
+                yield line({'index': index, 'filename': name, 'success': False, 'error': 'Invalid file type'})
+                continue
+            file_extension = filename.rsplit('.', 1)[1].lower()
+            unique_id = str(uuid.uuid4())
+            input_filename = f"{unique_id}_input.{file_extension}"
+            output_filename = f"{unique_id}_output.{output_extension(file_extension)}" if render != 'none' else None
+            
+            cache_key = detection_cache_key(data, file_extension, variant=variant, filters=filters) if detection_cache is not None else None
+            cached = cached_result(cache_key, render)
+            if cached is not None:
+                if output_filename is not None:
+                    store_cached_output(cached, output_filename, input_filename, data, file_extension, cache_key)
+                succeeded += 1
+                yield line({
+                    'index': index,
+                    'filename': name,
+                    'success': True,
+                    'output_image': output_filename,
+                    'detections': format_detections(cached['detections']),
+                    'detection_count': len(cached['detections']['class']),
+                    'cached': True,
+                    **served_by
+                })
+                continue
+            
+            target_size = MODEL_INPUT_SIZE if PREPROCESS_ENABLED else None
+            region = None
+            if roi is not None:
+                image, scale, region = decode_region(data, roi, target_size)
+            else:
+                image, scale = decode_image(data, target_size)
+            if image is None:
+                yield line({'index': index, 'filename': name, 'success': False, 'error': 'Invalid image data or roi outside the image'})
+                continue
+            if render == 'lazy':
+                store_output(input_filename, data, IMAGE_MIMETYPES[file_extension])
+            pending.append((index, name, image, scale, region, input_filename, output_filename, cache_key))
         
-        if success:
-            return jsonify({
+        # 残りをまとめてバッチ推論し、完了した順にストリーミング
+        for position, result, error in iter_tracked_inference([entry[2] for entry in pending], variant):
+            index, name, image, scale, region, input_filename, output_filename, cache_key = pending[position]
+            try:
+                if error is not None:
+                    raise error
+                boxes = apply_filters(result, filters)
+                detections = detections_from_array(boxes, scale, region)
+                deferred = deferred_render(boxes, scale, region=region)
+                encoded = render_or_defer(output_filename, image, boxes, render, input_filename, deferred, cache_key)
+            except QueueFullError:
+                yield line({'index': index, 'filename': name, 'success': False, 'error': 'Server busy'})
+                continue
+            except Exception as e:
+                print(f"Error in object detection: {str(e)}")
+                error_counter.inc(kind='detection')
+                yield line({'index': index, 'filename': name, 'success': False, 'error': 'Object detection failed'})
+                continue
+            
+            if encoded is not None:
+                store_output(output_filename, encoded, output_mimetype(output_filename))
+            if cache_key is not None:
+                detection_cache.put(cache_key, detections, encoded, output_mimetype(output_filename), deferred)
+            succeeded += 1
+            yield line({
+                'index': index,
+                'filename': name,
                 'success': True,
                 'output_image': output_filename,
-                'detections': detections,
-                'detection_count': len(detections)
+                'detections': format_detections(detections),
+                'detection_count': len(detections['class']),
+                'cached': False,
+                **served_by
             })
-        else:
-            return jsonify({'error': 'Object detection failed'}), 500
+        
+        yield line({
+            'done': True,
+            'total': len(items),
+            'succeeded': succeeded,
+            'failed': len(items) - succeeded,
+            'elapsed_ms': (time.perf_counter() - started) * 1000.0
+        })
     
-    return jsonify({'error': 'Invalid file type'}), 400
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def run_detection_job(data, file_extension, tiled=False, render='eager', quality=None, filters=None):
+    """
+    Detect objects in an uploaded image for a background job and return the job result
+    """
+    # モデルはキューに積んだ時点ではなく実行する時点の負荷で選ぶ
+    variant, fallback = select_model(quality)
+    served_by = {'model': MODEL_IDS[variant], 'model_fallback': fallback}
+    unique_id = str(uuid.uuid4())
+    input_filename = f"{unique_id}_input.{file_extension}"
+    output_filename = f"{unique_id}_output.{output_extension(file_extension)}" if render != 'none' else None
+    
+    cache_key = detection_cache_key(data, file_extension, tiled, variant, filters) if detection_cache is not None else None
+    cached = cached_result(cache_key, render)
+    if cached is not None:
+        if output_filename is not None:
+            store_cached_output(cached, output_filename, input_filename, data, file_extension, cache_key)
+        return dict(served_by, output_image=output_filename, detections=cached['detections'], cached=True)
+    
+    image, scale, tiled, region = prepare_image(data, tiled, (filters or {}).get('roi'))
+    if image is None:
+        raise ValueError('Invalid image data or roi outside the image')
+    
+    detections, boxes = detect_image(image, scale, tiled, variant, filters, region)
+    if render == 'lazy':
+        store_output(input_filename, data, IMAGE_MIMETYPES[file_extension])
+    deferred = deferred_render(boxes, scale, tiled, region)
+    encoded = render_or_defer(output_filename, image, boxes, render, input_filename, deferred, cache_key)
+    if encoded is not None:
+        store_output(output_filename, encoded, output_mimetype(output_filename))
+    if cache_key is not None:
+        detection_cache.put(cache_key, detections, encoded, output_mimetype(output_filename), deferred)
+    return dict(served_by, output_image=output_filename, detections=detections, cached=False)
+
+def serialize_job(job):
+    payload = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at']
+    }
+    result = job.get('result')
+    if result is not None:
+        payload.update({
+            'success': True,
+            'output_image': result['output_image'],
+            'detections': format_detections(result['detections']),
+            'detection_count': len(result['detections']['class']),
+            'cached': result['cached'],
+            'model': result['model'],
+            'model_fallback': result['model_fallback']
+        })
+    if job.get('error'):
+        payload.update({'success': False, 'error': job['error']})
+    return payload
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    filename = secure_filename(file.filename)
+    if not allowed_file(filename):
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    render = requested_render_mode()
+    if render is None:
+        return jsonify({'error': f"Invalid render mode (expected one of {', '.join(RENDER_MODES)})"}), 400
+    
+    quality = requested_quality()
+    if quality is None:
+        return jsonify({'error': f"Invalid quality (expected one of {', '.join(QUALITY_TIERS)})"}), 400
+    try:
+        filters = requested_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    # 受け付けた時点でIDを返し、検出はバックグラウンドで実行
+    file_extension = filename.rsplit('.', 1)[1].lower()
+    tiled = request.args.get('tiled') == '1'
+    job_id = job_runner.submit(run_detection_job, file.read(), file_extension, tiled, render, quality, filters, filename=filename)
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': url_for('get_job', job_id=job_id),
+        'events_url': url_for('job_events', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(serialize_job(job))
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    if not job_event_streams.acquire(blocking=False):
+        # 空きがなければ GET /jobs/<job_id> のポーリングか再接続を促す
+        raise QueueFullError('Too many event streams')
+    
+    def generate():
+        deadline = time.monotonic() + JOB_EVENTS_MAX_SECONDS
+        current = job
+        # 接続を打ち切った後、EventSource は1秒後に再接続する
+        yield 'retry: 1000\n\n'
+        while True:
+            yield f"event: {current['status']}\ndata: {json.dumps(serialize_job(current), ensure_ascii=False)}\n\n"
+            if current['status'] in FINISHED_STATUSES:
+                return
+            # 状態が変わるまで待つ（接続維持のため定期的にコメント行を送る）
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                latest = job_store.wait(job_id, current['version'], timeout=min(15.0, remaining))
+                if latest is None:
+                    return
+                if latest['version'] != current['version']:
+                    current = latest
+                    break
+                yield ': keep-alive\n\n'
+    
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.call_on_close(job_event_streams.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/video', methods=['POST'])
+def upload_video():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    
+    file = request.files['file']
+    filename = secure_filename(file.filename)
+    if '.' not in filename or filename.rsplit('.', 1)[1].lower() not in VIDEO_EXTENSIONS:
+        return jsonify({'error': 'Invalid file type'}), 400
+    
+    try:
+        frame_skip = max(1, int(request.args.get('frame_skip', VIDEO_FRAME_SKIP)))
+    except ValueError:
+        return jsonify({'error': 'Invalid frame_skip'}), 400
+    annotate = request.args.get('annotate') == '1'
+    quality = requested_quality()
+    if quality is None:
+        return jsonify({'error': f"Invalid quality (expected one of {', '.join(QUALITY_TIERS)})"}), 400
+    try:
+        filters = requested_filters()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if filters is not None and 'roi' in filters:
+        # 注釈付き動画のフレームサイズが変わるため動画では切り出さない
+        return jsonify({'error': 'roi is not supported for video'}), 400
+    # フレーム間で結果がぶれないよう動画全体を同じモデルで処理する
+    variant, fallback = select_model(quality)
+    
+    # OpenCVはファイルパスからしか読めないため一時ファイルに保存
+    fd, video_path = tempfile.mkstemp(suffix=f".{filename.rsplit('.', 1)[1].lower()}")
+    with os.fdopen(fd, 'wb') as f:
+        file.save(f)
+    
+    reader = FrameReader(video_path, frame_skip=frame_skip, max_queue=VIDEO_QUEUE_SIZE)
+    if not reader.opened:
+        os.remove(video_path)
+        return jsonify({'error': 'Invalid video data'}), 400
+    
+    def generate():
+        meter = FpsMeter()
+        writer = None
+        output_filename = None
+        annotated_path = None
+        if annotate:
+            output_filename = f"{uuid.uuid4()}_output.mp4"
+            fd, annotated_path = tempfile.mkstemp(suffix='.mp4')
+            os.close(fd)
+            # スキップ後のフレームレートで注釈付き動画を書き出す
+            writer = cv2.VideoWriter(
+                annotated_path,
+                cv2.VideoWriter_fourcc(*'mp4v'),
+                reader.fps / frame_skip,
+                (reader.width, reader.height)
+            )
+        
+        reader.start()
+        frames_failed = 0
+        try:
+            for batch in iter_frame_batches(reader, BATCH_MAX_SIZE):
+                results = [None] * len(batch)
+                for position, result, error in iter_tracked_inference([frame for _, frame in batch], variant):
+                    results[position] = (result, error)
+                
+                # フレーム順に結果を返す（注釈付き動画もこの順で書き込む）
+                for (index, frame), (result, error) in zip(batch, results):
+                    payload = {'frame': index, 'timestamp_ms': index / reader.fps * 1000.0}
+                    annotated = None
+                    if isinstance(error, QueueFullError):
+                        payload.update({'success': False, 'error': 'Server busy'})
+                    elif error is not None:
+                        print(f"Error in object detection: {str(error)}")
+                        error_counter.inc(kind='detection')
+                        payload.update({'success': False, 'error': 'Object detection failed'})
+                    else:
+                        boxes = apply_filters(result, filters)
+                        detections = detections_from_array(boxes)
+                        payload.update({
+                            'success': True,
+                            'detections': format_detections(detections),
+                            'detection_count': len(detections['class'])
+                        })
+                        if writer is not None:
+                            # 絞り込んだ検出結果だけを描画する（フレームはこの後使わないので直接描き込む）
+                            annotated = draw_detections(frame, boxes, model_names)
+                    if not payload['success']:
+                        frames_failed += 1
+                    if writer is not None:
+                        # 推論に失敗したフレームも元のまま書き込み、動画の長さと timestamp_ms の対応を保つ
+                        writer.write(frame if annotated is None else annotated)
+                    yield json.dumps(payload, ensure_ascii=False) + '\n'
+                meter.update(len(batch))
+            
+            if writer is not None:
+                writer.release()
+                writer = None
+                if IN_MEMORY_UPLOADS:
+                    with open(annotated_path, 'rb') as f:
+                        result_store.put(output_filename, f.read(), 'video/mp4')
+                else:
+                    storage.put_file(output_filename, annotated_path, 'video/mp4')
+            
+            yield json.dumps({
+                'done': True,
+                'frames_read': reader.frames_read,
+                'frames_processed': meter.frames,
+                'frames_failed': frames_failed,
+                'frame_skip': frame_skip,
+                'source_fps': reader.fps,
+                'fps': meter.fps,
+                'elapsed_ms': meter.elapsed * 1000.0,
+                'output_video': output_filename,
+                'model': MODEL_IDS[variant],
+                'model_fallback': fallback
+            }) + '\n'
+        finally:
+            reader.stop()
+            if writer is not None:
+                writer.release()
+            for path in (video_path, annotated_path):
+                if path and os.path.exists(path):
+                    os.remove(path)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    filename = secure_filename(filename)
+    entry = result_store.get(filename)
+    if entry is None:
+        # 遅延描画の結果画像は初回の取得時に描画して保存する
+        entry = render_lazy_output(filename)
+    if entry is not None:
+        data, mimetype = entry
+        return send_file(io.BytesIO(data), mimetype=mimetype, download_name=filename)
+    if IN_MEMORY_UPLOADS:
+        abort(404)
+    # Range（動画のシーク）と ETag による条件付きリクエストに対応
+    return storage.serve(filename, request)
+
+@app.errorhandler(QueueFullError)
+def handle_queue_full(error):
+    # 推論キューが満杯の場合はタイムアウトさせずに即座に503で再試行を促す
+    error_counter.inc(kind='queue_full')
+    response = jsonify({'error': 'Server busy, please retry later'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+    return response
+
+@app.route('/healthz')
+def healthz():
+    # プロセスが応答できるか（モデルの状態は問わない）
+    return jsonify({'status': 'ok', 'startup': startup_timings})
+
+@app.route('/readyz')
+def readyz():
+    # モデルのロードとウォームアップが完了してからリクエストを受け付ける
+    ready = model_warmed.is_set()
+    response = jsonify({
+        'ready': ready,
+        'model_loaded': model_loaded.is_set(),
+        'model_warmed': ready,
+        'models': MODEL_IDS
+    })
+    response.status_code = 200 if ready else 503
+    return response
+
+@app.route('/stats')
+def stats():
+    # バッチサイズ分布・キュー長・ステージ別レイテンシを返す
+    return jsonify({
+        'models': MODEL_IDS,
+        'model_selection': model_selector.stats(),
+        'batching': [scheduler.stats() for scheduler in batch_schedulers] if batch_schedulers is not None else None,
+        'inference_pool': inference_pool.stats() if inference_pool is not None else None,
+        'result_store': result_store.stats(),
+        'storage': dict(storage_reaper.stats(), backend=STORAGE_BACKEND) if not IN_MEMORY_UPLOADS else None,
+        'detection_cache': dict(
+            detection_cache.stats(), disk=detection_cache_reaper.stats() if detection_cache_reaper is not None else None
+        ) if detection_cache is not None else None,
+        'jobs': dict(job_store.stats(), pending=job_runner.pending())
+    })
+
+def collect_component_metrics():
+    # キャッシュ・キュー・ジョブなど各コンポーネントの統計をメトリクスとして出力
+    families = [
+        ('model_loaded', 'gauge', 'Whether the model has been loaded', [
+            ({'model': model_id}, int(model_loaded.is_set())) for model_id in MODEL_IDS
+        ]),
+        ('model_in_flight', 'gauge', 'Requests being detected by each model', [
+            ({'model': entry['model']}, entry['in_flight']) for entry in model_selector.stats()['models']
+        ]),
+        ('result_store_bytes', 'gauge', 'Bytes held in the in-memory result store', [({}, result_store.stats()['bytes'])])
+    ]
+    if batch_schedulers is not None:
+        families.append(('batch_queue_depth', 'gauge', 'Images waiting for the batch scheduler', [
+            ({'model': model_id}, scheduler.queue_depth()) for model_id, scheduler in zip(MODEL_IDS, batch_schedulers)
+        ]))
+    if inference_pool is not None:
+        pool = inference_pool.stats()
+        families.extend([
+            ('inference_pool_pending', 'gauge', 'Tasks waiting for an inference worker', [({}, pool['pending'])]),
+            ('inference_pool_workers_alive', 'gauge', 'Inference worker processes alive', [({}, pool['workers_alive'])]),
+            ('inference_pool_restarts_total', 'counter', 'Inference worker restarts', [({}, pool['restarts'])])
+        ])
+    if detection_cache is not None:
+        cache = detection_cache.stats()
+        families.extend([
+            ('detection_cache_lookups_total', 'counter', 'Detection cache lookups by result', [
+                ({'result': 'memory_hit'}, cache['memory_hits']),
+                ({'result': 'disk_hit'}, cache['disk_hits']),
+                ({'result': 'miss'}, cache['misses'])
+            ]),
+            ('detection_cache_entries', 'gauge', 'Entries in the detection cache memory tier', [({}, cache['entries'])]),
+            ('detection_cache_bytes', 'gauge', 'Bytes in the detection cache memory tier', [({}, cache['bytes'])]),
+            ('detection_cache_hit_ratio', 'gauge', 'Detection cache hit ratio', [({}, cache['hit_rate'])])
+        ])
+    if detection_cache_reaper is not None:
+        disk = detection_cache_reaper.stats()
+        families.extend([
+            ('detection_cache_disk_bytes', 'gauge', 'Bytes in the detection cache disk tier seen by the reaper', [({}, disk['total_bytes'])]),
+            ('detection_cache_disk_evictions_total', 'counter', 'Entries deleted from the detection cache disk tier', [({}, disk['deleted'])])
+        ])
+    jobs = job_store.stats()
+    families.append(('jobs', 'gauge', 'Jobs held in the job store by status', [
+        ({'status': status}, count) for status, count in jobs['by_status'].items()
+    ]))
+    if not IN_MEMORY_UPLOADS:
+        reaper = storage_reaper.stats()
+        families.extend([
+            ('storage_reaper_active', 'gauge', 'Whether this worker runs the storage reaper for the host', [({}, int(reaper['active']))]),
+            ('storage_bytes', 'gauge', 'Total bytes of stored files seen by the storage reaper', [({}, reaper['total_bytes'])]),
+            ('storage_reaped_files_total', 'counter', 'Files deleted by the storage reaper', [({}, reaper['deleted'])])
+        ])
+    return families
+
+metrics.add_collector(collect_component_metrics)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/debug/profiler', methods=['GET', 'POST'])
+def debug_profiler():
+    # POST ?action=start（&seconds=N）/ stop で開始・停止し、GET で結果を返す（?format=collapsed でflamegraph用のテキスト）
+    if not PROFILER_ENABLED:
+        abort(404)
+    if request.method == 'POST':
+        action = request.args.get('action', 'start')
+        if action == 'start':
+            seconds = min(request.args.get('seconds', PROFILER_MAX_SECONDS, type=float), PROFILER_MAX_SECONDS)
+            if not profiler.start(duration=seconds):
+                return jsonify({'error': 'Profiler is already running'}), 409
+        elif action == 'stop':
+            profiler.stop()
+        else:
+            return jsonify({'error': 'Invalid action (expected start or stop)'}), 400
+    if request.args.get('format') == 'collapsed':
+        return Response(profiler.collapsed(), mimetype='text/plain')
+    return jsonify(profiler.snapshot(limit=request.args.get('limit', 50, type=int)))
+
+# python app.py で起動した場合、spawn で起動した推論ワーカーはこのファイルを __mp_main__ として読み込むため、
+# ワーカー内ではスレッドの起動やモデルのロードを行わない
+if __name__ != '__mp_main__':
+    # 期限切れ・容量超過のファイルを定期的に削除
+    if not IN_MEMORY_UPLOADS:
+        storage_reaper.start()
+    if detection_cache_reaper is not None:
+        detection_cache_reaper.start()
+    
+    # インポート時間（モデルのロードを除く）を記録し、目標を超えた場合は警告
+    startup_timings['import_ms'] = (time.perf_counter() - _import_started) * 1000.0
+    if startup_timings['import_ms'] > IMPORT_TIME_BUDGET_MS:
+        print(f"Warning: import took {startup_timings['import_ms']:.0f} ms (budget {IMPORT_TIME_BUDGET_MS:.0f} ms)")
+    
+    if STARTUP_MODE == 'background':
+        threading.Thread(target=lambda: (load_inference_model(), warm_up()), name='model-loader', daemon=True).start()
+    else:
+        # ウォームアップは fork 後の各ワーカーで行う（gunicorn.conf.py の post_worker_init）
+        load_inference_model()
 
 if __name__ == '__main__':
     print("Starting Flask app...")
     print("YOLO model loading...")
+    warm_up()
     app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,88 @@
+import os
+import shutil
+import numpy as np
+
+# 対応する推論バックエンド（torch以外は初回起動時にエクスポートしてキャッシュする）
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+def describe_model(model_name, backend='torch', int8=False):
+    """
+    キャッシュキーやレスポンスに使うモデル識別子を返す
+    """
+    if backend == 'torch':
+        return model_name
+    return f"{model_name}:{backend}{':int8' if int8 else ''}"
+
+
+def result_array(result):
+    """
+    YOLOの結果の検出ボックスを (N, 6: x1, y1, x2, y2, conf, cls) の配列にする
+    """
+    if result.boxes is None:
+        return np.zeros((0, 6), dtype=np.float32)
+    # トラッキングIDの列がある場合は除く
+    return result.boxes.data.cpu().numpy()[:, [0, 1, 2, 3, -2, -1]]
+
+
+def exported_model_path(model_name, backend, int8=False, export_dir='models'):
+    """
+    エクスポート済みモデルの保存先を返す
+    """
+    stem = os.path.splitext(os.path.basename(model_name))[0]
+    suffix = '_int8' if int8 else ''
+    if backend == 'onnx':
+        return os.path.join(export_dir, f'{stem}{suffix}.onnx')
+    # OpenVINOはディレクトリ形式（名前は ultralytics の規約 *_openvino_model に合わせる）
+    return os.path.join(export_dir, f'{stem}{suffix}_openvino_model')
+
+
+def export_model(model_name, backend, int8=False, export_dir='models', imgsz=640, int8_data='coco128.yaml'):
+    """
+    PyTorchモデルを指定バックエンド向けにエクスポートし、保存先のパスを返す
+    """
+    from ultralytics import YOLO
+    target = exported_model_path(model_name, backend, int8, export_dir)
+    os.makedirs(export_dir, exist_ok=True)
+    source = YOLO(model_name)
+
+    if backend == 'onnx':
+        # バッチ推論のためバッチ次元を動的にする
+        exported = source.export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        if int8:
+            # ONNXは重みの動的量子化でINT8化する
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(exported, target, weight_type=QuantType.QUInt8)
+        # 量子化元のFP32モデルも .pt の隣には残さず、export_dir のFP32用の名前に移す（INT8と取り違えないため）
+        fp32_target = exported_model_path(model_name, backend, False, export_dir)
+        if int8 and os.path.exists(fp32_target):
+            os.remove(exported)
+        else:
+            shutil.move(exported, fp32_target)
+        return target
+
+    exported = source.export(format='openvino', imgsz=imgsz, dynamic=True, int8=int8, data=int8_data if int8 else None)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    shutil.move(exported, target)
+    return target
+
+
+def load_model(model_name, backend='torch', int8=False, export_dir='models', imgsz=640, int8_data='coco128.yaml'):
+    """
+    設定されたバックエンドでモデルをロードする
+
+    エクスポート済みのモデルがなければ1回だけエクスポートし、以降はそれを再利用する
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    # ultralytics（torch）のインポートは数秒かかるため、モデルをロードする時点まで遅延させる
+    from ultralytics import YOLO
+    if backend == 'torch':
+        return YOLO(model_name)
+
+    path = exported_model_path(model_name, backend, int8, export_dir)
+    if not os.path.exists(path):
+        print(f"Exporting {model_name} for {backend}{' (INT8)' if int8 else ''}...")
+        path = export_model(model_name, backend, int8, export_dir, imgsz, int8_data)
+    return YOLO(path, task='detect')
@@ -0,0 +1,213 @@
+import os
+import threading
+import time
+import queue
+from collections import Counter, deque
+from concurrent.futures import Future
+
+
+class QueueFullError(RuntimeError):
+    """
+    推論キューが上限に達していて新しいリクエストを受け付けられない
+    """
+
+
+class LatencyTracker:
+    """
+    直近のサンプルを保持してパーセンタイルを計算する簡易トラッカー
+    """
+
+    def __init__(self, max_samples=2048):
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count, total = self.count, self.total
+        if not samples:
+            return {'count': count, 'avg_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+
+        def pct(p):
+            index = min(len(samples) - 1, int(round(p / 100.0 * (len(samples) - 1))))
+            return samples[index] * 1000.0
+
+        return {
+            'count': count,
+            'avg_ms': total / count * 1000.0,
+            'p50_ms': pct(50),
+            'p95_ms': pct(95),
+            'p99_ms': pct(99),
+            'max_ms': samples[-1] * 1000.0
+        }
+
+
+class _Request:
+    __slots__ = ('item', 'future', 'enqueued_at')
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class BatchScheduler:
+    """
+    リクエストをキューに溜め、最大バッチサイズか最大待ち時間に達した時点で
+    まとめて推論関数に渡すマイクロバッチスケジューラ
+
+    infer_fn はアイテムのリストを受け取り、同じ順序で結果のリストを返すこと
+    num_threads を増やすと複数のバッチを並行して infer_fn に渡す（推論ワーカーが複数ある場合）
+    max_queue を超えて投入しようとすると QueueFullError を送出する（0 は無制限）
+
+    スレッドは最初の投入時にそのプロセス内で起動する（gunicorn の preload で fork された場合にも動作するように）
+    """
+
+    def __init__(self, infer_fn, max_batch_size=8, max_wait_ms=15.0, num_threads=1, max_queue=0, name='batch-scheduler'):
+        self.infer_fn = infer_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.max_queue = max(0, int(max_queue))
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self.batch_sizes = Counter()
+        self.stage_latency = {
+            'queue_wait': LatencyTracker(),
+            'inference': LatencyTracker(),
+            'total': LatencyTracker()
+        }
+        self.errors = 0
+        self.rejected = 0
+        self.name = name
+        self.num_threads = max(1, int(num_threads))
+        self._threads = []
+        self._pid = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # fork 前のスレッドは子プロセスに引き継がれないため、このプロセスで起動し直す
+            self._threads = [
+                threading.Thread(target=self._run, name=f'{self.name}-{index}', daemon=True)
+                for index in range(self.num_threads)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, item):
+        """
+        アイテムをキューに投入し Future を返す
+        """
+        if self._stopped.is_set():
+            raise RuntimeError('BatchScheduler is stopped')
+        if self.max_queue and self._queue.qsize() >= self.max_queue:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFullError('Inference queue is full')
+        self._ensure_started()
+        request = _Request(item)
+        self._queue.put(request)
+        return request.future
+
+    def __call__(self, item, timeout=None):
+        """
+        アイテムを投入し、結果が返るまでブロックする
+        """
+        return self.submit(item).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=1.0):
+        self._stopped.set()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _collect_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # 停止要求はバッチ処理後に反映する（他のスレッド向けに戻しておく）
+                self._stopped.set()
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._process(batch)
+            if self._stopped.is_set() and self._queue.empty():
+                break
+
+    def _process(self, batch):
+        started = time.perf_counter()
+        for request in batch:
+            self.stage_latency['queue_wait'].observe(started - request.enqueued_at)
+        with self._lock:
+            self.batch_sizes[len(batch)] += 1
+
+        try:
+            results = self.infer_fn([request.item for request in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f'infer_fn returned {len(results)} results for a batch of {len(batch)}')
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        self.stage_latency['inference'].observe(finished - started)
+        for request, result in zip(batch, results):
+            self.stage_latency['total'].observe(finished - request.enqueued_at)
+            request.future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            histogram = dict(sorted(self.batch_sizes.items()))
+            errors = self.errors
+            rejected = self.rejected
+        batches = sum(histogram.values())
+        items = sum(size * count for size, count in histogram.items())
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'queue_depth': self.queue_depth(),
+            'max_queue': self.max_queue,
+            'threads': self.num_threads,
+            'batches': batches,
+            'items': items,
+            'avg_batch_size': items / batches if batches else 0.0,
+            'batch_size_histogram': {str(size): count for size, count in histogram.items()},
+            'errors': errors,
+            'rejected': rejected,
+            'latency': {stage: tracker.snapshot() for stage, tracker in self.stage_latency.items()}
+        }
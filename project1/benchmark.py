@@ -0,0 +1,466 @@
+"""
+検出サービスのベンチマーク・負荷試験
+
+固定の画像セットに対して以下を計測し、結果をJSONで保存する（コミット間の比較用）
+
+- stages: ステージ別（デコード・前処理・推論・後処理・描画・エンコード・ディスク書き込み）の処理時間
+- detect_objects: detect_objects() を直接呼び出した場合のスループットとレイテンシ
+- upload: Flaskのテストクライアント経由の POST /upload
+- gunicorn: 実際にgunicornを起動し、HTTPで POST /upload
+
+    python benchmark.py --images samples/ --output results/base.json
+    python benchmark.py --images samples/ --modes upload gunicorn --concurrency 1 4 16
+    python benchmark.py --images samples/ --output results/new.json --compare results/base.json
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import resource
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MODES = ('stages', 'detect_objects', 'upload', 'gunicorn')
+
+
+def load_corpus(directory):
+    """
+    画像ディレクトリから (ファイル名, バイト列) のリストを名前順で返す
+    """
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(directory, name), 'rb') as f:
+                corpus.append((name, f.read()))
+    return corpus
+
+
+def summarize(latencies, elapsed=None):
+    """
+    レイテンシ（秒）のリストから images/sec と分位点（ミリ秒）を求める
+
+    elapsed（並行実行時の経過時間）を指定した場合はそれを基準にスループットを求める
+    """
+    if not latencies:
+        return {'count': 0}
+    samples = np.array(latencies) * 1000.0
+    elapsed = elapsed if elapsed is not None else samples.sum() / 1000.0
+    return {
+        'count': len(samples),
+        'images_per_sec': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max())
+    }
+
+
+def peak_rss_mb():
+    # このプロセスの最大常駐メモリ（Linuxでは ru_maxrss はKB単位）
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def process_tree_peak_rss_mb(root_pid):
+    """
+    指定プロセスとその子プロセスの最大常駐メモリ（VmHWM）の合計を返す（Linuxのみ）
+    """
+    parents = {}
+    peaks = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/status', encoding='utf-8') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+        except OSError:
+            continue
+        parents[int(entry)] = int(fields['PPid'])
+        if 'VmHWM' in fields:
+            peaks[int(entry)] = int(fields['VmHWM'].split()[0])
+
+    tree = {root_pid}
+    changed = True
+    while changed:
+        children = {pid for pid, parent in parents.items() if parent in tree} - tree
+        tree |= children
+        changed = bool(children)
+    return sum(peaks.get(pid, 0) for pid in tree) / 1024.0
+
+
+def run_concurrently(fn, items, concurrency):
+    """
+    items の各要素に fn を concurrency 並列で適用し、(レイテンシのリスト, エラー数, 経過時間) を返す
+    """
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def call(item):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            ok = fn(item)
+        except Exception as e:
+            print(f"Error in benchmark request: {str(e)}", file=sys.stderr)
+            ok = False
+        latency = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, items))
+    return latencies, errors, time.perf_counter() - started
+
+
+def configure_batching(app, batch_size):
+    """
+    アプリの推論スケジューラ（モデルごと）を指定した最大バッチサイズで作り直す
+    """
+    import functools
+    from batching import BatchScheduler
+    for scheduler in app.batch_schedulers or []:
+        scheduler.stop()
+    app.batch_schedulers = [
+        BatchScheduler(
+            functools.partial(app.run_model_batch, variant=variant),
+            max_batch_size=batch_size,
+            max_wait_ms=app.BATCH_MAX_WAIT_MS,
+            num_threads=max(1, app.INFERENCE_WORKERS),
+            max_queue=0,
+            name=f'batch-scheduler-{variant}'
+        )
+        for variant in range(len(app.MODEL_VARIANTS))
+    ]
+
+
+def bench_stages(app, corpus, batch_sizes, runs):
+    """
+    処理をステージごとに分けて実行し、画像1枚あたりの各ステージの処理時間を計測する
+
+    preprocess / inference / postprocess はモデル内部（ultralytics）の計測値を使う
+    """
+    import cv2
+    from preprocess import decode_image, draw_detections
+    from storage import LocalStorage
+
+    target_size = app.MODEL_INPUT_SIZE if app.PREPROCESS_ENABLED else None
+    storage = LocalStorage(tempfile.mkdtemp(prefix='bench-write-'))
+    reports = []
+
+    for batch_size in batch_sizes:
+        stages = {name: [] for name in (
+            'decode', 'preprocess', 'inference', 'postprocess', 'detections', 'plot', 'encode', 'disk_write', 'total'
+        )}
+        for _ in range(runs):
+            for start in range(0, len(corpus), batch_size):
+                chunk = corpus[start:start + batch_size]
+                started = time.perf_counter()
+
+                images = []
+                for _, data in chunk:
+                    stage_started = time.perf_counter()
+                    images.append(decode_image(data, target_size))
+                    stages['decode'].append(time.perf_counter() - stage_started)
+
+                if app.inference_pool is None:
+                    results = app.models[0](
+                        [image for image, _ in images], conf=app.CONFIDENCE_THRESHOLD, iou=app.IOU_THRESHOLD, verbose=False
+                    )
+                    # ultralytics が計測したバッチ内の1枚あたりの時間（ミリ秒）
+                    speeds = [result.speed for result in results]
+                    arrays = [app.result_array(result) for result in results]
+                else:
+                    # ワーカープールは検出結果の配列だけを返すため、推論全体（転送込み）の時間を1枚あたりに割り振る
+                    stage_started = time.perf_counter()
+                    arrays = app.run_model_batch([image for image, _ in images])
+                    speeds = [{'inference': (time.perf_counter() - stage_started) * 1000.0 / len(arrays)}] * len(arrays)
+                for (name, _), (image, scale), boxes, speed in zip(chunk, images, arrays, speeds):
+                    for stage in ('preprocess', 'inference', 'postprocess'):
+                        stages[stage].append(speed.get(stage, 0.0) / 1000.0)
+
+                    stage_started = time.perf_counter()
+                    app.detections_from_array(boxes, scale)
+                    stages['detections'].append(time.perf_counter() - stage_started)
+
+                    stage_started = time.perf_counter()
+                    annotated_image = draw_detections(image.copy(), boxes, app.model_names)
+                    stages['plot'].append(time.perf_counter() - stage_started)
+
+                    extension = app.output_extension(name.rsplit('.', 1)[1].lower())
+                    stage_started = time.perf_counter()
+                    ok, encoded = cv2.imencode(f'.{extension}', annotated_image)
+                    stages['encode'].append(time.perf_counter() - stage_started)
+
+                    stage_started = time.perf_counter()
+                    storage.put(f'{uuid.uuid4()}_output.{extension}', encoded.tobytes())
+                    stages['disk_write'].append(time.perf_counter() - stage_started)
+
+                elapsed = time.perf_counter() - started
+                stages['total'].extend([elapsed / len(chunk)] * len(chunk))
+
+        reports.append({
+            'mode': 'stages',
+            'batch_size': batch_size,
+            'stages': {name: summarize(latencies) for name, latencies in stages.items()},
+            'peak_rss_mb': peak_rss_mb()
+        })
+    return reports
+
+
+def bench_detect_objects(app, corpus, batch_sizes, concurrency_levels, runs):
+    input_dir = tempfile.mkdtemp(prefix='bench-input-')
+    output_dir = tempfile.mkdtemp(prefix='bench-output-')
+    paths = []
+    for name, data in corpus:
+        path = os.path.join(input_dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        paths.append(path)
+
+    def call(path):
+        output_path = os.path.join(output_dir, f'{uuid.uuid4()}_{os.path.basename(path)}')
+        _, success = app.detect_objects(path, output_path)
+        return success
+
+    reports = []
+    for batch_size in batch_sizes:
+        configure_batching(app, batch_size)
+        for concurrency in concurrency_levels:
+            latencies, errors, elapsed = run_concurrently(call, paths * runs, concurrency)
+            reports.append({
+                'mode': 'detect_objects',
+                'batch_size': batch_size,
+                'concurrency': concurrency,
+                'errors': errors,
+                **summarize(latencies, elapsed),
+                'peak_rss_mb': peak_rss_mb()
+            })
+    return reports
+
+
+def bench_upload(app, corpus, batch_sizes, concurrency_levels, runs, render):
+    local = threading.local()
+
+    def call(item):
+        name, data = item
+        # テストクライアントはスレッドごとに作成する
+        if not hasattr(local, 'client'):
+            local.client = app.app.test_client()
+        response = local.client.post(
+            f'/upload?render={render}',
+            data={'file': (io.BytesIO(data), name)},
+            content_type='multipart/form-data'
+        )
+        return response.status_code == 200
+
+    reports = []
+    for batch_size in batch_sizes:
+        configure_batching(app, batch_size)
+        for concurrency in concurrency_levels:
+            latencies, errors, elapsed = run_concurrently(call, corpus * runs, concurrency)
+            reports.append({
+                'mode': 'upload',
+                'render': render,
+                'batch_size': batch_size,
+                'concurrency': concurrency,
+                'errors': errors,
+                **summarize(latencies, elapsed),
+                'peak_rss_mb': peak_rss_mb()
+            })
+    return reports
+
+
+def encode_multipart(name, data):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    return body, f'multipart/form-data; boundary={boundary}'
+
+
+def start_gunicorn(port, batch_size, args):
+    env = dict(
+        os.environ,
+        BIND=f'127.0.0.1:{port}',
+        BATCH_MAX_SIZE=str(batch_size),
+        WEB_CONCURRENCY=str(args.gunicorn_workers),
+        GUNICORN_THREADS=str(args.gunicorn_threads)
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    # 全ワーカーの準備完了を待つ（/readyz はモデルのロードとウォームアップが終わると200を返す）
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {process.returncode}')
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{port}/readyz', timeout=1.0) as response:
+                if response.status == 200:
+                    return process
+        except (urllib.error.URLError, OSError):
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('gunicorn did not become ready in time')
+
+
+def bench_gunicorn(corpus, batch_sizes, concurrency_levels, runs, render, args):
+    def call(item):
+        name, data = item
+        body, content_type = encode_multipart(name, data)
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{args.port}/upload?render={render}',
+            data=body,
+            headers={'Content-Type': content_type},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=120.0) as response:
+                response.read()
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    reports = []
+    for batch_size in batch_sizes:
+        process = start_gunicorn(args.port, batch_size, args)
+        try:
+            # ワーカーごとのウォームアップが終わっていない場合に備えて1周流しておく
+            run_concurrently(call, corpus, args.gunicorn_workers)
+            for concurrency in concurrency_levels:
+                latencies, errors, elapsed = run_concurrently(call, corpus * runs, concurrency)
+                reports.append({
+                    'mode': 'gunicorn',
+                    'render': render,
+                    'batch_size': batch_size,
+                    'concurrency': concurrency,
+                    'workers': args.gunicorn_workers,
+                    'threads': args.gunicorn_threads,
+                    'errors': errors,
+                    **summarize(latencies, elapsed),
+                    'peak_rss_mb': process_tree_peak_rss_mb(process.pid)
+                })
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return reports
+
+
+def scenario_key(report):
+    return tuple(report.get(field) for field in ('mode', 'render', 'batch_size', 'concurrency'))
+
+
+def compare_reports(current, baseline):
+    """
+    同じ条件のシナリオ同士で images/sec と p95 の変化率を求める
+    """
+    previous = {scenario_key(report): report for report in baseline['results']}
+    comparisons = []
+    for report in current['results']:
+        before = previous.get(scenario_key(report))
+        if before is None or 'images_per_sec' not in report or 'images_per_sec' not in before:
+            continue
+        comparisons.append({
+            'mode': report['mode'],
+            'batch_size': report.get('batch_size'),
+            'concurrency': report.get('concurrency'),
+            'images_per_sec_change': report['images_per_sec'] / before['images_per_sec'] - 1.0 if before['images_per_sec'] else None,
+            'p95_ms_change': report['p95_ms'] / before['p95_ms'] - 1.0 if before['p95_ms'] else None
+        })
+    return {'baseline_commit': baseline.get('commit'), 'scenarios': comparisons}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark and load-test the detection service')
+    parser.add_argument('--images', required=True, help='directory of sample images')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['stages', 'detect_objects', 'upload'])
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--runs', type=int, default=3, help='passes over the image set per scenario')
+    parser.add_argument('--render', choices=('none', 'lazy', 'eager'), default='eager', help='render mode for /upload')
+    parser.add_argument('--port', type=int, default=5055, help='port for the gunicorn mode')
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--gunicorn-threads', type=int, default=8)
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--output', help='write the report as JSON to this path')
+    parser.add_argument('--compare', help='baseline JSON report to compare against')
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.images)
+    if not corpus:
+        print(f"No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    # 同じ画像を繰り返し送るため、キャッシュを無効にして毎回推論させる
+    os.environ['DETECTION_CACHE_ENABLED'] = '0'
+
+    results = []
+    in_process = [mode for mode in args.modes if mode != 'gunicorn']
+    if in_process:
+        started = time.perf_counter()
+        import app
+        app.warm_up()
+        print(f"App loaded in {(time.perf_counter() - started) * 1000.0:.0f} ms", file=sys.stderr)
+        if 'stages' in in_process:
+            results.extend(bench_stages(app, corpus, args.batch_sizes, args.runs))
+        if 'detect_objects' in in_process:
+            results.extend(bench_detect_objects(app, corpus, args.batch_sizes, args.concurrency, args.runs))
+        if 'upload' in in_process:
+            results.extend(bench_upload(app, corpus, args.batch_sizes, args.concurrency, args.runs, args.render))
+    if 'gunicorn' in args.modes:
+        results.extend(bench_gunicorn(corpus, args.batch_sizes, args.concurrency, args.runs, args.render, args))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'images': len(corpus),
+        'runs': args.runs,
+        'results': results
+    }
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report['comparison'] = compare_reports(report, json.load(f))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
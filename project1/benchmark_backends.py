@@ -0,0 +1,158 @@
+"""
+推論バックエンドの比較ベンチマーク
+
+PyTorchモデルとエクスポート済みモデル（ONNX Runtime / OpenVINO）を同じ画像で実行し、
+推論時間と検出結果の一致率を比較する
+
+    python benchmark_backends.py --images samples/ --backend onnx
+    python benchmark_backends.py --images samples/ --backend openvino --int8 --output result.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from backends import BACKENDS, describe_model, load_model
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def box_iou(a, b):
+    """
+    2つのボックス集合 (N, 4), (M, 4) のIoU行列を返す
+    """
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)))
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def match_detections(reference, candidate, iou_threshold):
+    """
+    同じクラスでIoUがしきい値以上のボックスを貪欲に対応付け、(一致数, 信頼度差のリスト) を返す
+    """
+    ref = reference.boxes.data.cpu().numpy()
+    cand = candidate.boxes.data.cpu().numpy()
+    if len(ref) == 0 or len(cand) == 0:
+        return 0, []
+
+    iou = box_iou(ref[:, :4], cand[:, :4])
+    iou[ref[:, -1][:, None] != cand[:, -1][None, :]] = 0.0
+    matched = 0
+    confidence_deltas = []
+    used = set()
+    for i in np.argsort(-ref[:, -2]):
+        j = int(np.argmax(iou[i]))
+        if iou[i, j] >= iou_threshold and j not in used:
+            used.add(j)
+            matched += 1
+            confidence_deltas.append(abs(float(ref[i, -2]) - float(cand[j, -2])))
+            iou[:, j] = 0.0
+    return matched, confidence_deltas
+
+
+def time_model(model, images, conf, runs):
+    """
+    画像ごとの推論時間と、1回目のパスの結果を返す
+    """
+    latencies = []
+    results = []
+    for run in range(runs):
+        for image in images:
+            started = time.perf_counter()
+            result = model(image, conf=conf, verbose=False)[0]
+            latencies.append(time.perf_counter() - started)
+            if run == 0:
+                results.append(result)
+    return latencies, results
+
+
+def summarize(latencies):
+    samples = np.array(latencies) * 1000.0
+    return {
+        'images_per_sec': len(samples) / (samples.sum() / 1000.0),
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99))
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare inference backends against the PyTorch model')
+    parser.add_argument('--images', required=True, help='directory of sample images')
+    parser.add_argument('--backend', choices=[b for b in BACKENDS if b != 'torch'], required=True)
+    parser.add_argument('--int8', action='store_true', help='use the INT8 quantized export')
+    parser.add_argument('--model', default='yolov8n.pt')
+    parser.add_argument('--export-dir', default='models')
+    parser.add_argument('--conf', type=float, default=0.25)
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU threshold for matching detections')
+    parser.add_argument('--runs', type=int, default=3, help='timed passes over the image set')
+    parser.add_argument('--output', help='write the report as JSON to this path')
+    args = parser.parse_args()
+
+    import cv2
+    paths = sorted(
+        os.path.join(args.images, name) for name in os.listdir(args.images)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    images = [cv2.imread(path) for path in paths]
+    if not images:
+        print(f"No images found in {args.images}", file=sys.stderr)
+        return 1
+
+    reference_model = load_model(args.model, 'torch')
+    candidate_model = load_model(args.model, args.backend, int8=args.int8, export_dir=args.export_dir)
+
+    # ウォームアップ（初回推論のコストを計測から除外）
+    reference_model(images[0], verbose=False)
+    candidate_model(images[0], verbose=False)
+
+    reference_latencies, reference_results = time_model(reference_model, images, args.conf, args.runs)
+    candidate_latencies, candidate_results = time_model(candidate_model, images, args.conf, args.runs)
+
+    reference_total = 0
+    candidate_total = 0
+    matched_total = 0
+    confidence_deltas = []
+    for reference, candidate in zip(reference_results, candidate_results):
+        matched, deltas = match_detections(reference, candidate, args.iou)
+        reference_total += len(reference.boxes)
+        candidate_total += len(candidate.boxes)
+        matched_total += matched
+        confidence_deltas.extend(deltas)
+
+    report = {
+        'images': len(images),
+        'runs': args.runs,
+        'reference': {'model': describe_model(args.model), **summarize(reference_latencies)},
+        'candidate': {'model': describe_model(args.model, args.backend, args.int8), **summarize(candidate_latencies)},
+        'equivalence': {
+            'iou_threshold': args.iou,
+            'reference_detections': reference_total,
+            'candidate_detections': candidate_total,
+            'matched': matched_total,
+            'recall': matched_total / reference_total if reference_total else 1.0,
+            'precision': matched_total / candidate_total if candidate_total else 1.0,
+            'mean_confidence_delta': float(np.mean(confidence_deltas)) if confidence_deltas else 0.0
+        }
+    }
+    report['speedup'] = report['candidate']['images_per_sec'] / report['reference']['images_per_sec']
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
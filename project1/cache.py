@@ -0,0 +1,199 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+def make_cache_key(data, **settings):
+    """
+    画像バイト列と推論設定からキャッシュキー（SHA-256）を生成
+    """
+    digest = hashlib.sha256(data)
+    for name in sorted(settings):
+        digest.update(f'\0{name}={settings[name]}'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DetectionCache:
+    """
+    検出結果と注釈付き画像を保持するキャッシュ
+
+    メモリ上のLRU（件数・容量上限付き）と、再起動後も残るディスク上の任意の第2層で構成される。
+    ディスク層の保存期間・容量の上限は list_shards / iter_entries / delete を使って StorageReaper で管理する
+    """
+
+    def __init__(self, max_entries=512, max_bytes=256 * 1024 * 1024, disk_dir=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        エントリ {'detections', 'output', 'mimetype', 'render'} を返す。存在しない場合は None
+
+        注釈付き画像を描画しなかったエントリの output は None（render は後から描画するための検出ボックスなど）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+        entry = self._load_from_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+        # ディスクから読めたものはメモリ層に昇格
+        self._put_memory(key, entry)
+        return entry
+
+    def put(self, key, detections, output, mimetype, render=None):
+        entry = {'detections': detections, 'output': output, 'mimetype': mimetype, 'render': render}
+        self._put_memory(key, entry)
+        if self.disk_dir:
+            self._save_to_disk(key, entry)
+
+    def set_output(self, key, output, mimetype):
+        """
+        既存のエントリに後から描画した注釈付き画像を追加する（エントリがなければ何もしない）
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = self._load_from_disk(key)
+        if entry is not None:
+            self.put(key, entry['detections'], output, mimetype, entry['render'])
+
+    def _put_memory(self, key, entry):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)['output'] or b'')
+            self._entries[key] = entry
+            self._bytes += len(entry['output'] or b'')
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted['output'] or b'')
+
+    def _disk_paths(self, key):
+        shard = os.path.join(self.disk_dir, key[:2])
+        return shard, os.path.join(shard, f'{key}.json'), os.path.join(shard, f'{key}.bin')
+
+    def _load_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        _, meta_path, data_path = self._disk_paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            output = None
+            if meta.get('has_output', True):
+                with open(data_path, 'rb') as f:
+                    output = f.read()
+        except (OSError, ValueError):
+            return None
+        return {'detections': meta['detections'], 'output': output, 'mimetype': meta['mimetype'], 'render': meta.get('render')}
+
+    def _save_to_disk(self, key, entry):
+        shard, meta_path, data_path = self._disk_paths(key)
+        try:
+            os.makedirs(shard, exist_ok=True)
+            # 画像本体を先に書き、メタデータの置き換えを最後に行う（途中で落ちても壊れたエントリを読まない）
+            if entry['output'] is not None:
+                self._atomic_write(shard, data_path, entry['output'])
+            meta = json.dumps({
+                'detections': entry['detections'],
+                'mimetype': entry['mimetype'],
+                'has_output': entry['output'] is not None,
+                'render': entry['render']
+            }, ensure_ascii=False)
+            self._atomic_write(shard, meta_path, meta.encode('utf-8'))
+        except OSError as e:
+            print(f"Error writing detection cache: {str(e)}")
+
+    def list_shards(self):
+        """
+        ディスク層の分散ディレクトリ（キーの先頭2桁）のリストを返す
+        """
+        if not self.disk_dir:
+            return []
+        with os.scandir(self.disk_dir) as entries:
+            return sorted(entry.name for entry in entries if entry.is_dir())
+
+    def iter_entries(self, shard):
+        """
+        1つの分散ディレクトリにあるディスク層のエントリの (キー, サイズ, 更新時刻) を列挙する（サイズはメタデータと画像の合計）
+        """
+        directory = os.path.join(self.disk_dir, shard)
+        try:
+            with os.scandir(directory) as dir_entries:
+                filenames = [entry.name for entry in dir_entries if entry.is_file()]
+        except FileNotFoundError:
+            return
+        entries = {}
+        for filename in filenames:
+            key, ext = os.path.splitext(filename)
+            if ext not in ('.json', '.bin'):
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, filename))
+            except FileNotFoundError:
+                continue
+            size, mtime = entries.get(key, (0, 0.0))
+            entries[key] = (size + stat.st_size, max(mtime, stat.st_mtime))
+        for key, (size, mtime) in entries.items():
+            yield key, size, mtime
+
+    def delete(self, key):
+        """
+        ディスク層のエントリを削除する（メモリ層はそのまま）
+        """
+        if not self.disk_dir:
+            return
+        _, meta_path, data_path = self._disk_paths(key)
+        # メタデータを先に消し、画像だけが消えたエントリを読まないようにする
+        for path in (meta_path, data_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _atomic_write(directory, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'disk_tier': bool(self.disk_dir),
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,31 @@
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+
+# 状態をWebプロセス内にしか持たない設定では、ワーカーを1つに固定する（他のワーカーに届いたリクエストが404になるため）
+single_process_reasons = []
+if os.getenv('IN_MEMORY_UPLOADS', '0') == '1':
+    single_process_reasons.append('IN_MEMORY_UPLOADS=1 keeps results in process memory')
+if os.getenv('INFERENCE_WORKERS', '0') != '0':
+    # Webワーカーごとに推論ワーカープールを起動すると、モデルのプロセス数がワーカー数倍になる
+    single_process_reasons.append('INFERENCE_WORKERS starts one inference pool per web worker')
+if single_process_reasons and workers > 1:
+    print(f"Using 1 worker instead of {workers}: {'; '.join(single_process_reasons)}")
+    workers = 1
+
+# モデルをマスターで1回だけロードし、ワーカーとはコピーオンライトで共有する
+# （推論ワーカープール使用時やバックグラウンド起動時はWebプロセスでモデルを持たないため無効）
+preload_app = os.getenv('INFERENCE_WORKERS', '0') == '0' and os.getenv('STARTUP_MODE', 'eager') == 'eager'
+
+
+def post_worker_init(worker):
+    # リクエストを受け付ける前にダミー推論でウォームアップする（バックグラウンド起動時はローダースレッドが行う）
+    import app
+    if app.STARTUP_MODE == 'background':
+        return
+    app.warm_up()
+    worker.log.info("Model warmed up in %.0f ms", app.startup_timings.get('warmup_ms', 0.0))
@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from batching import QueueFullError
+
+# 終了状態（これ以上変化しない）
+FINISHED_STATUSES = ('done', 'failed')
+
+# 実行するプロセスが終了したジョブのエラー
+ORPHANED_ERROR = 'Job worker exited'
+
+
+def process_alive(pid):
+    # Windows の os.kill はシグナル 0 でもプロセスを終了させるため確認しない（生存確認の時刻だけで判定する）
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    ジョブの状態をTTL付きで保持する SQLite のストア
+
+    ファイルを共有するすべてのプロセス（gunicornのワーカー）から参照できるため、ジョブを作成したのと別のワーカーに
+    届いた GET /jobs/<id> でも状態を返せる。完了後 ttl 秒経過したジョブと、件数上限を超えた古い完了済みジョブは破棄される。
+
+    未完了のジョブには実行するプロセス（ホスト名・PID）と最後の生存確認の時刻を記録し、プロセスが終了している、
+    または stale_after 秒以上生存確認がないジョブは failed として扱う。読み出し（get / wait）は書き込みを行わず、
+    破棄と failed への書き換えは create でまとめて行う
+    """
+
+    def __init__(self, path, ttl=600.0, max_jobs=10000, poll_interval=0.5, stale_after=60.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.host = socket.gethostname()
+        self._local = threading.local()
+        # 同じプロセス内の待機者は更新時にすぐ起こす（他のプロセスの更新は poll_interval 秒ごとに確認する）
+        self._condition = threading.Condition()
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, created_at REAL NOT NULL, '
+                'finished_at REAL, version INTEGER NOT NULL, fields TEXT NOT NULL, '
+                'owner_host TEXT, owner_pid INTEGER, heartbeat_at REAL)'
+            )
+            # 実行プロセスの列がない以前のファイルには列を追加する
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(jobs)')}
+            for column, column_type in (('owner_host', 'TEXT'), ('owner_pid', 'INTEGER'), ('heartbeat_at', 'REAL')):
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+            connection.execute('CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30.0)
+            self._local.connection = connection
+        return connection
+
+    def create(self, **fields):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        connection = self._connect()
+        with connection:
+            self._purge(connection)
+            connection.execute(
+                'INSERT INTO jobs (id, status, created_at, finished_at, version, fields, owner_host, owner_pid, heartbeat_at) '
+                'VALUES (?, ?, ?, NULL, 0, ?, ?, ?, ?)',
+                (job_id, 'queued', now, json.dumps(fields), self.host, os.getpid(), now)
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        connection = self._connect()
+        with connection:
+            row = connection.execute('SELECT status, fields FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is None:
+                return
+            status = fields.pop('status', row[0])
+            stored = json.loads(row[1])
+            stored.update(fields)
+            finished_at = time.time() if status in FINISHED_STATUSES else None
+            connection.execute(
+                'UPDATE jobs SET status = ?, version = version + 1, fields = ?, '
+                'finished_at = COALESCE(finished_at, ?), heartbeat_at = ? WHERE id = ?',
+                (status, json.dumps(stored), finished_at, time.time(), job_id)
+            )
+        with self._condition:
+            self._condition.notify_all()
+
+    def heartbeat(self):
+        """
+        このプロセスが実行する未完了のジョブの生存確認の時刻を更新する
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                'UPDATE jobs SET heartbeat_at = ? WHERE owner_host = ? AND owner_pid = ? AND finished_at IS NULL',
+                (time.time(), self.host, os.getpid())
+            )
+
+    def get(self, job_id):
+        return self._load(self._connect(), job_id)
+
+    def _load(self, connection, job_id):
+        row = connection.execute(
+            'SELECT id, status, created_at, finished_at, version, fields, owner_host, owner_pid, heartbeat_at '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = {
+            'id': row[0],
+            'status': row[1],
+            'created_at': row[2],
+            'finished_at': row[3],
+            'version': row[4],
+            **json.loads(row[5])
+        }
+        if job['status'] not in FINISHED_STATUSES and self._orphaned(row[6], row[7], row[8]):
+            # 実行するプロセスがいなくなったジョブは完了しないため、書き換えを待たずに failed として返す
+            job.update(status='failed', finished_at=row[8], version=row[4] + 1, error=ORPHANED_ERROR)
+        return job
+
+    def _orphaned(self, owner_host, owner_pid, heartbeat_at):
+        if heartbeat_at is None or time.time() - heartbeat_at > self.stale_after:
+            return True
+        # 同じホストのプロセスは終了しているかを直接確認する
+        return owner_host == self.host and owner_pid is not None and not process_alive(owner_pid)
+
+    def wait(self, job_id, version, timeout):
+        """
+        ジョブの version が変わるか timeout 秒経過するまで待ち、最新のジョブを返す
+        """
+        deadline = time.monotonic() + timeout
+        connection = self._connect()
+        while True:
+            job = self._load(connection, job_id)
+            if job is None or job['version'] != version:
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._condition:
+                self._condition.wait(min(remaining, self.poll_interval))
+
+    def _purge(self, connection):
+        # 実行するプロセスがいなくなった未完了のジョブを failed にし、TTL・件数上限の対象にする
+        now = time.time()
+        rows = connection.execute(
+            'SELECT id, fields, owner_host, owner_pid, heartbeat_at FROM jobs WHERE finished_at IS NULL'
+        ).fetchall()
+        for job_id, fields, owner_host, owner_pid, heartbeat_at in rows:
+            if self._orphaned(owner_host, owner_pid, heartbeat_at):
+                connection.execute(
+                    'UPDATE jobs SET status = ?, version = version + 1, fields = ?, finished_at = ? WHERE id = ?',
+                    ('failed', json.dumps(dict(json.loads(fields), error=ORPHANED_ERROR)), now, job_id)
+                )
+        connection.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?', (now - self.ttl,))
+        # 件数上限を超えた場合は古い完了済みジョブから破棄（実行中のジョブは残す）
+        excess = connection.execute('SELECT COUNT(*) FROM jobs').fetchone()[0] - self.max_jobs
+        if excess > 0:
+            connection.execute(
+                'DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE finished_at IS NOT NULL '
+                'ORDER BY created_at LIMIT ?)',
+                (excess,)
+            )
+
+    def stats(self):
+        rows = self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall()
+        counts = dict(rows)
+        return {'jobs': sum(counts.values()), 'ttl_seconds': self.ttl, 'by_status': counts}
+
+
+class JobRunner:
+    """
+    バックグラウンドのスレッドプールでジョブを実行する
+
+    未完了のジョブが max_pending に達すると QueueFullError を送出する。未完了のジョブがある間は
+    ストアの stale_after の 1/3 ごとに生存確認の時刻を更新する
+    """
+
+    def __init__(self, store, max_workers=4, max_pending=256):
+        self.store = store
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job-worker')
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+
+    def submit(self, fn, *args, **fields):
+        """
+        fn(*args) を実行するジョブを作成してIDを返す。fn の戻り値がジョブの result になる
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError('Job queue is full')
+            self._pending += 1
+            # 生存確認のスレッドは最初のジョブで起動する（ジョブを受け付けないプロセスでは起動しない）
+            if self._heartbeat_thread is None:
+                self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True)
+                self._heartbeat_thread.start()
+        job_id = self.store.create(**fields)
+        self._executor.submit(self._run, job_id, fn, args)
+        return job_id
+
+    def _run(self, job_id, fn, args):
+        try:
+            self.store.update(job_id, status='running')
+            result = fn(*args)
+            self.store.update(job_id, status='done', result=result)
+        except Exception as e:
+            print(f"Error in job {job_id}: {str(e)}")
+            if isinstance(e, QueueFullError):
+                message = 'Server busy'
+            elif isinstance(e, ValueError):
+                message = str(e)
+            else:
+                message = 'Object detection failed'
+            self.store.update(job_id, status='failed', error=message)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(self.store.stale_after / 3)
+            if not self.pending():
+                continue
+            try:
+                self.store.heartbeat()
+            except sqlite3.Error as e:
+                print(f"Error updating job heartbeat: {str(e)}")
+
+    def pending(self):
+        with self._lock:
+            return self._pending
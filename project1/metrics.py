@@ -0,0 +1,275 @@
+import sys
+import time
+import bisect
+import threading
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+# レイテンシ用のヒストグラムの既定のバケット（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        lines.extend(self._render_samples(items))
+        return lines
+
+    def _render_samples(self, items):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in items]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount=1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # バケットごとの件数（累積でない）、合計、件数
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][bisect.bisect_left(self.buckets, value)] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _render_samples(self, items):
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Prometheusのテキスト形式で出力するメトリクスの登録先
+
+    collector は出力のたびに呼ばれ、(名前, 種類, 説明, [(ラベルの辞書, 値)]) のリストを返す
+    （キャッシュの統計など、他のコンポーネントが持っている値をそのまま出力するために使う）
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error in metrics collector: {str(e)}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_text = _format_labels(tuple(labels), tuple(labels.values()))
+                    lines.append(f'{name}{label_text} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class SpanRecorder:
+    """
+    処理ステージごとの所要時間を記録する
+
+    ヒストグラムに記録するほか、同じスレッドでトレースを開始していればリクエスト単位の内訳として保持する
+    """
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self._local = threading.local()
+
+    def start_trace(self):
+        self._local.spans = []
+
+    def finish_trace(self):
+        """
+        現在のスレッドのトレースを終了し、[(ステージ名, 秒)] を返す
+        """
+        spans = getattr(self._local, 'spans', None)
+        self._local.spans = None
+        return spans or []
+
+    def record(self, name, seconds):
+        self.histogram.observe(seconds, stage=name)
+        spans = getattr(self._local, 'spans', None)
+        if spans is not None:
+            spans.append((name, seconds))
+
+    @contextmanager
+    def span(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+
+class SamplingProfiler:
+    """
+    実行中の全スレッドのスタックを一定間隔でサンプリングするプロファイラ
+
+    実行中に開始・停止でき、結果は flamegraph.pl などで使える collapsed 形式（"関数;関数;... 回数"）で取得できる
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks = StackCounter()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.samples = 0
+        self.started_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None, reset=True):
+        """
+        サンプリングを開始する（duration 秒経過すると自動的に停止）。既に実行中の場合は False
+        """
+        with self._lock:
+            if self.running:
+                return False
+            if reset:
+                self._stacks.clear()
+                self.samples = 0
+            self._stopped.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, args=(duration,), name='sampling-profiler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stopped.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=1.0)
+        return self.snapshot()
+
+    def _run(self, duration):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stopped.wait(self.interval):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            frames = sys._current_frames()
+            collapsed = []
+            for thread_id, frame in frames.items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                    frame = frame.f_back
+                collapsed.append(';'.join(reversed(stack)))
+            with self._lock:
+                self._stacks.update(collapsed)
+                self.samples += 1
+
+    def snapshot(self, limit=None):
+        with self._lock:
+            stacks = self._stacks.most_common(limit)
+            samples = self.samples
+        return {
+            'running': self.running,
+            'interval_ms': self.interval * 1000.0,
+            'samples': samples,
+            'started_at': self.started_at,
+            'stacks': stacks
+        }
+
+    def collapsed(self):
+        with self._lock:
+            return '\n'.join(f'{stack} {count}' for stack, count in self._stacks.most_common()) + '\n'
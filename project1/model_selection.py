@@ -0,0 +1,99 @@
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# クライアントが指定できる品質ティア
+QUALITY_TIERS = ('fast', 'balanced', 'accurate')
+
+
+class ModelSelector:
+    """
+    品質ティアと負荷状況から推論に使うモデルを選ぶ
+
+    モデルは速い順に並べる。選んだモデルの処理中のリクエスト数が degrade_depth 以上の間は1段ずつ速いモデルに落とし、
+    直近 window 秒のレイテンシのp95が latency_slo_ms を超えているモデルは使わず最速のモデルに切り替える
+    （切り替え先に処理が流れると元のモデルのサンプルは window 秒で期限切れになり、自動的に元のモデルに戻る）
+    """
+
+    def __init__(self, model_ids, default_tier='balanced', degrade_depth=0, latency_slo_ms=0.0,
+                 window=10.0, min_samples=20, refresh_interval=0.5):
+        if default_tier not in QUALITY_TIERS:
+            raise ValueError(f"Unknown quality tier '{default_tier}' (expected one of {', '.join(QUALITY_TIERS)})")
+        self.model_ids = list(model_ids)
+        self.default_tier = default_tier
+        self.degrade_depth = degrade_depth
+        self.latency_slo_ms = latency_slo_ms
+        self.window = window
+        self.min_samples = min_samples
+        self.refresh_interval = refresh_interval
+        self._in_flight = [0] * len(self.model_ids)
+        self._samples = [deque(maxlen=4096) for _ in self.model_ids]
+        self._p95 = [(0.0, 0.0)] * len(self.model_ids)  # (計算した時刻, p95ミリ秒)
+        self._lock = threading.Lock()
+
+    def tier_index(self, tier):
+        count = len(self.model_ids)
+        return {'fast': 0, 'balanced': count // 2, 'accurate': count - 1}[tier]
+
+    def select(self, tier=None):
+        """
+        (モデルのインデックス, 切り替えた理由) を返す。理由は切り替えなければ None、SLO超過なら 'slo'、混雑なら 'queue'
+        """
+        index = self.tier_index(tier or self.default_tier)
+        reason = None
+        with self._lock:
+            if index > 0 and self.latency_slo_ms and self._recent_p95(index) > self.latency_slo_ms:
+                return 0, 'slo'
+            while index > 0 and self.degrade_depth and self._in_flight[index] >= self.degrade_depth:
+                index -= 1
+                reason = 'queue'
+        return index, reason
+
+    @contextmanager
+    def track(self, index):
+        """
+        推論中のリクエストとして数え、終了時にレイテンシを記録する
+        """
+        with self._lock:
+            self._in_flight[index] += 1
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            finished = time.monotonic()
+            with self._lock:
+                self._in_flight[index] -= 1
+                self._samples[index].append((finished, finished - started))
+
+    def _recent_p95(self, index):
+        now = time.monotonic()
+        computed_at, value = self._p95[index]
+        if now - computed_at < self.refresh_interval:
+            return value
+
+        samples = self._samples[index]
+        while samples and samples[0][0] < now - self.window:
+            samples.popleft()
+        value = 0.0
+        if len(samples) >= self.min_samples:
+            latencies = sorted(seconds for _, seconds in samples)
+            value = latencies[min(len(latencies) - 1, int(round(0.95 * (len(latencies) - 1))))] * 1000.0
+        self._p95[index] = (now, value)
+        return value
+
+    def stats(self):
+        with self._lock:
+            return {
+                'default_tier': self.default_tier,
+                'degrade_depth': self.degrade_depth,
+                'latency_slo_ms': self.latency_slo_ms,
+                'models': [
+                    {
+                        'model': model_id,
+                        'in_flight': self._in_flight[index],
+                        'recent_p95_ms': self._recent_p95(index)
+                    }
+                    for index, model_id in enumerate(self.model_ids)
+                ]
+            }
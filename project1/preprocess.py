@@ -0,0 +1,219 @@
+import io
+import cv2
+import numpy as np
+from PIL import Image
+
+# 描画に使うクラスごとの色（ultralytics の Colors と同じパレット、BGR）
+PLOT_COLORS = tuple(
+    (int(value[4:6], 16), int(value[2:4], 16), int(value[0:2], 16))
+    for value in (
+        '042AFF', '0BDBEB', 'F3F3F3', '00DFB7', '111F68', 'FF6FDD', 'FF444F', 'CCED00', '00F344', 'BD00FF',
+        '00B4FF', 'DD00BA', '00FFFF', '26C000', '01FFB3', '7D24FF', '7B0068', 'FF1B6C', 'FC6D2F', 'A2FF0B'
+    )
+)
+
+# JPEGの縮小デコード（libjpegのDCTスケーリングでデコード自体を軽くする）
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def image_size(source):
+    """
+    画像をデコードせずにヘッダから ((幅, 高さ), 形式) を返す。読めない場合は (None, None)
+    """
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as image:
+            return image.size, image.format
+    except Exception:
+        return None, None
+
+
+def downscale(image, target_size):
+    """
+    長辺が target_size を超える画像を縮小し、(画像, 縮尺) を返す
+    """
+    long_side = max(image.shape[:2])
+    if long_side <= target_size:
+        return image, 1.0
+    resize = target_size / long_side
+    image = cv2.resize(
+        image,
+        (max(1, round(image.shape[1] * resize)), max(1, round(image.shape[0] * resize))),
+        interpolation=cv2.INTER_AREA
+    )
+    return image, resize
+
+
+def _decode_reduced(source, target_size, long_side=None):
+    """
+    long_side（省略時は画像の長辺）が target_size を下回らない範囲でJPEGを縮小デコードし、
+    (画像, 元画像に対する縮尺) を返す。デコードできない場合は (None, 1.0)
+    """
+    flag = cv2.IMREAD_COLOR
+    size, image_format = image_size(source) if target_size else (None, None)
+    if size and image_format == 'JPEG':
+        for factor in (8, 4, 2):
+            if (long_side or max(size)) // factor >= target_size:
+                flag = REDUCED_DECODE_FLAGS[factor]
+                break
+
+    if isinstance(source, bytes):
+        image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), flag)
+    else:
+        image = cv2.imread(source, flag)
+    if image is None:
+        return None, 1.0
+
+    # EXIFの回転が適用されている場合があるため長辺同士で縮尺を求める
+    return image, max(image.shape[:2]) / max(size) if size else 1.0
+
+
+def decode_image(source, target_size=None):
+    """
+    画像のバイト列またはパスをBGR配列にデコードし、(画像, 元画像に対する縮尺) を返す
+
+    target_size を指定すると、JPEGは長辺が target_size を下回らない範囲で縮小デコードし、
+    さらに長辺が target_size になるよう1回だけ縮小する（モデル側のレターボックスはパディングのみになる）
+    """
+    image, scale = _decode_reduced(source, target_size)
+    if image is not None and target_size:
+        image, resize = downscale(image, target_size)
+        scale *= resize
+    return image, scale
+
+
+def decode_region(source, roi, target_size=None):
+    """
+    画像の ROI (x1, y1, x2, y2: 元画像の座標) だけを切り出し、(画像, 縮尺, 実際に切り出した ROI) を返す
+
+    縮小デコードは ROI の長辺を基準に行うため、小さな ROI でも解像度を落としすぎない。
+    ROI が画像と重ならない場合やデコードできない場合は (None, 1.0, None)
+    """
+    image, scale = _decode_reduced(source, target_size, max(roi[2] - roi[0], roi[3] - roi[1]))
+    if image is None:
+        return None, 1.0, None
+
+    height, width = image.shape[:2]
+    x1, y1 = max(0, int(roi[0] * scale)), max(0, int(roi[1] * scale))
+    x2, y2 = min(width, int(np.ceil(roi[2] * scale))), min(height, int(np.ceil(roi[3] * scale)))
+    if x2 <= x1 or y2 <= y1:
+        return None, 1.0, None
+    # 画素単位に丸めた位置を元画像の座標に戻して返す（検出結果の座標の変換に使う）
+    region = (x1 / scale, y1 / scale, x2 / scale, y2 / scale)
+    image = np.ascontiguousarray(image[y1:y2, x1:x2])
+    if target_size:
+        image, resize = downscale(image, target_size)
+        scale *= resize
+    return image, scale, region
+
+
+def tile_origins(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    origins = list(range(0, length - tile_size, stride))
+    # 最後のタイルは端に揃える
+    origins.append(length - tile_size)
+    return origins
+
+
+def split_tiles(image, tile_size=640, overlap=0.2):
+    """
+    画像を重なり付きのタイルに分割し、[(x, y, タイル画像)] を返す
+    """
+    height, width = image.shape[:2]
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+    return [
+        (x, y, np.ascontiguousarray(image[y:y + tile_size, x:x + tile_size]))
+        for y in tile_origins(height, tile_size, stride)
+        for x in tile_origins(width, tile_size, stride)
+    ]
+
+
+def nms(boxes, scores, iou_threshold):
+    """
+    NumPyによるNMS。残すボックスのインデックスを返す
+    """
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        width = np.clip(np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest]), 0, None)
+        height = np.clip(np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest]), 0, None)
+        intersection = width * height
+        iou = intersection / (areas[i] + areas[rest] - intersection + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.intp)
+
+
+def merge_detections(parts, iou_threshold=0.5):
+    """
+    タイルごとの検出結果 (N, 6: x1, y1, x2, y2, conf, cls) を結合し、クラスごとのNMSで重複を除く
+    """
+    parts = [part for part in parts if len(part)]
+    if not parts:
+        return np.zeros((0, 6), dtype=np.float32)
+    data = np.concatenate(parts)
+    # クラスごとに座標をずらし、1回のNMSでクラス別に処理する
+    offsets = data[:, 5:6] * (data[:, :4].max() + 1.0)
+    keep = nms(data[:, :4] + offsets, data[:, 4], iou_threshold)
+    return data[keep]
+
+
+def filter_detections(data, classes=None, conf=None, iou=None, max_det=None):
+    """
+    検出結果 (N, 6) をクラス・信頼度で絞り込み、iou を指定した場合はクラスごとのNMSをやり直して、
+    信頼度の高い順に max_det 件までに減らす
+    """
+    if classes is not None:
+        data = data[np.isin(data[:, 5].astype(np.intp), classes)]
+    if conf is not None:
+        data = data[data[:, 4] >= conf]
+    if iou is not None:
+        data = merge_detections([data], iou)
+    if max_det is not None and len(data) > max_det:
+        data = data[np.argsort(-data[:, 4], kind='stable')[:max_det]]
+    return data
+
+
+def draw_detections(image, data, names):
+    """
+    検出結果 (N, 6) を画像に描画する（英語のクラス名を使用）
+
+    ultralytics の result.plot() と同じ色・線幅・ラベル（「クラス名 信頼度」を塗りつぶした枠の上に表示）で描画する
+    """
+    line_width = max(round(sum(image.shape) / 2 * 0.003), 2)
+    font_thickness = max(line_width - 1, 1)
+    font_scale = line_width / 3
+    # plot() と同じく後ろの（信頼度の低い）検出から描き、信頼度の高い検出を上に重ねる
+    for x1, y1, x2, y2, confidence, class_id in data[::-1]:
+        class_id = int(class_id)
+        color = PLOT_COLORS[class_id % len(PLOT_COLORS)]
+        p1, p2 = (int(x1), int(y1)), (int(x2), int(y2))
+        cv2.rectangle(image, p1, p2, color, thickness=line_width, lineType=cv2.LINE_AA)
+
+        label = f"{names.get(class_id, class_id)} {confidence:.2f}"
+        w, h = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, fontScale=font_scale, thickness=font_thickness)[0]
+        h += 3
+        # 上に収まらなければ枠の内側に、右にはみ出す場合は左に寄せて表示する
+        outside = p1[1] >= h
+        if p1[0] > image.shape[1] - w:
+            p1 = (image.shape[1] - w, p1[1])
+        cv2.rectangle(image, p1, (p1[0] + w, p1[1] - h if outside else p1[1] + h), color, -1, cv2.LINE_AA)
+        cv2.putText(
+            image, label, (p1[0], p1[1] - 2 if outside else p1[1] + h - 1), cv2.FONT_HERSHEY_SIMPLEX, font_scale,
+            label_text_color(color), thickness=font_thickness, lineType=cv2.LINE_AA
+        )
+    return image
+
+
+def label_text_color(color):
+    # 明るい背景には濃い色、暗い背景には白の文字
+    b, g, r = color
+    return (104, 31, 17) if 0.299 * r + 0.587 * g + 0.114 * b > 160 else (255, 255, 255)
@@ -0,0 +1,425 @@
+import os
+import time
+import heapq
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import Counter, OrderedDict, deque
+from flask import Response, abort, send_file
+
+try:
+    import fcntl
+except ImportError:  # Windows ではホスト内の排他を行わない
+    fcntl = None
+
+
+class MemoryResultStore:
+    """
+    注釈付き画像などの結果をメモリ上に保持するストア
+
+    エントリ数と合計バイト数の上限を超えると古いものから破棄する（LRU）
+    """
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def put(self, key, data, mimetype='application/octet-stream'):
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key)[0])
+            self._entries[key] = (data, mimetype)
+            self._bytes += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def get(self, key):
+        """
+        (data, mimetype) を返す。存在しない場合は None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'evictions': self.evictions
+            }
+
+
+def shard_path(name, depth=2):
+    """
+    ファイル名のハッシュから分散用のサブディレクトリ（例: 'ab/cd'）を返す
+    """
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return '/'.join(digest[i * 2:i * 2 + 2] for i in range(depth))
+
+
+def host_lock_path(name):
+    """
+    同じホストのプロセス間で排他するためのロックファイルのパスを返す（name ごとに別のファイル）
+    """
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f'yolo-app-{digest}.lock')
+
+
+def stat_files(directory, filenames):
+    """
+    ディレクトリ内のファイルの (名前, サイズ, 更新時刻) を列挙する（書き込み途中の .tmp と、途中で消えたファイルは除く）
+    """
+    for filename in filenames:
+        if filename.endswith('.tmp'):
+            continue
+        try:
+            stat = os.stat(os.path.join(directory, filename))
+        except FileNotFoundError:
+            continue
+        yield filename, stat.st_size, stat.st_mtime
+
+
+class LocalStorage:
+    """
+    ハッシュで分散したサブディレクトリにファイルを保存するローカルディスクのストレージ
+
+    1つのディレクトリにファイルが集中してディレクトリ検索が遅くなるのを防ぐ
+    """
+
+    def __init__(self, root, shard_depth=2):
+        self.root = root
+        self.shard_depth = shard_depth
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, name):
+        return os.path.join(self.root, *shard_path(name, self.shard_depth).split('/'), name)
+
+    def put(self, name, data, mimetype=None):
+        path = self.path_for(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put_file(self, name, source_path, mimetype=None):
+        path = self.path_for(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.move(source_path, path)
+
+    def _existing_path(self, name):
+        path = self.path_for(name)
+        if os.path.isfile(path):
+            return path
+        # 分散導入前にアップロードディレクトリ直下へ保存されたファイル
+        legacy_path = os.path.join(self.root, name)
+        if os.path.isfile(legacy_path):
+            return legacy_path
+        return None
+
+    def get(self, name):
+        """
+        ファイルの内容を返す。存在しない場合は None
+        """
+        path = self._existing_path(name)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def serve(self, name, request):
+        """
+        ファイルを返す（Range / If-None-Match に対応）
+        """
+        path = self._existing_path(name)
+        if path is None:
+            abort(404)
+        return send_file(path, conditional=True, etag=True, max_age=3600)
+
+    def delete(self, name):
+        path = self._existing_path(name)
+        if path is not None:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def list_shards(self):
+        """
+        最上位の分散ディレクトリ名のリストを返す（'' は分散導入前にルート直下へ保存されたファイル）
+        """
+        with os.scandir(self.root) as entries:
+            return [''] + sorted(entry.name for entry in entries if entry.is_dir())
+
+    def iter_entries(self, shard):
+        """
+        1つの分散ディレクトリに保存されているファイルの (名前, サイズ, 更新時刻) を列挙する
+        """
+        if not shard:
+            with os.scandir(self.root) as entries:
+                filenames = [entry.name for entry in entries if entry.is_file()]
+            yield from stat_files(self.root, filenames)
+            return
+        for directory, _, filenames in os.walk(os.path.join(self.root, shard)):
+            yield from stat_files(directory, filenames)
+
+
+class S3Storage:
+    """
+    S3互換のオブジェクトストレージ（MinIOなどのローカル代替も可）に保存するストレージ
+    """
+
+    def __init__(self, bucket, prefix='uploads/', endpoint_url=None, shard_depth=2):
+        # boto3 はS3ストレージを使う場合のみ必要
+        import boto3
+        from botocore.exceptions import ClientError
+        self._client_error = ClientError
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.shard_depth = shard_depth
+
+    def key_for(self, name):
+        return f"{self.prefix}{shard_path(name, self.shard_depth)}/{name}"
+
+    def put(self, name, data, mimetype=None):
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=self.key_for(name),
+            Body=data,
+            ContentType=mimetype or 'application/octet-stream'
+        )
+
+    def put_file(self, name, source_path, mimetype=None):
+        self.client.upload_file(
+            source_path,
+            self.bucket,
+            self.key_for(name),
+            ExtraArgs={'ContentType': mimetype or 'application/octet-stream'}
+        )
+        os.remove(source_path)
+
+    def get(self, name):
+        """
+        オブジェクトの内容を返す。存在しない場合は None
+        """
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key_for(name))['Body'].read()
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                return None
+            raise
+
+    def serve(self, name, request):
+        """
+        オブジェクトを中継して返す（Range / If-None-Match はそのままストレージに渡す）
+        """
+        params = {'Bucket': self.bucket, 'Key': self.key_for(name)}
+        if request.headers.get('Range'):
+            params['Range'] = request.headers['Range']
+        if request.headers.get('If-None-Match'):
+            params['IfNoneMatch'] = request.headers['If-None-Match']
+
+        try:
+            obj = self.client.get_object(**params)
+        except self._client_error as e:
+            status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if status == 304:
+                return Response(status=304, headers={'ETag': request.headers['If-None-Match']})
+            if status == 416:
+                return Response(status=416)
+            if status == 404 or e.response.get('Error', {}).get('Code') in ('NoSuchKey', '404'):
+                abort(404)
+            raise
+
+        headers = {
+            'ETag': obj['ETag'],
+            'Accept-Ranges': 'bytes',
+            'Content-Length': str(obj['ContentLength']),
+            'Cache-Control': 'public, max-age=3600'
+        }
+        if obj.get('ContentRange'):
+            headers['Content-Range'] = obj['ContentRange']
+        if obj.get('LastModified'):
+            headers['Last-Modified'] = obj['LastModified'].strftime('%a, %d %b %Y %H:%M:%S GMT')
+        return Response(
+            obj['Body'].iter_chunks(64 * 1024),
+            status=206 if obj.get('ContentRange') else 200,
+            mimetype=obj.get('ContentType'),
+            headers=headers
+        )
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key_for(name))
+
+    def list_shards(self):
+        # キーの最上位の分散ディレクトリはハッシュの先頭2桁
+        if self.shard_depth < 1:
+            return ['']
+        return [f'{i:02x}' for i in range(256)]
+
+    def iter_entries(self, shard):
+        paginator = self.client.get_paginator('list_objects_v2')
+        prefix = f'{self.prefix}{shard}/' if shard else self.prefix
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                yield obj['Key'].rsplit('/', 1)[-1], obj['Size'], obj['LastModified'].timestamp()
+
+
+class StorageReaper:
+    """
+    保存期間（TTL）と合計容量の上限を超えたファイルを定期的に削除するバックグラウンドスレッド
+
+    storage は list_shards / iter_entries(shard) / delete を持つもの。1回の実行では最上位の分散ディレクトリを1つだけ
+    走査し、interval 秒で全体を1周する（全ファイルを一度に走査しない）。容量の上限がある場合は、走査したファイルを
+    分散ディレクトリごとに更新時刻順の索引に保持し、合計が上限を超えたら索引全体から古いものを削除する。
+    lock_path を指定した場合は、そのファイルのロックを取得できた1プロセスだけが削除を行う（同じホストの gunicorn の
+    ワーカーがそれぞれ走査して同じファイルを奪い合わない。ロックを持つプロセスが終了すると他のプロセスが引き継ぐ）
+    """
+
+    def __init__(self, storage, ttl=0.0, max_bytes=0, interval=300.0, lock_path=None):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.lock_path = lock_path
+        self.deleted = 0
+        self.deleted_bytes = 0
+        self.last_run = None
+        self.total_bytes = 0
+        self.active = False
+        self._lock_file = None
+        self._shards = deque()
+        self._pass_size = 0
+        self._index = {}
+        self._shard_bytes = {}
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='storage-reaper', daemon=True)
+
+    def start(self):
+        if self.ttl > 0 or self.max_bytes > 0:
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        # 1周の分散ディレクトリ数で interval を割った間隔で1つずつ走査する（最初の1周の前は interval 待つ）
+        while not self._stopped.wait(self.interval / max(1, self._pass_size)):
+            if not self._acquire_lock():
+                continue
+            try:
+                self.reap_next()
+            except Exception as e:
+                print(f"Error in storage reaper: {str(e)}")
+
+    def _acquire_lock(self):
+        if self.active:
+            return True
+        if self.lock_path and fcntl is not None:
+            lock_file = open(self.lock_path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            # プロセスが終了するまでロックを保持する
+            self._lock_file = lock_file
+        self.active = True
+        return True
+
+    def reap(self):
+        """
+        すべての分散ディレクトリを1周走査する
+        """
+        self._shards.clear()
+        self.reap_next()
+        while self._shards:
+            self.reap_next()
+
+    def reap_next(self):
+        """
+        次の分散ディレクトリを1つ走査し、期限切れのファイルと容量の上限を超えた分の古いファイルを削除する
+        """
+        if not self._shards:
+            shards = list(self.storage.list_shards())
+            # なくなった分散ディレクトリの索引は捨てる
+            for shard in set(self._shard_bytes) - set(shards):
+                self._index.pop(shard, None)
+                del self._shard_bytes[shard]
+            self._shards.extend(shards)
+            self._pass_size = len(shards)
+            if not shards:
+                return
+        shard = self._shards.popleft()
+
+        now = time.time()
+        entries = []
+        for name, size, mtime in self.storage.iter_entries(shard):
+            if self.ttl > 0 and now - mtime > self.ttl:
+                self._delete(name, size)
+            else:
+                entries.append((mtime, name, size, shard))
+        self._shard_bytes[shard] = sum(entry[2] for entry in entries)
+
+        total_bytes = sum(self._shard_bytes.values())
+        if self.max_bytes > 0:
+            entries.sort()
+            self._index[shard] = entries
+            if total_bytes > self.max_bytes:
+                # 容量上限を超えた分は索引全体から古いものを削除（索引は分散ディレクトリごとに更新時刻順）
+                deleted = Counter()
+                for _, name, size, entry_shard in heapq.merge(*self._index.values()):
+                    if total_bytes <= self.max_bytes:
+                        break
+                    self._delete(name, size)
+                    total_bytes -= size
+                    self._shard_bytes[entry_shard] -= size
+                    deleted[entry_shard] += 1
+                for entry_shard, count in deleted.items():
+                    del self._index[entry_shard][:count]
+
+        self.last_run = now
+        self.total_bytes = total_bytes
+
+    def _delete(self, name, size):
+        self.storage.delete(name)
+        self.deleted += 1
+        self.deleted_bytes += size
+
+    def stats(self):
+        return {
+            'ttl_seconds': self.ttl,
+            'max_bytes': self.max_bytes,
+            'active': self.active,
+            'total_bytes': self.total_bytes,
+            'deleted': self.deleted,
+            'deleted_bytes': self.deleted_bytes,
+            'last_run': self.last_run
+        }
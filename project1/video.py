@@ -0,0 +1,112 @@
+import threading
+import time
+import queue
+import cv2
+
+
+class FrameReader:
+    """
+    別スレッドで動画をデコードし、フレームを上限付きキューに積むリーダー
+
+    キューが満杯の間はデコードを止めるため、動画の長さに関わらずメモリ使用量は一定になる
+    """
+
+    def __init__(self, path, frame_skip=1, max_queue=32):
+        self.capture = cv2.VideoCapture(path)
+        self.frame_skip = max(1, int(frame_skip))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30.0
+        self.width = int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frames_read = 0
+        self._queue = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='frame-reader', daemon=True)
+
+    @property
+    def opened(self):
+        return self.capture.isOpened()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _put(self, item):
+        # 停止要求を確認しながらキューの空きを待つ
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _run(self):
+        try:
+            index = 0
+            while not self._stopped.is_set():
+                # スキップするフレームはデコードせずに読み飛ばす
+                if index % self.frame_skip != 0:
+                    if not self.capture.grab():
+                        break
+                    index += 1
+                    continue
+                ok, frame = self.capture.read()
+                if not ok:
+                    break
+                if not self._put((index, frame)):
+                    break
+                index += 1
+            self.frames_read = index
+        finally:
+            self.capture.release()
+            self._put(None)
+
+    def get(self, timeout=None):
+        """
+        (frame_index, frame) を返す。動画の終端では None
+        """
+        return self._queue.get(timeout=timeout)
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join(timeout=1.0)
+
+
+def iter_frame_batches(reader, batch_size):
+    """
+    リーダーから最大 batch_size 枚ずつフレームをまとめて返す
+    """
+    batch = []
+    while True:
+        item = reader.get()
+        if item is None:
+            break
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class FpsMeter:
+    """
+    処理済みフレーム数から実効FPSを計算する
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.frames = 0
+
+    def update(self, frames):
+        self.frames += frames
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def fps(self):
+        elapsed = self.elapsed
+        return self.frames / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,208 @@
+import os
+import time
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from batching import QueueFullError
+
+
+class PoolBusyError(QueueFullError):
+    """
+    推論ワーカープールの処理待ちが上限に達している
+    """
+
+
+def _worker_main(worker_id, config, threads, task_queue, result_queue):
+    # ワーカーごとの演算スレッド数を固定（子プロセス内で初期化されるライブラリ向けに環境変数も設定）
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name] = str(threads)
+    import torch
+    torch.set_num_threads(threads)
+    from backends import load_model, result_array
+
+    try:
+        # 各ワーカーが全モデル（速い順）を保持し、タスクごとに指定されたモデルで推論する
+        models = [
+            load_model(model_name, config['backend'], int8=config['int8'], export_dir=config['export_dir'])
+            for model_name in config['model_names']
+        ]
+    except Exception as e:
+        result_queue.put(('failed', worker_id, str(e)))
+        return
+    result_queue.put(('ready', worker_id, dict(models[0].names)))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, variant, sources = task
+        # 処理中のタスクをコレクタに知らせる（このワーカーが落ちた場合にすぐ失敗させるため）
+        result_queue.put(('started', task_id, worker_id))
+        try:
+            results = models[variant](sources, conf=config['conf'], iou=config['iou'], verbose=False)
+            # Results（テンソル・元画像を含む）ではなく (N, 6) の検出結果の配列だけを送り返す
+            result_queue.put(('result', task_id, [result_array(result) for result in results]))
+        except Exception as e:
+            result_queue.put(('error', task_id, str(e)))
+
+
+class InferencePool:
+    """
+    モデルを1つずつ保持する推論ワーカープロセスのプール
+
+    Webリクエストのスレッドとは独立したプロセスで推論を行い、キュー経由で結果を受け取る
+    """
+
+    def __init__(self, config, num_workers=2, threads_per_worker=1, max_pending=64, task_timeout=120.0,
+                 health_check_interval=1.0):
+        # Webプロセスにはスレッド（リクエスト・ストレージの削除・モデルのローダーなど）があり、再起動はコレクタの
+        # スレッドから行うため、fork ではなく spawn で新しいインタプリタとしてワーカーを起動する
+        self._context = mp.get_context('spawn')
+        self.config = config
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.max_pending = max_pending
+        self.task_timeout = task_timeout
+        self.health_check_interval = health_check_interval
+        self.names = None
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._ready = threading.Event()
+        self._failure = None
+        self._processes = {}
+        # ワーカーごとの処理中のタスクID
+        self._running = {}
+        self._stopped = threading.Event()
+        self.completed = 0
+        self.errors = 0
+        self.restarts = 0
+
+    def _spawn(self, worker_id):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.config, self.threads_per_worker, self._tasks, self._results),
+            name=f'inference-worker-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        self._processes[worker_id] = process
+
+    def start(self, timeout=300.0):
+        for worker_id in range(self.num_workers):
+            self._spawn(worker_id)
+        threading.Thread(target=self._collect, name='inference-pool-collector', daemon=True).start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError('Inference workers did not become ready in time')
+        if self._failure is not None:
+            raise RuntimeError(f'Inference worker failed to load the model: {self._failure}')
+        return self
+
+    def _collect(self):
+        last_check = time.monotonic()
+        while not self._stopped.is_set():
+            # 結果が届き続けている間も一定間隔でワーカーの生存を確認する
+            if time.monotonic() - last_check >= self.health_check_interval:
+                self._restart_dead_workers()
+                last_check = time.monotonic()
+            try:
+                kind, key, payload = self._results.get(timeout=self.health_check_interval)
+            except queue.Empty:
+                continue
+
+            if kind == 'started':
+                self._running[payload] = key
+            elif kind == 'ready':
+                if self.names is None:
+                    self.names = payload
+                self._ready.set()
+            elif kind == 'failed':
+                self._failure = payload
+                self._ready.set()
+            else:
+                self._running = {worker_id: task_id for worker_id, task_id in self._running.items() if task_id != key}
+                if kind == 'result':
+                    self._finish(key, result=payload)
+                else:
+                    self._finish(key, error=RuntimeError(payload))
+
+    def _finish(self, task_id, result=None, error=None):
+        with self._lock:
+            future = self._pending.pop(task_id, None)
+            if error is None:
+                self.completed += 1
+            else:
+                self.errors += 1
+        if future is None:
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+    def _restart_dead_workers(self):
+        for worker_id, process in list(self._processes.items()):
+            if not process.is_alive() and not self._stopped.is_set():
+                print(f"Inference worker {worker_id} exited with code {process.exitcode}, restarting")
+                self.restarts += 1
+                # 落ちたワーカーが処理中だったタスクはタイムアウトを待たずに失敗させる
+                # （入力が原因で落ちた可能性があるため再投入はしない）
+                task_id = self._running.pop(worker_id, None)
+                if task_id is not None:
+                    self._finish(task_id, error=RuntimeError(f'Inference worker exited with code {process.exitcode}'))
+                self._spawn(worker_id)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+    def submit(self, sources, variant=0):
+        """
+        画像のリストを variant 番目のモデルの推論キューに投入し Future を返す
+        """
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                raise PoolBusyError('Inference pool is busy')
+            task_id = next(self._ids)
+            future = Future()
+            self._pending[task_id] = future
+        self._tasks.put((task_id, variant, sources))
+        return future
+
+    def run(self, sources, variant=0):
+        """
+        画像のリストを推論し、画像ごとの (N, 6: x1, y1, x2, y2, conf, cls) の検出結果の配列が返るまでブロックする
+        """
+        future = self.submit(sources, variant)
+        try:
+            return future.result(timeout=self.task_timeout)
+        except FutureTimeoutError:
+            # ワーカーが落ちた場合などは結果が返らないので待ちを打ち切る
+            with self._lock:
+                self._pending = {key: pending for key, pending in self._pending.items() if pending is not future}
+            raise
+
+    def stop(self):
+        self._stopped.set()
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes.values():
+            process.join(timeout=5.0)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'workers': self.num_workers,
+            'workers_alive': sum(1 for process in self._processes.values() if process.is_alive()),
+            'threads_per_worker': self.threads_per_worker,
+            'pending': pending,
+            'max_pending': self.max_pending,
+            'completed': self.completed,
+            'errors': self.errors,
+            'restarts': self.restarts
+        }
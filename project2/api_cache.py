@@ -0,0 +1,196 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from datetime import datetime, timezone
+from quota import quota_day
+
+# 日時のパラメータをキーに含める際に丸める単位（秒）。「今から30日前」の検索が毎回別のキーにならないようにする
+TIME_PARAMS = ('publishedAfter', 'publishedBefore')
+
+
+def normalize_params(params, time_granularity=600):
+    """
+    キャッシュキー用にリクエストパラメータを正規化する
+
+    - 検索語の前後・連続する空白をまとめる
+    - カンマ区切りのID・part は順序を問わないため並べ替える
+    - 日時は time_granularity 秒単位に切り捨てる
+    """
+    normalized = {}
+    for name, value in params.items():
+        if value is None:
+            continue
+        if name == 'q':
+            value = ' '.join(str(value).split())
+        elif name in ('id', 'part'):
+            value = ','.join(sorted(part.strip() for part in str(value).split(',') if part.strip()))
+        elif name in TIME_PARAMS and time_granularity:
+            moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+            epoch = int(moment.replace(tzinfo=moment.tzinfo or timezone.utc).timestamp())
+            value = epoch - epoch % time_granularity
+        normalized[name] = value
+    return normalized
+
+
+class ApiCache:
+    """
+    YouTube Data API のレスポンスを保存する SQLite のキャッシュ
+
+    ファイルを共有するすべてのセッション・プロセスで使える。検索結果はリクエスト全体を、
+    videos / channels は ID ごとにキャッシュし、別の検索で同じ動画・チャンネルが出てきた場合も再利用する。
+    TTL はエンドポイントごとに ttls で指定する（未指定のエンドポイントはキャッシュしない）
+    """
+
+    def __init__(self, path, ttls, time_granularity=600):
+        self.path = path
+        self.ttls = dict(ttls)
+        self.time_granularity = time_granularity
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, body TEXT NOT NULL, expires_at REAL NOT NULL)'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS stats ('
+                'day TEXT NOT NULL, endpoint TEXT NOT NULL, hits INTEGER NOT NULL DEFAULT 0, '
+                'misses INTEGER NOT NULL DEFAULT 0, units_saved INTEGER NOT NULL DEFAULT 0, '
+                'PRIMARY KEY (day, endpoint))'
+            )
+        self.purge()
+
+    def _connect(self):
+        # 接続はスレッドごとに1つ（sqlite3 の接続はスレッド間で共有しない）
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30.0)
+            self._local.connection = connection
+        return connection
+
+    def _key(self, endpoint, params):
+        payload = json.dumps([endpoint, normalize_params(params, self.time_granularity)], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, endpoint, params, cost=0):
+        """
+        キャッシュ済みのレスポンスを返す。ない場合は None。ヒットした場合は cost ユニットを節約した量として記録する
+        """
+        if endpoint not in self.ttls:
+            return None
+        row = self._connect().execute(
+            'SELECT body FROM responses WHERE key = ? AND expires_at > ?',
+            (self._key(endpoint, params), time.time())
+        ).fetchone()
+        if row is None:
+            self._record(endpoint, misses=1)
+            return None
+        self._record(endpoint, hits=1, units_saved=cost)
+        return json.loads(row[0])
+
+    def put(self, endpoint, params, response):
+        if endpoint not in self.ttls:
+            return
+        self._store(endpoint, [(self._key(endpoint, params), response)])
+
+    def get_items(self, endpoint, part, ids, cost=0, fields=None):
+        """
+        ID ごとにキャッシュした items を {ID: item} で返す（期限切れ・未取得の ID は含まない）
+
+        fields（部分レスポンスの指定）が異なる場合は別のエントリとして扱う。ヒットした ID 1件あたり cost ユニットを節約した量として記録する
+        """
+        if endpoint not in self.ttls or not ids:
+            return {}
+        keys = {self._key(endpoint, {'part': part, 'id': item_id, 'fields': fields}): item_id for item_id in ids}
+        found = {}
+        now = time.time()
+        connection = self._connect()
+        # SQLite の変数の上限を超えないよう分割して引く
+        key_list = list(keys)
+        for start in range(0, len(key_list), 500):
+            chunk = key_list[start:start + 500]
+            rows = connection.execute(
+                f"SELECT key, body FROM responses WHERE expires_at > ? AND key IN ({','.join('?' * len(chunk))})",
+                [now] + chunk
+            ).fetchall()
+            for key, body in rows:
+                found[keys[key]] = json.loads(body)
+        hits = len(found)
+        self._record(endpoint, hits=hits, misses=len(keys) - hits, units_saved=hits * cost)
+        return found
+
+    def put_items(self, endpoint, part, items, fields=None):
+        if endpoint not in self.ttls or not items:
+            return
+        self._store(
+            endpoint,
+            [(self._key(endpoint, {'part': part, 'id': item['id'], 'fields': fields}), item) for item in items]
+        )
+
+    def record_saving(self, endpoint, units):
+        """
+        キャッシュによって不要になった呼び出しの分のユニットを記録する（ID ごとのキャッシュで呼び出し回数が減った場合など）
+        """
+        if units > 0:
+            self._record(endpoint, units_saved=units)
+
+    def _store(self, endpoint, entries):
+        expires_at = time.time() + self.ttls[endpoint]
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO responses (key, endpoint, body, expires_at) VALUES (?, ?, ?, ?)',
+                [(key, endpoint, json.dumps(body, ensure_ascii=False), expires_at) for key, body in entries]
+            )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.purge()
+
+    def _record(self, endpoint, hits=0, misses=0, units_saved=0):
+        # 複数プロセスから同時に更新されても失われないよう、読み出さずにSQLの中で加算する
+        # 日はクォータの台帳と同じ太平洋時間で区切る（節約したユニットと使用量を同じ日で比べられるように）
+        day = quota_day()
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT INTO stats (day, endpoint, hits, misses, units_saved) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (day, endpoint) DO UPDATE SET hits = hits + excluded.hits, '
+                'misses = misses + excluded.misses, units_saved = units_saved + excluded.units_saved',
+                (day, endpoint, hits, misses, units_saved)
+            )
+
+    def purge(self):
+        """
+        期限切れのエントリを削除する
+        """
+        with self._connect() as connection:
+            connection.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),))
+
+    def stats(self, day=None):
+        """
+        指定日（省略時はクォータの台帳と同じ太平洋時間の今日）のエンドポイント別・合計のヒット数・ミス数・ヒット率・節約したユニット数を返す
+        """
+        day = day or quota_day()
+        rows = self._connect().execute(
+            'SELECT endpoint, hits, misses, units_saved FROM stats WHERE day = ?', (day,)
+        ).fetchall()
+        endpoints = {
+            endpoint: {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+                'units_saved': units_saved
+            }
+            for endpoint, hits, misses, units_saved in rows
+        }
+        hits = sum(entry['hits'] for entry in endpoints.values())
+        lookups = hits + sum(entry['misses'] for entry in endpoints.values())
+        return {
+            'day': day,
+            'hits': hits,
+            'misses': lookups - hits,
+            'hit_rate': hits / lookups if lookups else 0.0,
+            'units_saved': sum(entry['units_saved'] for entry in endpoints.values()),
+            'endpoints': endpoints
+        }
@@ -3,12 +3,21 @@ import pandas as pd
 from datetime import datetime, timedelta
 from dateutil.parser import parse
 import os
-import re
-import json
 from dotenv import load_dotenv
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from api_cache import ApiCache
+from watchlist import WatchList
+from quota import API_COSTS, QuotaExceededError, QuotaLedger, RateLimitedError
+from results import ResultBuilder
+from transport import PooledHttp, RetryPolicy, build_youtube_client, execute_with_retry
+
+# 再実行の開始時刻（Streamlit は操作のたびにこのスクリプト全体を実行し直す）
+RERUN_STARTED = time.perf_counter()
 
 # 環境変数を読み込み
 load_dotenv()
@@ -21,134 +30,94 @@ if not YOUTUBE_API_KEY:
     st.error("⚠️ YouTube API Keyが設定されていません。管理者に連絡してください。")
     st.stop()
 
-# クォータ使用量の永続化ファイルパス
-QUOTA_FILE = "quota_usage.json"
+# APIの接続先（未指定ならYouTube Data API。ローカルのスタブサーバーなどを使う場合は 'http://127.0.0.1:8080/' のように指定）
+YOUTUBE_API_ENDPOINT = os.getenv('YOUTUBE_API_ENDPOINT') or None
+# HTTP接続プールの接続数と、1回の通信のタイムアウト（秒）
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', '10'))
+API_TIMEOUT_SECONDS = float(os.getenv('API_TIMEOUT_SECONDS', '10'))
+# 一時的なエラー（5xx・レート制限・タイムアウト）の再試行。指数バックオフ（ジッター付き）で最大 API_MAX_RETRIES 回、
+# 最初の試行から API_DEADLINE_SECONDS 秒以内に限る
+API_MAX_RETRIES = int(os.getenv('API_MAX_RETRIES', '4'))
+API_RETRY_BASE_SECONDS = float(os.getenv('API_RETRY_BASE_SECONDS', '0.5'))
+API_RETRY_MAX_SECONDS = float(os.getenv('API_RETRY_MAX_SECONDS', '8'))
+API_DEADLINE_SECONDS = float(os.getenv('API_DEADLINE_SECONDS', '30'))
+API_RETRY_POLICY = RetryPolicy(API_MAX_RETRIES, API_RETRY_BASE_SECONDS, API_RETRY_MAX_SECONDS, API_DEADLINE_SECONDS)
 
-# クォータ使用量の読み込み
-def load_quota_usage():
-    try:
-        if os.path.exists(QUOTA_FILE):
-            with open(QUOTA_FILE, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                today = datetime.now().strftime('%Y-%m-%d')
-                # 今日のデータがあれば使用量を復元、なければリセット
-                if data.get('date') == today:
-                    return data.get('quota_used', 0)
-                else:
-                    # 日付が変わっていればリセット
-                    return 0
-        return 0
-    except Exception:
-        return 0
-
-# クォータ使用量の保存
-def save_quota_usage(quota_used):
-    try:
-        today = datetime.now().strftime('%Y-%m-%d')
-        data = {
-            'date': today,
-            'quota_used': quota_used
-        }
-        with open(QUOTA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass  # 保存に失敗しても継続
+# 部分レスポンス（fields）で、表示・判定に使う項目だけを取得する
+SEARCH_FIELDS = 'nextPageToken,items(id/videoId,snippet/publishedAt)'
+VIDEO_FIELDS = 'items(id,snippet(channelId,title,description,publishedAt),statistics/viewCount,contentDetails/duration)'
+CHANNEL_FIELDS = 'items(id,snippet(title,country,defaultLanguage),statistics/subscriberCount)'
+VIEW_COUNT_FIELDS = 'items(id,statistics/viewCount)'
+
+# クォータ使用量の台帳（SQLite。全セッション・プロセスで共有）
+QUOTA_DB_PATH = os.getenv('QUOTA_DB_PATH', 'quota.sqlite3')
+QUOTA_DAILY_LIMIT = int(os.getenv('QUOTA_DAILY_LIMIT', '9000'))
+# API呼び出しのペース（トークンバケット）。足りない場合は最大 QUOTA_MAX_WAIT_SECONDS 秒待ち、それでも足りなければ拒否
+QUOTA_RATE_UNITS_PER_SECOND = float(os.getenv('QUOTA_RATE_UNITS_PER_SECOND', '20'))
+QUOTA_BURST_UNITS = float(os.getenv('QUOTA_BURST_UNITS', '1000'))
+QUOTA_MAX_WAIT_SECONDS = float(os.getenv('QUOTA_MAX_WAIT_SECONDS', '30'))
+
+# videos / channels の list で1回に指定できるIDの上限（search の maxResults の上限も同じ）
+API_MAX_IDS_PER_REQUEST = 50
+# 1回の検索で取得する件数の上限（50件ごとに検索1ページ＝100ユニット消費）
+SEARCH_MAX_RESULTS = int(os.getenv('SEARCH_MAX_RESULTS', '500'))
+# 動画・チャンネル情報を並行して取得するスレッド数
+SEARCH_FETCH_WORKERS = int(os.getenv('SEARCH_FETCH_WORKERS', '4'))
+
+# ウォッチリスト（保存した検索条件と同期した動画の履歴、SQLite）
+WATCHLIST_PATH = os.getenv('WATCHLIST_PATH', 'watchlist.sqlite3')
+# 同期時に視聴回数を更新する動画の条件（前回の更新からこの時間以上経過した動画を、新しい順に上限件数まで）
+WATCHLIST_STATS_MAX_AGE_HOURS = float(os.getenv('WATCHLIST_STATS_MAX_AGE_HOURS', '6'))
+WATCHLIST_STATS_REFRESH_LIMIT = int(os.getenv('WATCHLIST_STATS_REFRESH_LIMIT', '500'))
+
+# APIレスポンスのキャッシュ（SQLite。全セッション・プロセスで共有）
+API_CACHE_ENABLED = os.getenv('API_CACHE_ENABLED', '1') == '1'
+API_CACHE_PATH = os.getenv('API_CACHE_PATH', 'api_cache.sqlite3')
+# エンドポイントごとの有効期限（秒）。チャンネル情報は変化が遅く、視聴回数などの統計は数分で変わる
+API_CACHE_TTLS = {
+    'search': int(os.getenv('API_CACHE_TTL_SEARCH', '900')),
+    'videos': int(os.getenv('API_CACHE_TTL_VIDEOS', '300')),
+    'channels': int(os.getenv('API_CACHE_TTL_CHANNELS', '86400'))
+}
+
+# API使用量パネルを自動で更新する間隔（秒）。0 の場合は自動で更新しない
+QUOTA_PANEL_REFRESH_SECONDS = float(os.getenv('QUOTA_PANEL_REFRESH_SECONDS', '30'))
+
+# 再実行1回あたりの処理時間の目安（ミリ秒）。DEBUG_PANEL=1 の場合、サイドバーに区間ごとの処理時間を表示する
+DEBUG_PANEL = os.getenv('DEBUG_PANEL', '0') == '1'
+RERUN_BUDGET_MS = float(os.getenv('RERUN_BUDGET_MS', '300'))
 
 # セッション状態の初期化
 def initialize_session_state():
-    if 'quota_used' not in st.session_state:
-        st.session_state.quota_used = load_quota_usage()
-    if 'quota_limit' not in st.session_state:
-        st.session_state.quota_limit = 9000
     if 'last_search_time' not in st.session_state:
         st.session_state.last_search_time = None
     if 'search_results' not in st.session_state:
         st.session_state.search_results = None
     if 'filtered_channels' not in st.session_state:
         st.session_state.filtered_channels = []
+    if 'rerun_history' not in st.session_state:
+        st.session_state.rerun_history = deque(maxlen=20)
 
-# 最初に初期化を実行
-initialize_session_state()
+# 再実行1回分の区間ごとの処理時間（ミリ秒）。スクリプトの再実行のたびに空になる
+_rerun_timings = {}
 
-# StreamlitのCSSを直接注入
-def inject_css():
-    st.markdown("""
-    <style>
-    /* サイドバーの×ボタンのみをターゲット - より具体的なセレクタ */
-    [data-testid="stSidebar"] button[kind="header"],
-    [data-testid="stSidebar"] button[aria-label*="Close"],
-    [data-testid="stSidebar"] .css-1rs6os {
-        position: relative !important;
-        background: transparent !important;
-    }
-    
-    /* サイドバーの×ボタンのSVGのみ非表示 */
-    [data-testid="stSidebar"] button[kind="header"] svg,
-    [data-testid="stSidebar"] button[aria-label*="Close"] svg,
-    [data-testid="stSidebar"] .css-1rs6os svg {
-        opacity: 0 !important;
-        visibility: hidden !important;
-    }
-    
-    /* サイドバーの×ボタンにのみ疑似要素で×マークを作成 */
-    [data-testid="stSidebar"] button[kind="header"]::before,
-    [data-testid="stSidebar"] button[aria-label*="Close"]::before,
-    [data-testid="stSidebar"] .css-1rs6os::before {
-        content: "×" !important;
-        position: absolute !important;
-        top: 50% !important;
-        left: 50% !important;
-        transform: translate(-50%, -50%) !important;
-        color: black !important;
-        font-size: 18px !important;
-        font-weight: 900 !important;
-        z-index: 1000 !important;
-    }
-    
-    /* メインエリアの検索実行ボタンのスタイルを確保 */
-    .main button[kind="primary"],
-    button[data-testid="baseButton-primary"] {
-        background-color: #ff4b4b !important;
-        color: white !important;
-        border: none !important;
-        border-radius: 0.5rem !important;
-        position: relative !important;
-    }
-    
-    /* 検索実行ボタンの疑似要素を無効化 */
-    .main button[kind="primary"]::before,
-    button[data-testid="baseButton-primary"]::before {
-        display: none !important;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+@contextmanager
+def timed_section(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _rerun_timings[name] = _rerun_timings.get(name, 0.0) + (time.perf_counter() - started) * 1000.0
 
-# ISO 8601 duration を時間文字列に変換する関数
-def parse_duration(duration):
-    """
-    YouTube API の ISO 8601 duration (PT4M13S) を時間文字列 (4:13) に変換
-    """
-    import re
-    
-    if not duration:
-        return "不明"
-    
-    # PT4M13S のような形式をパース
-    pattern = r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?'
-    match = re.match(pattern, duration)
-    
-    if not match:
-        return "不明"
-    
-    hours, minutes, seconds = match.groups()
-    hours = int(hours) if hours else 0
-    minutes = int(minutes) if minutes else 0
-    seconds = int(seconds) if seconds else 0
-    
-    if hours > 0:
-        return f"{hours}:{minutes:02d}:{seconds:02d}"
-    else:
-        return f"{minutes}:{seconds:02d}"
+# スタイルシート（style.css）はプロセス内で1回だけ読み込む
+@st.cache_resource
+def load_css():
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'style.css'), encoding='utf-8') as f:
+        return f"<style>\n{f.read()}</style>"
+
+# StreamlitのCSSを注入（再実行のたびに1回）
+def inject_css():
+    st.markdown(load_css(), unsafe_allow_html=True)
 
 # ページ設定
 st.set_page_config(
@@ -158,225 +127,10 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# カスタムCSS
-st.markdown("""
-<style>
-    .main-title {
-        font-size: 2.5rem;
-        font-weight: bold;
-        color: #1f1f1f;
-        text-align: center;
-        margin-bottom: 0.2rem;
-    }
-    .subtitle-red {
-        font-size: 1.2rem;
-        color: #ff4b4b;
-        text-align: center;
-        margin-bottom: 0.2rem;
-        font-weight: 600;
-    }
-    .subtitle-gray {
-        font-size: 1rem;
-        color: #666666;
-        text-align: center;
-        margin-bottom: 2rem;
-    }
-    .metric-container {
-        background-color: #f0f2f6;
-        padding: 1rem;
-        border-radius: 0.5rem;
-        border-left: 4px solid #ff4b4b;
-    }
-    .warning-box {
-        background-color: #fff3cd;
-        border: 1px solid #ffeaa7;
-        border-radius: 0.5rem;
-        padding: 1rem;
-        margin: 1rem 0;
-    }
-    .danger-box {
-        background-color: #f8d7da;
-        border: 1px solid #f5c6cb;
-        border-radius: 0.5rem;
-        padding: 1rem;
-        margin: 1rem 0;
-    }
-    /* サイドバーの背景色変更 - より広範なセレクタを使用 */
-    .css-1d391kg, 
-    .css-17lntkn, 
-    .css-1lcbmhc, 
-    .css-1y4p8pa,
-    [data-testid="stSidebar"] > div:first-child,
-    section[data-testid="stSidebar"] > div {
-        background-color: #1e3a8a !important;
-    }
-    
-    /* サイドバーのテキストを白色に（入力フィールドと×ボタンは除外） */
-    .css-1d391kg *:not(input):not(textarea):not(line),
-    .css-17lntkn *:not(input):not(textarea):not(line),
-    .css-1lcbmhc *:not(input):not(textarea):not(line),
-    .css-1y4p8pa *:not(input):not(textarea):not(line),
-    [data-testid="stSidebar"] *:not(input):not(textarea):not(line),
-    section[data-testid="stSidebar"] *:not(input):not(textarea):not(line) {
-        color: white !important;
-    }
-    
-    /* サイドバーのヘッダー */
-    [data-testid="stSidebar"] h2,
-    [data-testid="stSidebar"] h3 {
-        color: white !important;
-    }
-    
-    /* 入力フィールドのラベル */
-    [data-testid="stSidebar"] label {
-        color: white !important;
-    }
-    
-    /* スライダーのスタイル調整 */
-    [data-testid="stSidebar"] .stSlider > div > div > div > div {
-        color: white !important;
-    }
-    
-    /* 入力フィールドのスタイル調整 */
-    [data-testid="stSidebar"] input {
-        background-color: white !important;
-        color: black !important;
-        border: 1px solid #ccc !important;
-    }
-    
-    /* ヘルプアイコン（?マーク）のスタイル */
-    [data-testid="stSidebar"] .css-1cpxqw2,
-    [data-testid="stSidebar"] [data-testid="stTooltipIcon"],
-    [data-testid="stSidebar"] .css-1wgd1hx,
-    [data-testid="stSidebar"] .st-emotion-cache-1wgd1hx {
-        color: white !important;
-    }
-    
-    /* ヘルプアイコンのSVG - 円の枠線は白、中身は透明、?マークは白 */
-    [data-testid="stSidebar"] svg circle {
-        fill: none !important;
-        stroke: white !important;
-        stroke-width: 1.5 !important;
-    }
-    
-    [data-testid="stSidebar"] svg path {
-        fill: white !important;
-    }
-    
-    /* サイドバーの×ボタンのみの全体的なスタイル */
-    section[data-testid="stSidebar"] button[kind="header"],
-    section[data-testid="stSidebar"] button[aria-label*="Close"],
-    section[data-testid="stSidebar"] .css-1rs6os,
-    section[data-testid="stSidebar"] [data-testid="baseButton-header"] {
-        background-color: transparent !important;
-        background: transparent !important;
-        border: none !important;
-    }
-    
-    /* ×ボタンのSVG - 全ての可能なセレクタを網羅 */
-    section[data-testid="stSidebar"] svg,
-    section[data-testid="stSidebar"] button svg,
-    section[data-testid="stSidebar"] .css-1rs6os svg,
-    section[data-testid="stSidebar"] [data-testid="baseButton-header"] svg,
-    section[data-testid="stSidebar"] .st-emotion-cache-1rs6os svg {
-        background-color: transparent !important;
-        background: transparent !important;
-    }
-    
-    /* ×ボタンを完全に非表示にして、CSS疑似要素で代替 */
-    section[data-testid="stSidebar"] button[kind="header"],
-    section[data-testid="stSidebar"] button[aria-label*="Close"],
-    section[data-testid="stSidebar"] .css-1rs6os {
-        position: relative !important;
-        background: transparent !important;
-        border: none !important;
-        width: 24px !important;
-        height: 24px !important;
-    }
-    
-    /* 既存のSVGを非表示 */
-    section[data-testid="stSidebar"] button[kind="header"] svg,
-    section[data-testid="stSidebar"] button[aria-label*="Close"] svg,
-    section[data-testid="stSidebar"] .css-1rs6os svg {
-        display: none !important;
-    }
-    
-    /* CSS疑似要素で×マークを作成 */
-    section[data-testid="stSidebar"] button[kind="header"]::before,
-    section[data-testid="stSidebar"] button[aria-label*="Close"]::before,
-    section[data-testid="stSidebar"] .css-1rs6os::before {
-        content: "✕" !important;
-        position: absolute !important;
-        top: 50% !important;
-        left: 50% !important;
-        transform: translate(-50%, -50%) !important;
-        color: #000000 !important;
-        font-size: 16px !important;
-        font-weight: bold !important;
-        line-height: 1 !important;
-    }
-    
-    /* 代替として、CSSで線を描画 */
-    section[data-testid="stSidebar"] button[kind="header"]::after,
-    section[data-testid="stSidebar"] button[aria-label*="Close"]::after,
-    section[data-testid="stSidebar"] .css-1rs6os::after {
-        content: "" !important;
-        position: absolute !important;
-        top: 50% !important;
-        left: 50% !important;
-        width: 14px !important;
-        height: 2px !important;
-        background: #000000 !important;
-        transform: translate(-50%, -50%) rotate(45deg) !important;
-        border-radius: 1px !important;
-    }
-    
-    section[data-testid="stSidebar"] button[kind="header"]::before,
-    section[data-testid="stSidebar"] button[aria-label*="Close"]::before,
-    section[data-testid="stSidebar"] .css-1rs6os::before {
-        content: "" !important;
-        position: absolute !important;
-        top: 50% !important;
-        left: 50% !important;
-        width: 14px !important;
-        height: 2px !important;  
-        background: #000000 !important;
-        transform: translate(-50%, -50%) rotate(-45deg) !important;
-        border-radius: 1px !important;
-    }
-    
-    /* メインエリアのボタンスタイルを保護 */
-    .main button,
-    .block-container button {
-        position: static !important;
-    }
-    
-    /* メインエリアのボタンの疑似要素を完全に無効化 */
-    .main button::before,
-    .main button::after,
-    .block-container button::before,
-    .block-container button::after {
-        display: none !important;
-        content: none !important;
-    }
-    
-    /* primaryボタン（検索実行ボタン）の正常なスタイル */
-    button[kind="primary"] {
-        background-color: rgb(255, 75, 75) !important;
-        color: white !important;
-        border: 1px solid rgb(255, 75, 75) !important;
-        border-radius: 0.5rem !important;
-    }
-    
-    /* secondaryボタン（再生ボタン）の正常なスタイル */
-    button[kind="secondary"] {
-        background-color: white !important;
-        color: rgb(49, 51, 63) !important;
-        border: 1px solid rgb(230, 234, 241) !important;
-        border-radius: 0.5rem !important;
-    }
-</style>
-""", unsafe_allow_html=True)
+# API呼び出しに使うHTTPクライアント（接続プールをすべてのセッション・スレッドで共有）
+@st.cache_resource
+def get_http_client():
+    return PooledHttp(API_POOL_SIZE, API_TIMEOUT_SECONDS)
 
 # YouTube API v3クライアントを初期化
 @st.cache_resource
@@ -387,167 +141,461 @@ def get_youtube_client():
         return None
     
     try:
-        youtube = build('youtube', 'v3', developerKey=YOUTUBE_API_KEY)
+        youtube = build_youtube_client(YOUTUBE_API_KEY, get_http_client(), YOUTUBE_API_ENDPOINT)
         return youtube
     except Exception as e:
         st.error(f"YouTube API クライアントの初期化に失敗しました: {e}")
         return None
 
-# 動画検索機能
-def search_videos(query, published_after, japan_only=True, max_results=50):
+# APIレスポンスのキャッシュを初期化（プロセス内で1つ）
+@st.cache_resource
+def get_api_cache():
+    if not API_CACHE_ENABLED:
+        return None
+    try:
+        return ApiCache(API_CACHE_PATH, API_CACHE_TTLS)
+    except Exception as e:
+        # キャッシュが使えなくても検索は継続
+        st.warning(f"APIキャッシュの初期化に失敗しました: {e}")
+        return None
+
+# クォータ台帳を初期化（プロセス内で1つ）
+@st.cache_resource
+def get_quota_ledger():
+    return QuotaLedger(
+        QUOTA_DB_PATH,
+        QUOTA_DAILY_LIMIT,
+        rate=QUOTA_RATE_UNITS_PER_SECOND,
+        burst=QUOTA_BURST_UNITS,
+        max_wait=QUOTA_MAX_WAIT_SECONDS
+    )
+
+# APIリクエストを実行（一時的なエラーは再試行する。失敗した呼び出しもクォータを消費するため、試行ごとに台帳でコストを消費する）
+def execute_api(ledger, endpoint, request):
+    return execute_with_retry(request, API_RETRY_POLICY, lambda: ledger.acquire(endpoint))
+
+# ID指定の list リクエスト（videos / channels）をキャッシュ経由で実行し、ID順の items と実際に呼び出した回数を返す
+# APIの上限に合わせて50件ずつに分けて取得する
+def list_by_ids(cache, ledger, endpoint, request, part, ids, fields=None):
+    cached = cache.get_items(endpoint, part, ids, fields=fields) if cache else {}
+    missing = [item_id for item_id in ids if item_id not in cached]
+    items = dict(cached)
+    calls = 0
+    for start in range(0, len(missing), API_MAX_IDS_PER_REQUEST):
+        chunk = missing[start:start + API_MAX_IDS_PER_REQUEST]
+        fetched = execute_api(ledger, endpoint, request(part=part, id=','.join(chunk), fields=fields))['items']
+        calls += 1
+        if cache:
+            cache.put_items(endpoint, part, fetched, fields=fields)
+        items.update((item['id'], item) for item in fetched)
+    if cache:
+        # キャッシュがなければ必要だった呼び出し回数との差を節約分として記録
+        saved = -(-len(ids) // API_MAX_IDS_PER_REQUEST) - calls
+        cache.record_saving(endpoint, saved * API_COSTS[endpoint])
+    return [items[item_id] for item_id in ids if item_id in items], calls
+
+# スレッドプールのワーカーごとのYouTube APIクライアント（HTTPの接続プールは共有する）
+_thread_clients = threading.local()
+
+def get_thread_youtube_client(http):
+    youtube = getattr(_thread_clients, 'youtube', None)
+    if youtube is None:
+        youtube = build_youtube_client(YOUTUBE_API_KEY, http, YOUTUBE_API_ENDPOINT)
+        _thread_clients.youtube = youtube
+    return youtube
+
+# 1ページ分の動画の詳細とチャンネル情報を取得（スレッドプールで実行するため st.* は呼ばない）
+def fetch_page_details(cache, ledger, http, video_ids, known_channel_ids):
+    youtube = get_thread_youtube_client(http)
+    video_items, _ = list_by_ids(
+        cache, ledger, 'videos', youtube.videos().list, 'statistics,snippet,contentDetails', video_ids, VIDEO_FIELDS
+    )
+    # 前のページで判定済みのチャンネルは取得しない
+    channel_ids = [
+        channel_id for channel_id in dict.fromkeys(item['snippet']['channelId'] for item in video_items)
+        if channel_id not in known_channel_ids
+    ]
+    channel_items, _ = list_by_ids(
+        cache, ledger, 'channels', youtube.channels().list, 'statistics,snippet', channel_ids, CHANNEL_FIELDS
+    )
+    return video_items, channel_items
+
+# 動画検索機能（ページ単位で取得し、ページを処理するたびにそれまでの結果のDataFrameを返す）
+# record_debug が False の場合は画面のフィルタリング詳細情報を更新しない（ウォッチリストの同期用）
+# search_state に辞書を渡すと、処理したページの検索結果（日本チャンネルの絞り込み前）の最新・最古の投稿日時を
+# newest / oldest に、検索範囲の最後のページまで処理できたかを complete に記録する
+# cache_search が False の場合は検索結果のキャッシュを使わない（キャッシュのキーは日時を丸めるため、期間を厳密に指定する同期用）
+def iter_search_videos(query, published_after, japan_only=True, max_results=50, record_debug=True,
+                       published_before=None, search_state=None, cache_search=True):
     youtube = get_youtube_client()
     if not youtube:
-        return None
+        return
+    cache = get_api_cache()
+    ledger = get_quota_ledger()
+    http = get_http_client()
+    
+    # UTC形式でISO 8601タイムスタンプを作成
+    published_after_utc = published_after.replace(tzinfo=None).isoformat() + 'Z'
+    
+    # 検索パラメータを設定（投稿日時は同期のウォーターマークに使う）
+    search_params = {
+        'q': query,
+        'part': 'id,snippet',
+        'maxResults': min(max_results, API_MAX_IDS_PER_REQUEST),
+        'order': 'date',
+        'type': 'video',
+        'publishedAfter': published_after_utc,
+        'regionCode': 'JP',
+        'fields': SEARCH_FIELDS
+    }
+    if published_before is not None:
+        search_params['publishedBefore'] = published_before.replace(tzinfo=None).isoformat() + 'Z'
+    
+    # 日本チャンネル限定の場合、日本語の検索語を追加
+    if japan_only:
+        search_params['relevanceLanguage'] = 'ja'
+        # 検索クエリに日本語キーワードを追加してより日本関連のコンテンツを取得
+        search_params['q'] = f"{query} 日本"
+    
+    builder = ResultBuilder(japan_only)
+    debug_info = {'pages': 0, 'total_videos_found': 0, 'total_channels': 0, 'filtered_channels': 0, 'final_videos': 0}
+    filtered_channels = []
+    if record_debug:
+        st.session_state.debug_info = debug_info
+        if not hasattr(st.session_state, 'filtered_channels'):
+            st.session_state.filtered_channels = []
+        filtered_channels = st.session_state.filtered_channels
+    if search_state is None:
+        search_state = {}
+    search_state.update(newest=None, oldest=None, complete=False)
+    pending = deque()
+    
+    def process(page):
+        # 完了したページの結果を取り込み、それまでの結果を返す（ページ順を保つ）
+        future, published = page
+        video_items, channel_items = future.result()
+        channels = builder.add_page(video_items, channel_items)
+        # ISO 8601（UTC）の文字列は辞書順が時刻順と一致する
+        search_state['newest'] = max(filter(None, [search_state['newest'], *published]))
+        search_state['oldest'] = min(filter(None, [search_state['oldest'], *published]))
+        excluded = [channel for channel in channels if not channel['is_japanese']]
+        debug_info['total_channels'] += len(channels)
+        debug_info['filtered_channels'] += len(excluded)
+        # デバッグ用：除外されたチャンネルの情報を記録
+        filtered_channels.extend(
+            {key: channel[key] for key in ('name', 'country', 'language', 'has_japanese')} for channel in excluded
+        )
+        results = builder.results()
+        debug_info['final_videos'] = len(results)
+        return results
     
+    # 検索はページトークンを順にたどり、各ページの動画・チャンネルの取得は次のページの検索と並行して行う
+    executor = ThreadPoolExecutor(max_workers=SEARCH_FETCH_WORKERS)
+    exhausted = False
     try:
-        # 検索リクエスト（約100ユニット消費）
-        # UTC形式でISO 8601タイムスタンプを作成
-        published_after_utc = published_after.replace(tzinfo=None).isoformat() + 'Z'
-        
-        # 検索パラメータを設定
-        search_params = {
-            'q': query,
-            'part': 'id,snippet',
-            'maxResults': max_results,
-            'order': 'date',
-            'type': 'video',
-            'publishedAfter': published_after_utc,
-            'regionCode': 'JP'
-        }
-        
-        # 日本チャンネル限定の場合、日本語の検索語を追加
-        if japan_only:
-            search_params['relevanceLanguage'] = 'ja'
-            # 検索クエリに日本語キーワードを追加してより日本関連のコンテンツを取得
-            search_params['q'] = f"{query} 日本"
-        
-        search_response = youtube.search().list(**search_params).execute()
-        
-        # 動画IDを収集
-        video_ids = [item['id']['videoId'] for item in search_response['items']]
-        
-        if not video_ids:
-            return pd.DataFrame()
-        
-        # 動画詳細情報を取得（約1ユニット/動画）
-        videos_response = youtube.videos().list(
-            part='statistics,snippet,contentDetails',
-            id=','.join(video_ids)
-        ).execute()
-        
-        # チャンネル情報を取得するためのチャンネルIDを収集
-        channel_ids = list(set([item['snippet']['channelId'] for item in videos_response['items']]))
-        
-        # チャンネル詳細情報を取得（約1ユニット/チャンネル）
-        channels_response = youtube.channels().list(
-            part='statistics,snippet,localizations',
-            id=','.join(channel_ids)
-        ).execute()
-        
-        # チャンネル情報を辞書形式で整理
-        channel_info = {}
-        filtered_count = 0
-        total_channels = len(channels_response['items'])
-        
-        for channel in channels_response['items']:
-            # 日本チャンネル判定（国コード、言語、チャンネル名の日本語文字含有で判定）
-            is_japanese_channel = True
-            if japan_only:
-                country = channel['snippet'].get('country', '')
-                default_language = channel['snippet'].get('defaultLanguage', '')
-                channel_title = channel['snippet']['title']
-                
-                # 日本語文字が含まれているかチェック
-                has_japanese = bool(re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', channel_title))
-                
-                # 日本チャンネル判定条件（より厳密に）
-                is_japanese_channel = (
-                    country == 'JP' or 
-                    default_language == 'ja' or 
-                    has_japanese
-                )
-                
-                # 追加の判定：動画タイトルや説明文に日本語が含まれているかチェック
-                if not is_japanese_channel:
-                    # 対応する動画のタイトルをチェック
-                    matching_videos = [v for v in videos_response['items'] if v['snippet']['channelId'] == channel['id']]
-                    for video in matching_videos:
-                        video_title = video['snippet']['title']
-                        video_description = video['snippet'].get('description', '')
-                        if (re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', video_title) or 
-                            re.search(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]', video_description)):
-                            is_japanese_channel = True
-                            break
-                
-                if not is_japanese_channel:
-                    filtered_count += 1
+        page_token = None
+        while debug_info['total_videos_found'] < max_results:
+            if ledger.used() + API_COSTS['search'] > ledger.daily_limit:
+                st.warning("⚠️ クォータ上限に達したため、取得を途中で停止しました。")
+                break
+            params = dict(search_params, pageToken=page_token) if page_token else search_params
             
-            if is_japanese_channel:
-                channel_info[channel['id']] = {
-                    'name': channel['snippet']['title'],
-                    'subscriber_count': int(channel['statistics'].get('subscriberCount', 0)),
-                    'country': country,
-                    'language': default_language,
-                    'has_japanese': has_japanese if japan_only else None
-                }
-            else:
-                # デバッグ用：除外されたチャンネルの情報を記録
-                if not hasattr(st.session_state, 'filtered_channels'):
-                    st.session_state.filtered_channels = []
-                st.session_state.filtered_channels.append({
-                    'name': channel['snippet']['title'],
-                    'country': country,
-                    'language': default_language,
-                    'has_japanese': has_japanese
-                })
-        
-        # データフレーム作成（日本チャンネルのみフィルタリング）
-        videos_data = []
-        for video in videos_response['items']:
-            channel_id = video['snippet']['channelId']
-            # 日本チャンネル限定の場合、チャンネル情報があるもののみ追加
-            if channel_id in channel_info:
-                duration = video.get('contentDetails', {}).get('duration', '')
-                videos_data.append({
-                    '動画ID': video['id'],
-                    'タイトル': video['snippet']['title'],
-                    '視聴回数': int(video['statistics'].get('viewCount', 0)),
-                    '投稿日時': parse(video['snippet']['publishedAt']).strftime('%Y-%m-%d %H:%M'),
-                    '動画時間': parse_duration(duration),
-                    'チャンネル名': channel_info[channel_id]['name'],
-                    '登録者数': channel_info[channel_id]['subscriber_count']
-                })
-        
-        # クォータ使用量を更新（概算）
-        quota_used = 100 + len(video_ids) + len(channel_ids)
-        st.session_state.quota_used += quota_used
-        # 使用量を永続化
-        save_quota_usage(st.session_state.quota_used)
-        
-        # デバッグ情報をセッション状態に保存
-        st.session_state.debug_info = {
-            'total_videos_found': len(search_response['items']),
-            'total_channels': total_channels,
-            'filtered_channels': filtered_count,
-            'final_videos': len(videos_data)
-        }
+            # 同じ条件の検索が最近行われていればキャッシュから返す（他のセッションの検索結果も使う）
+            # 検索リクエスト（100ユニット消費）
+            search_response = cache.get('search', params, cost=API_COSTS['search']) if cache and cache_search else None
+            if search_response is None:
+                search_response = execute_api(ledger, 'search', youtube.search().list(**params))
+                if cache and cache_search:
+                    cache.put('search', params, search_response)
+            
+            # 予算を超える分は捨てる
+            items = search_response['items'][:max_results - debug_info['total_videos_found']]
+            debug_info['pages'] += 1
+            debug_info['total_videos_found'] += len(items)
+            video_ids = [item['id']['videoId'] for item in items]
+            if video_ids:
+                known_channel_ids = set(builder.known_channel_ids)
+                pending.append((
+                    executor.submit(fetch_page_details, cache, ledger, http, video_ids, known_channel_ids),
+                    [item['snippet']['publishedAt'] for item in items]
+                ))
+            
+            # 先に完了したページから順に表示する
+            while pending and pending[0][0].done():
+                yield process(pending.popleft())
+            
+            page_token = search_response.get('nextPageToken')
+            if not page_token or not items:
+                # 予算で切り捨てた分がなければ検索範囲の最後まで取得した
+                exhausted = len(items) == len(search_response['items'])
+                break
         
-        return pd.DataFrame(videos_data)
+        while pending:
+            yield process(pending.popleft())
+        search_state['complete'] = exhausted
         
+        if not debug_info['total_videos_found']:
+            yield pd.DataFrame()
+    except QuotaExceededError:
+        st.error("❌ クォータ上限に達したため、取得を途中で停止しました。")
+    except RateLimitedError:
+        st.error("⏳ API呼び出しが集中しているため、取得を途中で停止しました。しばらくしてから再度お試しください。")
     except HttpError as e:
         st.error(f"YouTube API エラー: {e}")
-        return None
+    except (TimeoutError, ConnectionError) as e:
+        st.error(f"YouTube API に接続できませんでした（再試行後）: {e}")
     except Exception as e:
         st.error(f"検索中にエラーが発生しました: {e}")
+    finally:
+        # エラー時は未完了の取得を待たずに戻る
+        executor.shutdown(wait=False, cancel_futures=True)
+
+# 動画検索機能（すべてのページを取得してから結果を返す。失敗した場合は None）
+def search_videos(query, published_after, japan_only=True, max_results=50):
+    results = None
+    for results in iter_search_videos(query, published_after, japan_only, max_results):
+        pass
+    return results
+
+# ウォッチリストのストアを初期化（プロセス内で1つ）
+@st.cache_resource
+def get_watchlist():
+    return WatchList(WATCHLIST_PATH)
+
+# 保存した検索条件を同期し、(新しく見つかった動画数, 視聴回数を更新した動画数, 新着をすべて取得できたか) を返す。失敗した場合は None
+# 前回の同期で見た最新の投稿日時（ウォーターマーク）以降だけを検索し、既存の動画は統計が古いものだけ視聴回数を取り直す。
+# 検索は新しい順のため、件数の上限やエラーで途中までしか取得できなかった場合はウォーターマークを進めず、
+# 取得できた最も古い投稿日時を続きの位置として記録し、次回はそれ以前（publishedBefore）から続きを取得する
+def sync_saved_search(search_id):
+    watchlist = get_watchlist()
+    search = watchlist.get_search(search_id)
+    published_after = parse(search['watermark']).replace(tzinfo=None)
+    published_before = parse(search['resume_before']).replace(tzinfo=None) if search['resume_before'] else None
+    
+    state = {}
+    results = None
+    for results in iter_search_videos(
+        search['query'], published_after, search['japan_only'], SEARCH_MAX_RESULTS,
+        record_debug=False, published_before=published_before, search_state=state, cache_search=False
+    ):
+        pass
+    if results is None:
         return None
+    
+    new_videos = [
+        {
+            'video_id': row['動画ID'],
+            'title': row['タイトル'],
+            'view_count': row['視聴回数'],
+            'published_at': row['投稿日時'],
+            'duration': row['動画時間'],
+            'channel_name': row['チャンネル名'],
+            'subscriber_count': row['登録者数']
+        }
+        for row in results.to_dict('records')
+    ]
+    # ウォーターマークは日本チャンネルの絞り込み前の検索結果から決める（新着がすべて除外された場合も進める）
+    # publishedAfter・publishedBefore はその時刻ちょうどの動画も返すため、境界の動画は次回も返ってくる（既存の動画は重複して追加されない）
+    added = watchlist.add_videos(search_id, new_videos, state['newest'], state['oldest'], state['complete'])
+    
+    # 統計が古い動画の視聴回数だけを取り直す（50件ごとに1リクエスト）
+    stale_ids = watchlist.stale_video_ids(search_id, WATCHLIST_STATS_MAX_AGE_HOURS * 3600, WATCHLIST_STATS_REFRESH_LIMIT)
+    if stale_ids:
+        youtube = get_youtube_client()
+        if not youtube:
+            return added, 0, state['complete']
+        try:
+            items, _ = list_by_ids(
+                get_api_cache(), get_quota_ledger(), 'videos', youtube.videos().list, 'statistics', stale_ids, VIEW_COUNT_FIELDS
+            )
+        except (HttpError, TimeoutError, ConnectionError, QuotaExceededError, RateLimitedError) as e:
+            st.error(f"視聴回数の更新に失敗しました: {e}")
+            return added, 0, state['complete']
+        watchlist.update_view_counts(
+            {item['id']: int(item['statistics'].get('viewCount', 0)) for item in items}, checked_ids=stale_ids
+        )
+    return added, len(stale_ids), state['complete']
+
+# 検索結果テーブルの列設定
+def results_column_config():
+    return {
+        "視聴回数": st.column_config.NumberColumn(
+            "視聴回数",
+            format="%d 回"
+        ),
+        "登録者数": st.column_config.NumberColumn(
+            "登録者数",
+            format="%d 人"
+        )
+    }
+
+# ウォッチリストの履歴を表示用のDataFrameにする（同期するまでは同じ結果を使う。他の検索条件の同期で更新された視聴回数は ttl 秒で反映）
+@st.cache_data(ttl=60)
+def load_history(search_id, last_synced_at):
+    videos = get_watchlist().videos(search_id)
+    if not videos:
+        return None
+    return pd.DataFrame(videos).rename(columns={
+        'video_id': '動画ID',
+        'title': 'タイトル',
+        'view_count': '視聴回数',
+        'published_at': '投稿日時',
+        'duration': '動画時間',
+        'channel_name': 'チャンネル名',
+        'subscriber_count': '登録者数'
+    }).drop(columns=['stats_updated_at'])
+
+# ウォッチリストの表示と同期（操作してもこの部分だけを再実行する）
+@st.fragment
+def render_watchlist():
+    watchlist = get_watchlist()
+    searches = watchlist.searches()
+    st.subheader("📚 ウォッチリスト")
+    if not searches:
+        st.caption("サイドバーの「⭐ この条件をウォッチリストに保存」で検索条件を保存すると、新しい動画だけを差分で取得できます。")
+        return
+    
+    labels = {
+        search['id']: f"{search['query']}（{'日本のみ' if search['japan_only'] else 'すべて'}・{search['video_count']}件）"
+        for search in searches
+    }
+    search_id = st.selectbox("保存した検索条件", list(labels), format_func=labels.get)
+    search = next(search for search in searches if search['id'] == search_id)
+    
+    sync_col, delete_col = st.columns([1, 1])
+    with sync_col:
+        sync_button = st.button("🔄 同期（新着のみ取得）", key="watchlist_sync")
+    with delete_col:
+        delete_button = st.button("🗑️ 削除", key="watchlist_delete")
+    
+    if delete_button:
+        watchlist.delete_search(search_id)
+        st.rerun(scope='fragment')
+    if sync_button:
+        ledger = get_quota_ledger()
+        if ledger.used() + API_COSTS['search'] > ledger.daily_limit:
+            st.error("❌ クォータ上限に達しているため、同期を実行できません。")
+        else:
+            with st.spinner("🔄 新着動画を同期中..."):
+                synced = sync_saved_search(search_id)
+            if synced is not None:
+                added, refreshed, complete = synced
+                st.success(f"新着 {added}件を追加し、{refreshed}件の視聴回数を更新しました")
+                if not complete:
+                    st.info("新着をすべて取得できなかったため、残りは次回の同期で続きから取得します。")
+                search = watchlist.get_search(search_id)
+    
+    if search['last_synced_at']:
+        st.caption(
+            f"最終同期: {datetime.fromtimestamp(search['last_synced_at']).strftime('%Y-%m-%d %H:%M:%S')}"
+            f" | 取得済みの最新投稿日時: {search['watermark']}"
+            + (f" | 未取得の続き: {search['resume_before']} 以前" if search['resume_before'] else "")
+        )
+    history = load_history(search_id, search['last_synced_at'])
+    if history is not None:
+        st.dataframe(history, use_container_width=True, hide_index=True, column_config=results_column_config())
+    else:
+        st.caption("まだ同期していません。")
+
+# API使用量パネル（一定間隔でこの部分だけを再実行し、他のセッションの使用量も反映する）
+@st.fragment(run_every=QUOTA_PANEL_REFRESH_SECONDS or None)
+def render_quota_panel():
+    st.subheader("📈 API使用量")
+    # 全セッション・プロセスの合計（太平洋時間の0時にリセット）
+    ledger = get_quota_ledger()
+    quota_used = ledger.used()
+    quota_percentage = (quota_used / ledger.daily_limit) * 100
+    
+    # プログレスバー
+    st.progress(min(quota_percentage / 100, 1.0))
+    st.metric(
+        "使用量 / 上限",
+        f"{quota_used} / {ledger.daily_limit}",
+        f"{quota_percentage:.1f}%"
+    )
+    
+    # アラート表示
+    if quota_percentage >= 100:
+        st.markdown("""
+        <div class="danger-box">
+            ⚠️ <strong>クォータ上限に達しました</strong><br>
+            API呼び出しが停止されています。
+        </div>
+        """, unsafe_allow_html=True)
+    elif quota_percentage >= 90:
+        st.markdown("""
+        <div class="warning-box">
+            ⚠️ <strong>クォータ使用量が90%を超えました</strong><br>
+            残り使用量にご注意ください。
+        </div>
+        """, unsafe_allow_html=True)
+    
+    st.info("💡 検索50件ごとに100ユニット、動画・チャンネル情報の取得50件ごとに1ユニット消費")
+    
+    # 今日のエンドポイント別の呼び出し回数
+    calls = ledger.calls()
+    if calls:
+        st.caption("📞 " + " | ".join(f"{endpoint}: {count}回（{units}ユニット）" for endpoint, (count, units) in calls.items()))
+    
+    # キャッシュの効果（クォータと同じ太平洋時間の今日の、全セッション・プロセスの合計）
+    cache = get_api_cache()
+    if cache:
+        cache_stats = cache.stats()
+        st.caption(
+            f"🗄️ キャッシュヒット率: {cache_stats['hit_rate'] * 100:.1f}%"
+            f"（{cache_stats['hits']} / {cache_stats['hits'] + cache_stats['misses']}）"
+            f" | 節約したユニット: {cache_stats['units_saved']}"
+        )
+
+# 動画再生（入力・再生してもこの部分だけを再実行し、検索結果の表を送り直さない）
+@st.fragment
+def render_player():
+    st.subheader("🎬 動画再生")
+    
+    video_id_input = st.text_input(
+        "動画IDを入力",
+        placeholder="例: dQw4w9WgXcQ",
+        help="YouTubeの動画IDを入力してください"
+    )
+    
+    play_button = st.button("▶️ 再生", type="secondary")
+    
+    if play_button and video_id_input:
+        try:
+            st.video(f"https://www.youtube.com/watch?v={video_id_input}")
+        except Exception as e:
+            st.error(f"動画の再生に失敗しました: {e}")
+
+# 再実行の処理時間（区間ごと・直近の再実行）を表示するデバッグパネル
+def render_debug_panel():
+    total = (time.perf_counter() - RERUN_STARTED) * 1000.0
+    history = st.session_state.rerun_history
+    history.append(total)
+    with st.sidebar.expander("⏱️ 再実行の処理時間", expanded=total > RERUN_BUDGET_MS):
+        st.metric(
+            "今回の再実行",
+            f"{total:.0f} ms",
+            f"{total - RERUN_BUDGET_MS:+.0f} ms（目安 {RERUN_BUDGET_MS:.0f} ms）",
+            delta_color="inverse"
+        )
+        if total > RERUN_BUDGET_MS:
+            st.warning("目安の時間を超えています")
+        for name, milliseconds in sorted(_rerun_timings.items(), key=lambda item: -item[1]):
+            st.caption(f"{name}: {milliseconds:.1f} ms")
+        ordered = sorted(history)
+        st.caption(
+            f"直近{len(ordered)}回: 中央値 {ordered[len(ordered) // 2]:.0f} ms / 最大 {ordered[-1]:.0f} ms"
+            "（部分的な再実行は含まない）"
+        )
 
 # メイン関数
 def main():
     # セッション状態を最初に初期化
     initialize_session_state()
     
-    # 追加のCSSを注入
-    inject_css()
+    # CSSを注入
+    with timed_section('css'):
+        inject_css()
     
     # タイトル部分
     st.markdown('<div class="main-title">YouTube動画分析アプリ</div>', unsafe_allow_html=True)
@@ -580,11 +628,28 @@ def main():
         help="日本のチャンネルの動画のみを検索対象にします"
     )
     
+    # 取得件数（50件を超える場合はページをたどって取得）
+    max_results = st.sidebar.slider(
+        "最大取得件数",
+        min_value=API_MAX_IDS_PER_REQUEST,
+        max_value=max(API_MAX_IDS_PER_REQUEST, SEARCH_MAX_RESULTS),
+        value=API_MAX_IDS_PER_REQUEST,
+        step=API_MAX_IDS_PER_REQUEST,
+        help="50件ごとに検索1回分（約100ユニット）を消費します"
+    )
+    
     published_after = datetime.now() - timedelta(days=days_back)
     
     # 検索ボタン
     search_button = st.sidebar.button("🔍 検索実行", type="primary")
     
+    # 現在の検索条件をウォッチリストに保存（初回の同期は投稿日範囲の開始日時から）
+    if st.sidebar.button("⭐ この条件をウォッチリストに保存"):
+        get_watchlist().save_search(
+            search_query.strip(), japan_only, published_after.replace(tzinfo=None).isoformat(timespec='seconds') + 'Z'
+        )
+        st.sidebar.success("ウォッチリストに保存しました")
+    
     # メインフレーム
     col1, col2 = st.columns([2, 1])
     
@@ -595,51 +660,36 @@ def main():
             <strong>検索キーワード:</strong> {search_query}<br>
             <strong>投稿日範囲:</strong> {published_after.strftime('%Y-%m-%d')} 以降<br>
             <strong>日本チャンネル限定:</strong> {'はい' if japan_only else 'いいえ'}<br>
-            <strong>最大表示件数:</strong> 50件
+            <strong>最大表示件数:</strong> {max_results}件
         </div>
         """, unsafe_allow_html=True)
     
-    with col2:
-        st.subheader("📈 API使用量")
-        quota_percentage = (st.session_state.quota_used / st.session_state.quota_limit) * 100
-        
-        # プログレスバー
-        st.progress(quota_percentage / 100)
-        st.metric(
-            "使用量 / 上限",
-            f"{st.session_state.quota_used} / {st.session_state.quota_limit}",
-            f"{quota_percentage:.1f}%"
-        )
-        
-        # アラート表示
-        if quota_percentage >= 100:
-            st.markdown("""
-            <div class="danger-box">
-                ⚠️ <strong>クォータ上限に達しました</strong><br>
-                API呼び出しが停止されています。
-            </div>
-            """, unsafe_allow_html=True)
-        elif quota_percentage >= 90:
-            st.markdown("""
-            <div class="warning-box">
-                ⚠️ <strong>クォータ使用量が90%を超えました</strong><br>
-                残り使用量にご注意ください。
-            </div>
-            """, unsafe_allow_html=True)
-        
-        st.info("💡 検索1回あたり約100ユニット消費")
+    with col2, timed_section('quota_panel'):
+        render_quota_panel()
     
     # 検索実行
     if search_button:
-        if st.session_state.quota_used >= st.session_state.quota_limit:
+        ledger = get_quota_ledger()
+        if ledger.used() + API_COSTS['search'] > ledger.daily_limit:
             st.error("❌ クォータ上限に達しているため、検索を実行できません。")
         else:
-            with st.spinner("🔍 動画を検索中..."):
-                # 前回の除外チャンネルリストをクリア
-                st.session_state.filtered_channels = []
-                results = search_videos(search_query, published_after, japan_only)
-                st.session_state.search_results = results
-                st.session_state.last_search_time = datetime.now()
+            # 前回の除外チャンネルリストをクリア
+            st.session_state.filtered_channels = []
+            st.session_state.search_results = None
+            # 取得できたページから順に途中結果を表示（完了後は下の検索結果に置き換える）
+            progress = st.empty()
+            preview = st.empty()
+            progress.info("🔍 動画を検索中...")
+            with timed_section('search'):
+                for results in iter_search_videos(search_query, published_after, japan_only, max_results):
+                    st.session_state.search_results = results
+                    progress.info(
+                        f"🔍 動画を検索中... {st.session_state.debug_info['pages']}ページ目まで取得（{len(results)}件）"
+                    )
+                    preview.dataframe(results, use_container_width=True, hide_index=True, column_config=results_column_config())
+            progress.empty()
+            preview.empty()
+            st.session_state.last_search_time = datetime.now()
     
     # 検索結果表示
     if st.session_state.search_results is not None:
@@ -652,6 +702,7 @@ def main():
             if hasattr(st.session_state, 'debug_info') and japan_only:
                 debug_info = st.session_state.debug_info
                 with st.expander("🔍 フィルタリング詳細情報"):
+                    st.write(f"- **取得した検索ページ数**: {debug_info['pages']}ページ")
                     st.write(f"- **検索で見つかった動画数**: {debug_info['total_videos_found']}件")
                     st.write(f"- **ユニークチャンネル数**: {debug_info['total_channels']}チャンネル")
                     st.write(f"- **フィルタで除外されたチャンネル**: {debug_info['filtered_channels']}チャンネル")
@@ -664,53 +715,39 @@ def main():
                             st.write(f"  {i+1}. {ch['name']} (国: {ch['country']}, 言語: {ch['language']}, 日本語: {ch['has_japanese']})")
             
             # データフレーム表示
-            st.dataframe(
-                st.session_state.search_results,
-                use_container_width=True,
-                hide_index=True,
-                column_config={
-                    "視聴回数": st.column_config.NumberColumn(
-                        "視聴回数",
-                        format="%d 回"
-                    ),
-                    "登録者数": st.column_config.NumberColumn(
-                        "登録者数",
-                        format="%d 人"
-                    )
-                }
-            )
+            with timed_section('results_table'):
+                st.dataframe(
+                    st.session_state.search_results,
+                    use_container_width=True,
+                    hide_index=True,
+                    column_config=results_column_config()
+                )
         else:
             st.warning("検索条件に一致する動画が見つかりませんでした。")
         
         if st.session_state.last_search_time:
             st.caption(f"最終検索時刻: {st.session_state.last_search_time.strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # 動画再生セクション
-    st.subheader("🎬 動画再生")
-    
-    video_id_input = st.text_input(
-        "動画IDを入力",
-        placeholder="例: dQw4w9WgXcQ",
-        help="YouTubeの動画IDを入力してください"
-    )
-    
-    play_button = st.button("▶️ 再生", type="secondary")
+    # ウォッチリスト
+    with timed_section('watchlist'):
+        render_watchlist()
     
-    if play_button and video_id_input:
-        try:
-            st.video(f"https://www.youtube.com/watch?v={video_id_input}")
-        except Exception as e:
-            st.error(f"動画の再生に失敗しました: {e}")
+    # 動画再生セクション
+    with timed_section('player'):
+        render_player()
     
     # フッター
     st.markdown("---")
-    st.markdown("""
+    st.markdown(f"""
     <div style="text-align: center; color: #666666; font-size: 0.9rem;">
-        📺 YouTube Data API v3 を使用 | 日次クォータ上限: 9,000 ユニット<br>
+        📺 YouTube Data API v3 を使用 | 日次クォータ上限: {QUOTA_DAILY_LIMIT:,} ユニット<br>
         <br>
         <strong>©2025 岩崎俊介</strong>
     </div>
     """, unsafe_allow_html=True)
+    
+    if DEBUG_PANEL:
+        render_debug_panel()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,278 @@
+"""
+検索のベンチマーク
+
+合成した videos.list / channels.list のレスポンス（1万件以上を想定）とローカルのスタンドイン（mock_api.py）を使って
+以下を計測し、結果をJSONで保存する（コミット間の比較用）
+
+- postprocess: results.ResultBuilder で、50件ずつのページとして（アプリと同じくページごとに results を呼ぶ）/ 全件を1ページとして処理する時間
+- legacy: 以前の処理（チャンネルごとに全動画を走査し、1行ずつ dateutil で日時を変換）の時間。
+  --legacy-max-videos 件までの規模だけ計測し、出力が全件を1ページとした postprocess と一致することも確認する
+  （ページごとの処理ではチャンネルを最初に出てきたページの動画だけで判定するため、件数が一致しない）。
+  speedup はアプリの実際の使い方である50件ずつのページでの時間との比
+- search: app.py の検索（iter_search_videos）をスタンドインに対して実行し、取得件数ごとに
+  全体のレイテンシ・最初の結果までの時間・エンドポイント別のAPI呼び出し回数とユニット数・後処理の時間を計測する
+
+    python benchmark.py --videos 10000 50000 --output results/base.json
+    python benchmark.py --modes postprocess --videos 100000
+    python benchmark.py --modes search --search-sizes 50 200 500 1000 --latency-ms 50 --error-rate 0.02
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from dateutil.parser import parse
+
+from mock_api import MockYouTubeApi, synthetic_corpus
+from results import ResultBuilder
+
+MODES = ('postprocess', 'legacy', 'search')
+PAGE_SIZE = 50
+
+def pages(video_items, channel_items):
+    """
+    50件ずつのページに分け、各ページの動画のチャンネルのうち前のページで出てこなかったものを割り当てる
+    """
+    channels = {item['id']: item for item in channel_items}
+    seen = set()
+    for start in range(0, len(video_items), PAGE_SIZE):
+        page = video_items[start:start + PAGE_SIZE]
+        channel_ids = [
+            channel_id for channel_id in dict.fromkeys(item['snippet']['channelId'] for item in page)
+            if channel_id not in seen
+        ]
+        seen.update(channel_ids)
+        yield page, [channels[channel_id] for channel_id in channel_ids]
+
+
+def run_postprocess(video_items, channel_items, paged):
+    builder = ResultBuilder(japan_only=True)
+    if paged:
+        for page_videos, page_channels in pages(video_items, channel_items):
+            builder.add_page(page_videos, page_channels)
+            # 画面ではページごとにそれまでの結果を表示する
+            builder.results()
+    else:
+        builder.add_page(video_items, channel_items)
+    return builder.results()
+
+
+def legacy_duration(duration):
+    if not duration:
+        return "不明"
+    match = re.match(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?', duration)
+    if not match:
+        return "不明"
+    hours, minutes, seconds = (int(value) if value else 0 for value in match.groups())
+    if hours > 0:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def run_legacy(video_items, channel_items):
+    """
+    以前の行単位の処理（比較用。日本チャンネル限定の場合のみ）
+    """
+    japanese = r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]'
+    channel_info = {}
+    for channel in channel_items:
+        snippet = channel['snippet']
+        is_japanese_channel = (
+            snippet.get('country', '') == 'JP' or
+            snippet.get('defaultLanguage', '') == 'ja' or
+            bool(re.search(japanese, snippet['title']))
+        )
+        if not is_japanese_channel:
+            for video in [v for v in video_items if v['snippet']['channelId'] == channel['id']]:
+                if (re.search(japanese, video['snippet']['title']) or
+                        re.search(japanese, video['snippet'].get('description', ''))):
+                    is_japanese_channel = True
+                    break
+        if is_japanese_channel:
+            channel_info[channel['id']] = {
+                'name': snippet['title'],
+                'subscriber_count': int(channel['statistics'].get('subscriberCount', 0))
+            }
+
+    videos_data = []
+    for video in video_items:
+        channel_id = video['snippet']['channelId']
+        if channel_id in channel_info:
+            videos_data.append({
+                '動画ID': video['id'],
+                'タイトル': video['snippet']['title'],
+                '視聴回数': int(video['statistics'].get('viewCount', 0)),
+                '投稿日時': parse(video['snippet']['publishedAt']).strftime('%Y-%m-%d %H:%M'),
+                '動画時間': legacy_duration(video.get('contentDetails', {}).get('duration', '')),
+                'チャンネル名': channel_info[channel_id]['name'],
+                '登録者数': channel_info[channel_id]['subscriber_count']
+            })
+    return pd.DataFrame(videos_data)
+
+
+def timed(fn, runs):
+    """
+    fn を runs 回実行し、(最後の結果, 所要時間の中央値・最小値（ミリ秒）) を返す
+    """
+    durations = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = fn()
+        durations.append((time.perf_counter() - started) * 1000.0)
+    return result, {'median_ms': statistics.median(durations), 'min_ms': min(durations)}
+
+
+def load_app(endpoint, workdir, cache):
+    """
+    app.py をスタンドインに接続する設定で読み込む（台帳・キャッシュ・ウォッチリストは workdir に置き、クォータの制限は外す）
+    """
+    os.environ.update({
+        'YOUTUBE_API_KEY': 'mock',
+        'YOUTUBE_API_ENDPOINT': endpoint,
+        'QUOTA_DB_PATH': os.path.join(workdir, 'quota.sqlite3'),
+        'QUOTA_DAILY_LIMIT': str(10 ** 9),
+        'QUOTA_RATE_UNITS_PER_SECOND': str(10 ** 9),
+        'QUOTA_BURST_UNITS': str(10 ** 9),
+        'API_CACHE_ENABLED': '1' if cache else '0',
+        'API_CACHE_PATH': os.path.join(workdir, 'api_cache.sqlite3'),
+        'WATCHLIST_PATH': os.path.join(workdir, 'watchlist.sqlite3')
+    })
+    import app
+    return app
+
+
+def bench_search(app, server, sizes, days, runs):
+    """
+    取得件数（max_results）ごとに検索を runs 回実行し、レイテンシ・API呼び出し・後処理の時間を計測する
+    """
+    postprocess_seconds = []
+
+    class TimedResultBuilder(app.ResultBuilder):
+        # 後処理（ResultBuilder）にかかった時間を記録する
+        def add_page(self, video_items, channel_items):
+            started = time.perf_counter()
+            try:
+                return super().add_page(video_items, channel_items)
+            finally:
+                postprocess_seconds.append(time.perf_counter() - started)
+
+        def results(self):
+            started = time.perf_counter()
+            try:
+                return super().results()
+            finally:
+                postprocess_seconds.append(time.perf_counter() - started)
+
+    app.ResultBuilder = TimedResultBuilder
+    ledger = app.get_quota_ledger()
+    reports = []
+    for size in sizes:
+        latencies = []
+        first_results = []
+        postprocess = []
+        rows = None
+        calls_before = ledger.calls()
+        server.reset_stats()
+        for _ in range(runs):
+            published_after = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=days)
+            postprocess_seconds.clear()
+            started = time.perf_counter()
+            first = None
+            results = None
+            for results in app.iter_search_videos('benchmark', published_after, True, size, record_debug=False):
+                if first is None:
+                    first = time.perf_counter() - started
+            latencies.append((time.perf_counter() - started) * 1000.0)
+            first_results.append((first or 0.0) * 1000.0)
+            postprocess.append(sum(postprocess_seconds) * 1000.0)
+            rows = len(results) if results is not None else None
+
+        calls_after = ledger.calls()
+        api = {}
+        for endpoint, (calls, units) in calls_after.items():
+            previous_calls, previous_units = calls_before.get(endpoint, (0, 0))
+            api[endpoint] = {
+                'calls_per_search': (calls - previous_calls) / runs,
+                'units_per_search': (units - previous_units) / runs
+            }
+        reports.append({
+            'max_results': size,
+            'rows': rows,
+            'latency_ms': statistics.median(latencies),
+            'first_results_ms': statistics.median(first_results),
+            'postprocess_ms': statistics.median(postprocess),
+            'units_per_search': sum(entry['units_per_search'] for entry in api.values()),
+            'api': api,
+            'server': server.stats()
+        })
+        print(f"search {size} done", file=sys.stderr)
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark search result post-processing on synthetic API responses')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['postprocess', 'legacy'])
+    parser.add_argument('--videos', nargs='+', type=int, default=[1000, 10000, 50000])
+    parser.add_argument('--videos-per-channel', type=int, default=4)
+    parser.add_argument('--legacy-max-videos', type=int, default=10000, help='skip the legacy mode above this size')
+    parser.add_argument('--search-sizes', nargs='+', type=int, default=[50, 200, 500, 1000], help='max_results per search')
+    parser.add_argument('--mock-videos', type=int, default=5000, help='synthetic videos served by the stand-in')
+    parser.add_argument('--days', type=int, default=30, help='search window; the stand-in spreads videos over it')
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='stand-in response latency')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of stand-in requests that fail with 503')
+    parser.add_argument('--cache', action='store_true', help='keep the API response cache enabled during searches')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the report as JSON to this path')
+    args = parser.parse_args()
+
+    report = {'args': vars(args), 'scenarios': []}
+    for video_count in args.videos if {'postprocess', 'legacy'} & set(args.modes) else []:
+        video_items, channel_items = synthetic_corpus(video_count, args.videos_per_channel, args.seed)
+        scenario = {'videos': video_count, 'channels': len(channel_items)}
+
+        if 'postprocess' in args.modes:
+            results, scenario['postprocess'] = timed(lambda: run_postprocess(video_items, channel_items, False), args.runs)
+            _, scenario['postprocess_paged'] = timed(lambda: run_postprocess(video_items, channel_items, True), args.runs)
+            scenario['rows'] = len(results)
+
+        if 'legacy' in args.modes and video_count <= args.legacy_max_videos:
+            legacy, scenario['legacy'] = timed(lambda: run_legacy(video_items, channel_items), args.runs)
+            if 'postprocess' in args.modes:
+                scenario['matches_legacy'] = bool(results.equals(legacy))
+                scenario['speedup'] = scenario['legacy']['median_ms'] / scenario['postprocess_paged']['median_ms']
+
+        report['scenarios'].append(scenario)
+        print(f"{video_count} videos done", file=sys.stderr)
+
+    if 'search' in args.modes:
+        video_items, channel_items = synthetic_corpus(
+            args.mock_videos, args.videos_per_channel, args.seed, datetime.now(timezone.utc), args.days
+        )
+        server = MockYouTubeApi(
+            video_items, channel_items,
+            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed
+        ).start()
+        try:
+            app = load_app(server.base_url, tempfile.mkdtemp(prefix='bench-search-'), args.cache)
+            report['searches'] = bench_search(app, server, args.search_sizes, args.days, args.runs)
+        finally:
+            server.stop()
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
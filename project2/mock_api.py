@@ -0,0 +1,288 @@
+"""
+YouTube Data API v3 のローカルのスタンドイン（負荷試験・回帰試験用）
+
+search.list / videos.list / channels.list を合成データで返す。クォータ・ネットワークを使わずに検索全体を試せる
+
+- 検索結果は投稿日時が新しい順。publishedAfter / publishedBefore / maxResults（最大50）/ pageToken に対応する（q は無視）
+- videos / channels は id に指定した順に返す（51件以上は 400）
+- --latency-ms / --jitter-ms で応答を遅らせ、--error-rate の割合で --errors のエラーを返す
+- fields（部分レスポンス）は無視してすべての項目を返す。Accept-Encoding に gzip があれば圧縮して返す
+- GET /stats でエンドポイント別の呼び出し回数・エラー数を返す
+
+    python mock_api.py --port 8080 --videos 5000 --latency-ms 50
+    YOUTUBE_API_ENDPOINT=http://127.0.0.1:8080/ YOUTUBE_API_KEY=mock streamlit run app.py
+"""
+import gzip
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+API_PREFIX = '/youtube/v3/'
+MAX_RESULTS = 50
+
+# 注入するエラー（HTTPステータス, エラー理由）
+ERRORS = {
+    'backend': (503, 'backendError'),
+    'internal': (500, 'internalError'),
+    'rate': (403, 'rateLimitExceeded'),
+    'throttle': (429, 'rateLimitExceeded'),
+    'quota': (403, 'quotaExceeded')
+}
+
+JAPANESE_WORDS = ('ゲーム実況', '料理', '東京', 'ニュース', 'カラオケ', '旅行記')
+ENGLISH_WORDS = ('gameplay', 'cooking', 'travel', 'news', 'music', 'review')
+
+
+def synthetic_corpus(video_count, videos_per_channel=4, seed=0, newest=None, days=30):
+    """
+    (video_items, channel_items) を生成する。投稿日時は newest（省略時は 2024-01-31 UTC）までの days 日間に分布する
+
+    チャンネルは国コード JP・既定の言語 ja・日本語のチャンネル名・動画だけに日本語・日本語なしに分かれる
+    """
+    rng = random.Random(seed)
+    newest = newest or datetime(2024, 1, 31, tzinfo=timezone.utc)
+    channel_count = max(1, video_count // videos_per_channel)
+    channel_items = []
+    kinds = {}
+    for index in range(channel_count):
+        kind = rng.choice(('country', 'language', 'name', 'videos', 'none', 'none'))
+        kinds[f'UC{index:022d}'] = kind
+        snippet = {
+            'title': f"{rng.choice(JAPANESE_WORDS) if kind == 'name' else rng.choice(ENGLISH_WORDS)} channel {index}"
+        }
+        if kind == 'country':
+            snippet['country'] = 'JP'
+        elif kind == 'language':
+            snippet['defaultLanguage'] = 'ja'
+        elif rng.random() < 0.5:
+            snippet['country'] = 'US'
+        channel_items.append({
+            'kind': 'youtube#channel',
+            'id': f'UC{index:022d}',
+            'snippet': snippet,
+            'statistics': {'subscriberCount': str(rng.randrange(0, 5_000_000))}
+        })
+
+    channel_ids = list(kinds)
+    video_items = []
+    for index in range(video_count):
+        channel_id = rng.choice(channel_ids)
+        # 「動画だけに日本語」のチャンネルは一部の動画の説明文にだけ日本語を含める
+        japanese_description = kinds[channel_id] == 'videos' and rng.random() < 0.3
+        duration = rng.choice((
+            f'PT{rng.randrange(1, 60)}M{rng.randrange(0, 60)}S',
+            f'PT{rng.randrange(1, 4)}H{rng.randrange(0, 60)}M{rng.randrange(0, 60)}S',
+            f'PT{rng.randrange(1, 60)}S',
+            'P0D',
+            ''
+        ))
+        published_at = newest - timedelta(seconds=rng.randrange(0, days * 86400))
+        video_items.append({
+            'kind': 'youtube#video',
+            'id': f'v{index:010d}',
+            'snippet': {
+                'channelId': channel_id,
+                'title': f'{rng.choice(ENGLISH_WORDS)} video {index}',
+                'description': (
+                    f'{rng.choice(JAPANESE_WORDS)}の動画です' if japanese_description
+                    else ' '.join(rng.choice(ENGLISH_WORDS) for _ in range(20))
+                ),
+                'publishedAt': published_at.strftime('%Y-%m-%dT%H:%M:%SZ')
+            },
+            'statistics': {'viewCount': str(rng.randrange(0, 10_000_000))},
+            'contentDetails': {'duration': duration}
+        })
+    return video_items, channel_items
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class MockYouTubeApi(ThreadingHTTPServer):
+    """
+    合成データを返す YouTube Data API のスタンドイン
+
+    serve_forever で起動する（start / stop でバックグラウンドのスレッドで動かせる）。base_url を YOUTUBE_API_ENDPOINT に指定する
+    """
+
+    daemon_threads = True
+
+    def __init__(self, video_items, channel_items, host='127.0.0.1', port=0,
+                 latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, errors=('backend',), seed=0):
+        super().__init__((host, port), MockRequestHandler)
+        # 検索は投稿日時が新しい順
+        self.search_order = sorted(video_items, key=lambda item: item['snippet']['publishedAt'], reverse=True)
+        self.videos = {item['id']: item for item in video_items}
+        self.channels = {item['id']: item for item in channel_items}
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.errors = [ERRORS[name] for name in errors]
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-youtube-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {}
+
+    def stats(self):
+        """
+        エンドポイント別の {'calls': 呼び出し回数, 'errors': 注入したエラー数}
+        """
+        with self._lock:
+            return {endpoint: dict(counts) for endpoint, counts in self._stats.items()}
+
+    def record(self, endpoint, error):
+        with self._lock:
+            counts = self._stats.setdefault(endpoint, {'calls': 0, 'errors': 0})
+            counts['calls'] += 1
+            counts['errors'] += int(error)
+
+    def delay(self):
+        with self._lock:
+            seconds = (self.latency_ms + self._rng.uniform(0.0, self.jitter_ms)) / 1000.0
+            error = self._rng.choice(self.errors) if self.errors and self._rng.random() < self.error_rate else None
+        return seconds, error
+
+    def search(self, params):
+        items = self.search_order
+        # 実際の API と同じく、publishedAfter・publishedBefore はその時刻ちょうどの動画も含む
+        if 'publishedAfter' in params:
+            after = parse_time(params['publishedAfter'])
+            items = [item for item in items if parse_time(item['snippet']['publishedAt']) >= after]
+        if 'publishedBefore' in params:
+            before = parse_time(params['publishedBefore'])
+            items = [item for item in items if parse_time(item['snippet']['publishedAt']) <= before]
+        per_page = max(0, min(int(params.get('maxResults', 5)), MAX_RESULTS))
+        # snippet は同期のウォーターマークに使う投稿日時だけを返す
+        with_snippet = 'snippet' in params.get('part', '').split(',')
+        start = int(params.get('pageToken') or 0)
+        page = items[start:start + per_page]
+        response = {
+            'kind': 'youtube#searchListResponse',
+            'pageInfo': {'totalResults': len(items), 'resultsPerPage': per_page},
+            'items': [
+                dict(
+                    {'kind': 'youtube#searchResult', 'id': {'kind': 'youtube#video', 'videoId': item['id']}},
+                    **({'snippet': {'publishedAt': item['snippet']['publishedAt']}} if with_snippet else {})
+                )
+                for item in page
+            ]
+        }
+        if start + per_page < len(items):
+            response['nextPageToken'] = str(start + per_page)
+        return response
+
+    def list_by_ids(self, endpoint, params):
+        store = self.videos if endpoint == 'videos' else self.channels
+        ids = [item_id for item_id in params.get('id', '').split(',') if item_id]
+        if len(ids) > MAX_RESULTS:
+            return None
+        return {
+            'kind': f'youtube#{endpoint[:-1]}ListResponse',
+            'items': [store[item_id] for item_id in ids if item_id in store]
+        }
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == '/stats':
+            self.send_json(200, self.server.stats())
+            return
+        endpoint = url.path[len(API_PREFIX):] if url.path.startswith(API_PREFIX) else None
+        if endpoint not in ('search', 'videos', 'channels'):
+            self.send_error_json(404, 'notFound', f'Unknown path {url.path}')
+            return
+
+        seconds, error = self.server.delay()
+        self.server.record(endpoint, error is not None)
+        if seconds > 0:
+            time.sleep(seconds)
+        if error is not None:
+            self.send_error_json(error[0], error[1], f'Injected {error[1]}')
+            return
+
+        response = self.server.search(params) if endpoint == 'search' else self.server.list_by_ids(endpoint, params)
+        if response is None:
+            self.send_error_json(400, 'badRequest', f'At most {MAX_RESULTS} ids per request')
+            return
+        self.send_json(200, response)
+
+    def send_error_json(self, status, reason, message):
+        self.send_json(status, {'error': {'code': status, 'message': message, 'errors': [{'reason': reason, 'message': message}]}})
+
+    def send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        compress = 'gzip' in self.headers.get('Accept-Encoding', '')
+        if compress:
+            data = gzip.compress(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        if compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a local stand-in for the YouTube Data API v3')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--videos', type=int, default=5000, help='number of synthetic videos')
+    parser.add_argument('--videos-per-channel', type=int, default=4)
+    parser.add_argument('--days', type=int, default=30, help='spread publish times over the last N days')
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of API requests that fail')
+    parser.add_argument('--errors', nargs='+', choices=sorted(ERRORS), default=['backend'])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    video_items, channel_items = synthetic_corpus(
+        args.videos, args.videos_per_channel, args.seed, datetime.now(timezone.utc), args.days
+    )
+    server = MockYouTubeApi(
+        video_items, channel_items, args.host, args.port,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate, errors=args.errors, seed=args.seed
+    )
+    print(f"Serving {len(video_items)} videos / {len(channel_items)} channels at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
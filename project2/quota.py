@@ -0,0 +1,136 @@
+import time
+import sqlite3
+import threading
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# YouTube Data API の1回の呼び出しあたりのコスト（ユニット）。list は指定するID数・part に関係なく一定
+API_COSTS = {
+    'search': 100,
+    'videos': 1,
+    'channels': 1
+}
+
+# クォータは太平洋時間の0時にリセットされる
+QUOTA_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+
+class QuotaExceededError(Exception):
+    """
+    呼び出すと日次のクォータ上限を超える
+    """
+
+
+class RateLimitedError(Exception):
+    """
+    トークンバケットが待ち時間の上限内に回復しない
+    """
+
+
+def quota_day():
+    return datetime.now(QUOTA_TIMEZONE).strftime('%Y-%m-%d')
+
+
+class QuotaLedger:
+    """
+    日次のクォータ使用量を記録する SQLite の台帳
+
+    ファイルを共有するすべてのセッション・プロセスで使える。API を呼び出す前に acquire でコストを予約し、
+    日次の上限を超える呼び出しは拒否する。全体の消費ペースはトークンバケット（rate ユニット/秒、最大 burst ユニット）で
+    制限し、トークンが足りない呼び出しは最大 max_wait 秒待たせ、それでも足りなければ拒否する
+    """
+
+    def __init__(self, path, daily_limit, rate=20.0, burst=1000.0, max_wait=30.0):
+        self.path = path
+        self.daily_limit = daily_limit
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._local = threading.local()
+        connection = self._connect()
+        connection.execute('PRAGMA journal_mode=WAL')
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS usage (day TEXT PRIMARY KEY, units INTEGER NOT NULL)')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS calls (day TEXT NOT NULL, endpoint TEXT NOT NULL, '
+                'calls INTEGER NOT NULL, units INTEGER NOT NULL, PRIMARY KEY (day, endpoint))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS bucket (id INTEGER PRIMARY KEY CHECK (id = 1), '
+                'tokens REAL NOT NULL, updated_at REAL NOT NULL)'
+            )
+            connection.execute('INSERT OR IGNORE INTO bucket (id, tokens, updated_at) VALUES (1, ?, ?)', (burst, time.time()))
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # 自前で BEGIN IMMEDIATE するため自動のトランザクションは使わない
+            connection = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+    def acquire(self, endpoint):
+        """
+        endpoint の呼び出し1回分のコストを消費する。上限を超える場合は QuotaExceededError、
+        max_wait 秒以内にトークンが回復しない場合は RateLimitedError
+        """
+        cost = API_COSTS[endpoint]
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            wait = self._try_acquire(endpoint, cost)
+            if wait is None:
+                return cost
+            if time.monotonic() + wait > deadline:
+                raise RateLimitedError(f'API rate limit: {cost} units not available within {self.max_wait:.0f}s')
+            time.sleep(wait)
+
+    def _try_acquire(self, endpoint, cost):
+        # 使用量とトークンの確認・更新を1つの書き込みトランザクションで行い、他のプロセスと競合しないようにする
+        # 消費できた場合は None、トークン不足の場合は回復までの秒数を返す
+        day = quota_day()
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            row = connection.execute('SELECT units FROM usage WHERE day = ?', (day,)).fetchone()
+            used = row[0] if row else 0
+            if used + cost > self.daily_limit:
+                raise QuotaExceededError(f'Daily quota exceeded ({used} + {cost} > {self.daily_limit} units)')
+
+            tokens, updated_at = connection.execute('SELECT tokens, updated_at FROM bucket WHERE id = 1').fetchone()
+            now = time.time()
+            tokens = min(self.burst, tokens + max(0.0, now - updated_at) * self.rate)
+            # burst より大きいコストはバケットが満杯なら通す（残高はマイナスになり、後続の呼び出しが待つ）
+            required = min(cost, self.burst)
+            if tokens < required:
+                connection.execute('UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 1', (tokens, now))
+                connection.execute('COMMIT')
+                return (required - tokens) / self.rate
+
+            connection.execute('UPDATE bucket SET tokens = ?, updated_at = ? WHERE id = 1', (tokens - cost, now))
+            connection.execute(
+                'INSERT INTO usage (day, units) VALUES (?, ?) ON CONFLICT (day) DO UPDATE SET units = units + excluded.units',
+                (day, cost)
+            )
+            connection.execute(
+                'INSERT INTO calls (day, endpoint, calls, units) VALUES (?, ?, 1, ?) '
+                'ON CONFLICT (day, endpoint) DO UPDATE SET calls = calls + 1, units = units + excluded.units',
+                (day, endpoint, cost)
+            )
+            connection.execute('COMMIT')
+            return None
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def used(self, day=None):
+        row = self._connect().execute('SELECT units FROM usage WHERE day = ?', (day or quota_day(),)).fetchone()
+        return row[0] if row else 0
+
+    def calls(self, day=None):
+        """
+        エンドポイント別の {endpoint: (呼び出し回数, ユニット)} を返す
+        """
+        rows = self._connect().execute(
+            'SELECT endpoint, calls, units FROM calls WHERE day = ? ORDER BY endpoint', (day or quota_day(),)
+        ).fetchall()
+        return {endpoint: (calls, units) for endpoint, calls, units in rows}
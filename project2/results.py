@@ -0,0 +1,142 @@
+import re
+from datetime import datetime, timezone
+import pandas as pd
+
+# ひらがな・カタカナ・漢字のいずれかを含むかの判定
+JAPANESE_PATTERN = re.compile(r'[\u3040-\u309F\u30A0-\u30FF\u4E00-\u9FAF]')
+
+# ISO 8601 duration（PT4M13S）
+DURATION_PATTERN = re.compile(r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?')
+
+# UTC の ISO 8601 の日時（2024-01-31T12:34:56Z、小数秒付きも可）。文字列の切り出しだけで表示用にできる
+UTC_TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z')
+
+# 表示用の検索結果の列
+RESULT_COLUMNS = ['動画ID', 'タイトル', '視聴回数', '投稿日時', '動画時間', 'チャンネル名', '登録者数']
+
+
+def to_count(value):
+    # API の統計値は文字列で返る（取得できない値は 0）
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def format_duration(duration):
+    """
+    ISO 8601 duration（PT4M13S）を時間文字列（4:13、1時間以上は 1:04:13）にする。形式が違う場合は「不明」
+    """
+    match = DURATION_PATTERN.match(duration or '')
+    if not match:
+        return "不明"
+    hours, minutes, seconds = (int(value) if value else 0 for value in match.groups())
+    if hours > 0:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def format_timestamp(timestamp):
+    """
+    ISO 8601 の日時を UTC の 'YYYY-MM-DD HH:MM' にする
+    """
+    if UTC_TIMESTAMP_PATTERN.fullmatch(timestamp):
+        return f'{timestamp[:10]} {timestamp[11:16]}'
+    published = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    if published.tzinfo is not None:
+        published = published.astimezone(timezone.utc)
+    return published.strftime('%Y-%m-%d %H:%M')
+
+
+def classify_channels(channel_items, video_items, japan_only=True):
+    """
+    チャンネルごとに日本チャンネルかどうかを判定し、{チャンネルID: チャンネル} を返す
+
+    チャンネルは channel_id, name, country, language, subscriber_count, has_japanese（チャンネル名に日本語を含むか）,
+    is_japanese の辞書。国コードが JP、既定の言語が ja、チャンネル名に日本語を含む、のいずれにも当てはまらない
+    チャンネルは、video_items に含まれるそのチャンネルの動画のタイトル・説明文に日本語を含むものがあれば日本チャンネルとする。
+    japan_only が False の場合はすべて日本チャンネルとする（has_japanese は None）
+    """
+    channels = {}
+    for item in channel_items:
+        snippet = item['snippet']
+        channel = {
+            'channel_id': item['id'],
+            'name': snippet['title'],
+            'country': snippet.get('country', ''),
+            'language': snippet.get('defaultLanguage', ''),
+            'subscriber_count': to_count(item['statistics'].get('subscriberCount', 0)),
+            'has_japanese': None,
+            'is_japanese': True
+        }
+        if japan_only:
+            channel['has_japanese'] = bool(JAPANESE_PATTERN.search(channel['name']))
+            channel['is_japanese'] = channel['country'] == 'JP' or channel['language'] == 'ja' or channel['has_japanese']
+        channels.setdefault(item['id'], channel)
+
+    # 残ったチャンネルの動画だけを調べ、日本語を含む動画が見つかった時点でそのチャンネルは調べ終える
+    candidates = {channel_id for channel_id, channel in channels.items() if not channel['is_japanese']}
+    for video in video_items if candidates else ():
+        snippet = video['snippet']
+        channel_id = snippet['channelId']
+        if channel_id in candidates and (
+                JAPANESE_PATTERN.search(snippet['title']) or JAPANESE_PATTERN.search(snippet.get('description', ''))):
+            channels[channel_id]['is_japanese'] = True
+            candidates.discard(channel_id)
+            if not candidates:
+                break
+    return channels
+
+
+class ResultBuilder:
+    """
+    ページごとに取得した動画・チャンネルから検索結果を組み立てる
+
+    ページの処理（判定・整形）は行単位の辞書で行い、DataFrame は results で未連結の行だけから作る
+    （ページごとに DataFrame を組み立てる固定費を避けるため）。判定済みのチャンネルを保持し、後のページでは
+    同じチャンネルを判定し直さずに使う（並行して取得したページに同じチャンネルが含まれていた場合は先に追加したページの判定を使う）
+    """
+
+    def __init__(self, japan_only=True):
+        self.japan_only = japan_only
+        self.channels = {}
+        self.known_channel_ids = set()
+        self._results = pd.DataFrame(columns=RESULT_COLUMNS)
+        self._pending = []
+
+    def add_page(self, video_items, channel_items):
+        """
+        1ページ分の動画とチャンネルを追加し、このページで新たに判定したチャンネルのリストを返す
+        """
+        channels = classify_channels(
+            [item for item in channel_items if item['id'] not in self.known_channel_ids], video_items, self.japan_only
+        )
+        self.channels.update(channels)
+        self.known_channel_ids.update(channels)
+
+        for video in video_items:
+            snippet = video['snippet']
+            channel = self.channels.get(snippet['channelId'])
+            if channel is None or not channel['is_japanese']:
+                continue
+            self._pending.append((
+                video['id'],
+                snippet['title'],
+                to_count(video['statistics'].get('viewCount', 0)),
+                format_timestamp(snippet['publishedAt']),
+                format_duration(video.get('contentDetails', {}).get('duration', '')),
+                channel['name'],
+                channel['subscriber_count']
+            ))
+        return list(channels.values())
+
+    def results(self):
+        """
+        それまでに追加したページの結果をページ順に連結して返す
+        """
+        if self._pending:
+            # 前回までの結果に未連結の行だけを追加する（呼び出しごとに全行から作り直さない）
+            rows = pd.DataFrame(self._pending, columns=RESULT_COLUMNS)
+            self._results = pd.concat([self._results, rows], ignore_index=True) if len(self._results) else rows
+            self._pending = []
+        return self._results
@@ -0,0 +1,136 @@
+import json
+import time
+import random
+import threading
+import httplib2
+import requests
+from requests.adapters import HTTPAdapter
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+# 再試行する HTTP ステータスと、403 / 429 の場合に再試行するエラー理由（quotaExceeded などは再試行しない）
+RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+RETRYABLE_REASONS = frozenset({'rateLimitExceeded', 'userRateLimitExceeded', 'backendError', 'internalError'})
+
+# execute_with_retry の期限（スレッドごと）。PooledHttp が1回の通信のタイムアウトを残り時間に合わせる
+_deadline = threading.local()
+
+
+class PooledHttp:
+    """
+    googleapiclient に httplib2.Http の代わりに渡す HTTP クライアント
+
+    requests.Session の接続プール（keep-alive）をすべてのスレッドで共有する。
+    gzip で圧縮された応答は requests が展開する。1回の通信のタイムアウトは timeout 秒
+    （execute_with_retry の期限までの残り時間の方が短い場合はそちら）
+    """
+
+    def __init__(self, pool_size=10, timeout=10.0):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        timeout = self.timeout
+        deadline = getattr(_deadline, 'value', None)
+        if deadline is not None:
+            timeout = max(0.001, min(timeout, deadline - time.monotonic()))
+        try:
+            response = self.session.request(
+                method, uri, data=body, headers=headers, timeout=timeout, allow_redirects=redirections > 0
+            )
+        except requests.Timeout as e:
+            raise TimeoutError(str(e)) from e
+        except requests.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+
+        info = {name.lower(): value for name, value in response.headers.items()}
+        # 本文は展開済みのため、圧縮時の形式・長さは渡さない
+        info.pop('content-encoding', None)
+        info.pop('content-length', None)
+        info['status'] = str(response.status_code)
+        result = httplib2.Response(info)
+        result.reason = response.reason
+        return result, response.content
+
+    def close(self):
+        self.session.close()
+
+
+class RetryPolicy:
+    """
+    一時的なエラー（5xx・レート制限・タイムアウト・接続エラー）の再試行の設定
+
+    n 回目の再試行の前に 0〜min(max_delay, base_delay * 2^(n-1)) 秒のランダムな時間待つ。
+    最初の試行から deadline 秒を超える場合は再試行しない
+    """
+
+    def __init__(self, max_retries=4, base_delay=0.5, max_delay=8.0, deadline=30.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, retry):
+        return random.uniform(0.0, min(self.max_delay, self.base_delay * 2 ** retry))
+
+
+def error_reason(error):
+    """
+    HttpError の本文のエラー理由（rateLimitExceeded, quotaExceeded など）。取り出せない場合は None
+    """
+    try:
+        return json.loads(error.content.decode('utf-8'))['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+        return None
+
+
+def is_retryable(error):
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status in RETRYABLE_STATUSES or status == 429:
+            return True
+        return status == 403 and error_reason(error) in RETRYABLE_REASONS
+    return isinstance(error, (TimeoutError, ConnectionError))
+
+
+def execute_with_retry(request, policy, before_attempt=None):
+    """
+    request.execute() を実行し、一時的なエラーの場合は policy に従って再試行する
+
+    before_attempt は試行のたびに呼び出す（失敗した呼び出しもクォータを消費するため、試行ごとにコストを予約する）
+    """
+    deadline = time.monotonic() + policy.deadline
+    retry = 0
+    while True:
+        if before_attempt is not None:
+            before_attempt()
+        _deadline.value = deadline
+        try:
+            return request.execute()
+        except Exception as e:
+            if not is_retryable(e) or retry >= policy.max_retries:
+                raise
+            delay = policy.backoff(retry)
+            if time.monotonic() + delay >= deadline:
+                raise
+        finally:
+            _deadline.value = None
+        retry += 1
+        time.sleep(delay)
+
+
+def build_youtube_client(api_key, http, api_endpoint=None):
+    """
+    http を使う YouTube Data API v3 のクライアントを作成する。api_endpoint を指定するとそのURLに接続する（スタブサーバーなど）
+    """
+    return build(
+        'youtube',
+        'v3',
+        developerKey=api_key,
+        http=http,
+        client_options={'api_endpoint': api_endpoint} if api_endpoint else None,
+        cache_discovery=False
+    )
@@ -0,0 +1,158 @@
+import time
+import sqlite3
+import threading
+
+# 保存する動画の列（投稿日時はUTCの 'YYYY-MM-DD HH:MM'）
+VIDEO_COLUMNS = ('video_id', 'title', 'view_count', 'published_at', 'duration', 'channel_name', 'subscriber_count')
+
+
+class WatchList:
+    """
+    保存した検索条件と、同期で見つかった動画の履歴を保持する SQLite のストア
+
+    検索条件ごとに見つかった動画の最新の投稿日時（ウォーターマーク）を記録し、
+    次回の同期ではそれ以降に投稿された動画だけを検索する。同期が途中で打ち切られた場合は、取得できた最も古い投稿日時を
+    続きの位置（resume_before）、見つかった最新の投稿日時を次のウォーターマークの候補（pending_watermark）として記録し、
+    続きを最後まで取得できた時点でウォーターマークを進める
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS searches ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT NOT NULL, japan_only INTEGER NOT NULL, '
+                'watermark TEXT NOT NULL, created_at REAL NOT NULL, last_synced_at REAL, '
+                'resume_before TEXT, pending_watermark TEXT, UNIQUE (query, japan_only))'
+            )
+            # 続きの位置の列がない以前のファイルには列を追加する
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(searches)')}
+            for column in ('resume_before', 'pending_watermark'):
+                if column not in columns:
+                    connection.execute(f'ALTER TABLE searches ADD COLUMN {column} TEXT')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS videos ('
+                'search_id INTEGER NOT NULL, video_id TEXT NOT NULL, title TEXT, view_count INTEGER, '
+                'published_at TEXT, duration TEXT, channel_name TEXT, subscriber_count INTEGER, '
+                'stats_updated_at REAL NOT NULL, PRIMARY KEY (search_id, video_id))'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS videos_stats ON videos (search_id, stats_updated_at)')
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30.0)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def save_search(self, query, japan_only, published_after):
+        """
+        検索条件を保存し、その ID を返す。published_after（ISO 8601）は初回の同期で検索する期間の開始日時
+
+        同じ条件が保存済みの場合はそのまま既存の ID を返す
+        """
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR IGNORE INTO searches (query, japan_only, watermark, created_at) VALUES (?, ?, ?, ?)',
+                (query, int(japan_only), published_after, time.time())
+            )
+            row = connection.execute(
+                'SELECT id FROM searches WHERE query = ? AND japan_only = ?', (query, int(japan_only))
+            ).fetchone()
+        return row['id']
+
+    def searches(self):
+        rows = self._connect().execute(
+            'SELECT s.id, s.query, s.japan_only, s.watermark, s.resume_before, s.last_synced_at, '
+            'COUNT(v.video_id) AS video_count '
+            'FROM searches s LEFT JOIN videos v ON v.search_id = s.id GROUP BY s.id ORDER BY s.id'
+        ).fetchall()
+        return [dict(row, japan_only=bool(row['japan_only'])) for row in rows]
+
+    def get_search(self, search_id):
+        row = self._connect().execute('SELECT * FROM searches WHERE id = ?', (search_id,)).fetchone()
+        return dict(row, japan_only=bool(row['japan_only'])) if row is not None else None
+
+    def delete_search(self, search_id):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM videos WHERE search_id = ?', (search_id,))
+            connection.execute('DELETE FROM searches WHERE id = ?', (search_id,))
+
+    def add_videos(self, search_id, videos, newest=None, oldest=None, complete=True):
+        """
+        同期で見つかった動画（VIDEO_COLUMNS の辞書）を追加し、新しく追加した件数を返す
+
+        既にある動画は視聴回数・登録者数だけを更新する。newest / oldest は同期で検索した範囲（絞り込み前）の
+        最新・最古の投稿日時（ISO 8601）。complete が True（検索範囲を最後まで取得した）の場合はウォーターマークを
+        それまでに見た最新の投稿日時まで進め、False の場合はウォーターマークを進めずに oldest を続きの位置として記録する
+        """
+        now = time.time()
+        with self._connect() as connection:
+            before = connection.execute('SELECT COUNT(*) FROM videos WHERE search_id = ?', (search_id,)).fetchone()[0]
+            connection.executemany(
+                'INSERT INTO videos (search_id, video_id, title, view_count, published_at, duration, channel_name, '
+                'subscriber_count, stats_updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (search_id, video_id) DO UPDATE SET view_count = excluded.view_count, '
+                'subscriber_count = excluded.subscriber_count, stats_updated_at = excluded.stats_updated_at',
+                [(search_id, *(video[column] for column in VIDEO_COLUMNS), now) for video in videos]
+            )
+            after = connection.execute('SELECT COUNT(*) FROM videos WHERE search_id = ?', (search_id,)).fetchone()[0]
+            row = connection.execute(
+                'SELECT watermark, resume_before, pending_watermark FROM searches WHERE id = ?', (search_id,)
+            ).fetchone()
+            # ISO 8601（UTC）の文字列は辞書順が時刻順と一致する
+            pending_watermark = max(filter(None, [row['pending_watermark'], newest]), default=None)
+            if complete:
+                watermark = max(filter(None, [row['watermark'], pending_watermark]))
+                resume_before, pending_watermark = None, None
+            else:
+                watermark = row['watermark']
+                resume_before = oldest or row['resume_before']
+            connection.execute(
+                'UPDATE searches SET last_synced_at = ?, watermark = ?, resume_before = ?, pending_watermark = ? WHERE id = ?',
+                (now, watermark, resume_before, pending_watermark, search_id)
+            )
+        return after - before
+
+    def stale_video_ids(self, search_id, max_age, limit=None):
+        """
+        統計の更新から max_age 秒以上経過した動画の ID を、投稿日時が新しい順に返す
+        """
+        rows = self._connect().execute(
+            'SELECT video_id FROM videos WHERE search_id = ? AND stats_updated_at < ? '
+            'ORDER BY published_at DESC LIMIT ?',
+            (search_id, time.time() - max_age, limit if limit is not None else -1)
+        ).fetchall()
+        return [row['video_id'] for row in rows]
+
+    def update_view_counts(self, view_counts, checked_ids=()):
+        """
+        {動画ID: 視聴回数} で視聴回数を更新する（同じ動画を含むすべての検索条件が対象）
+
+        checked_ids のうち view_counts にない動画（削除・非公開で API が返さなかったもの）は、視聴回数を変えずに
+        統計の更新時刻だけを進め、更新のたびに取り直さないようにする
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                'UPDATE videos SET view_count = ?, stats_updated_at = ? WHERE video_id = ?',
+                [(view_count, now, video_id) for video_id, view_count in view_counts.items()]
+            )
+            connection.executemany(
+                'UPDATE videos SET stats_updated_at = ? WHERE video_id = ?',
+                [(now, video_id) for video_id in checked_ids if video_id not in view_counts]
+            )
+
+    def videos(self, search_id):
+        """
+        保存した動画を投稿日時が新しい順に返す
+        """
+        rows = self._connect().execute(
+            f"SELECT {', '.join(VIDEO_COLUMNS)}, stats_updated_at FROM videos WHERE search_id = ? "
+            'ORDER BY published_at DESC',
+            (search_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]